@@ -8,6 +8,7 @@ from modules.curvefit import *
 from modules import errormap
 import numpy as np
 from modules.utility import print_debug
+import os
 import sys
 
 
@@ -31,7 +32,11 @@ class MainWindow(QtWidgets.QMainWindow):
         # initialize arrays and variables
         self.signal = Signal()
         self.signal_processor = SignalProcessor()
+        # long spline, rbf and auto fits go to worker processes, leaving a
+        # core to the GUI
+        self.signal_processor.set_chunk_executor(max((os.cpu_count() or 1) - 1, 0))
         self.hidden_row = 0
+        self.channel_index = 0
         self.toggle_progressBar = 0
 
         self.x_type = "No. Of Chunks"
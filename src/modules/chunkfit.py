@@ -0,0 +1,546 @@
+'''Chunk fitting routines, kept free of GUI imports so worker processes
+can load them cheaply'''
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import os
+from math import factorial
+import numpy as np
+from scipy import interpolate as interp
+from scipy import sparse
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from modules.moments import shift_matrices
+
+PARALLEL_MIN_SAMPLES = 50000
+"""Below this many samples to fit, chunks are fitted serially"""
+
+channel_pool = ThreadPoolExecutor(thread_name_prefix="channel fit")
+"""Fits the channels of multi-channel chunks side by side"""
+
+SELECTION_CRITERIA = ["aic", "bic", "loo"]
+"""Criteria auto fits choose the order or smoothing of a chunk by"""
+
+SPLINE_ENGINES = ["fitpack", "penalized"]
+"""Spline fitters: FITPACK's adaptive knots, or penalized B-splines on
+fixed knots shared by chunks of the same length"""
+
+SAMPLES_PER_KNOT = 4
+"""Knot spacing of penalized splines, in samples"""
+
+SMOOTHING_CANDIDATES = np.append(np.geomspace(1, 1e-5, 16), 0)
+"""Spline smoothing tried by auto fits, as fractions of the sum of squared
+deviations of the chunk from its mean, up to all of it so that chunks with
+more noise than signal can be smoothed down to their trend"""
+
+
+def polyval(coef, time):
+    """np.polyval that also takes one column of coefficients per channel"""
+    if np.ndim(coef) < 2:
+        return np.polyval(coef, time)
+    return np.polyval(coef, np.asarray(time)[:, np.newaxis])
+
+
+def evaluate_model(model, time):
+    """Evaluates a chunk model from fit_chunk at any times: polynomial
+    coefficients, a spline or interpolator, or a list of per-channel splines"""
+    if isinstance(model, list):
+        return np.column_stack([spl(time) for spl in model])
+    if callable(model):
+        return model(time)
+    return polyval(model, time)
+
+
+def bspline_design_matrix(x, knots, order):
+    """Sparse matrix of the B-spline basis functions at x, what
+    BSpline.design_matrix gives from scipy 1.8 on, by Cox-de Boor recursion
+    on older scipy
+    \n x = positions within [knots[order], knots[-order - 1]]"""
+    if hasattr(interp.BSpline, "design_matrix"):
+        return interp.BSpline.design_matrix(x, knots, order)
+    x = np.asarray(x, dtype=float)
+    knots = np.asarray(knots, dtype=float)
+    n_coef = len(knots) - order - 1
+    # knot interval of each position, the last one closed
+    intervals = np.clip(np.searchsorted(knots, x, side="right") - 1, order, n_coef - 1)
+    values = np.zeros((len(x), order + 1))
+    values[:, 0] = 1
+    for degree in range(1, order + 1):
+        saved = np.zeros(len(x))
+        for r in range(degree):
+            right = knots[intervals + r + 1] - x
+            left = x - knots[intervals + r + 1 - degree]
+            term = values[:, r] / (right + left)
+            values[:, r] = saved + right * term
+            saved = left * term
+        values[:, degree] = saved
+    columns = (intervals - order)[:, np.newaxis] + np.arange(order + 1)
+    return sparse.csr_matrix(
+        (values.ravel(), (np.repeat(np.arange(len(x)), order + 1), columns.ravel())),
+        shape=(len(x), n_coef))
+
+
+def fit_splines(time, magnitude, order=3, smoothing_factor=0):
+    """Fits a smoothing spline to each channel, returns a list of splines"""
+    def fit(channel):
+        return interp.UnivariateSpline(time,
+                                       channel,
+                                       k=order,
+                                       s=smoothing_factor, check_finite=False)
+    if np.ndim(magnitude) < 2:
+        return [fit(magnitude)]
+    return list(channel_pool.map(fit, np.asarray(magnitude).T))
+
+
+def is_uniform(time):
+    """Whether time is evenly sampled"""
+    steps = np.diff(time)
+    return len(steps) == 0 or np.ptp(steps) <= 1e-9 * abs(steps.mean())
+
+
+def polynomial_basis(time, max_order):
+    """Orthonormal basis of the polynomials up to max_order over time, the
+    Q of a QR factorization of the centered and scaled Vandermonde matrix"""
+    time = np.asarray(time, dtype=float)
+    center = (time[0] + time[-1]) / 2
+    half_width = (time[-1] - time[0]) / 2 or 1
+    vandermonde = np.vander((time - center) / half_width, max_order + 1,
+                            increasing=True)
+    return np.linalg.qr(vandermonde)[0]
+
+
+def get_basis(time, max_order, basis_cache=None):
+    """polynomial_basis, shared through basis_cache between evenly sampled
+    chunks of the same length"""
+    if basis_cache is None or not is_uniform(time):
+        return polynomial_basis(time, max_order)
+    key = (len(time), max_order)
+    if key not in basis_cache:
+        basis_cache[key] = polynomial_basis(time, max_order)
+    return basis_cache[key]
+
+
+def get_projection(length, order, projection_cache=None):
+    """Returns (basis, pseudo-inverse) of the polynomials up to order over
+    length evenly spaced samples, x spanning [-1, 1]. A chunk's least
+    squares coefficients are pseudo-inverse @ magnitude and its fitted
+    values basis @ coefficients, the (length, length) projection kept
+    factored.
+    \n projection_cache = optional dict keeping them by (length, order, basis)"""
+    key = (length, order, "polynomial")
+    if projection_cache is not None and key in projection_cache:
+        return projection_cache[key]
+    x = np.linspace(-1, 1, length) if length > 1 else np.zeros(1)
+    basis = np.vander(x, order + 1, increasing=True)
+    projection = (basis, np.linalg.pinv(basis))
+    if projection_cache is not None:
+        projection_cache[key] = projection
+    return projection
+
+
+def fit_uniform_polynomials(time, magnitude, order, projection_cache=None,
+                            evaluate=True):
+    """Least squares polynomials of a stack of evenly sampled chunks of the
+    same length, as matrix products over all of them at once
+    \n time = (chunks, length), magnitude = (chunks, length[, channels])
+    \n returns (fitted magnitudes or None, np.polyfit coefficients of each
+    \n chunk)"""
+    time = np.asarray(time, dtype=float)
+    magnitude = np.asarray(magnitude, dtype=float)
+    n_chunks, length = time.shape
+    basis, pseudo_inverse = get_projection(length, order, projection_cache)
+
+    # one row per chunk and channel
+    rows = np.moveaxis(magnitude, 1, -1).reshape(-1, length)
+    local = rows @ pseudo_inverse.T
+    fitted = None
+    if evaluate:
+        fitted = (local @ basis.T).reshape(
+            (n_chunks,) + magnitude.shape[2:] + (length,))
+        fitted = np.moveaxis(fitted, -1, 1)
+
+    # back to powers of time, as np.polyfit gives them
+    centers = (time[:, 0] + time[:, -1]) / 2
+    half_widths = (time[:, -1] - time[:, 0]) / 2
+    half_widths = np.where(half_widths > 0, half_widths, 1)
+    shifts = shift_matrices(-centers / half_widths, 1 / half_widths, order + 1)
+    coef = np.einsum("skj,sck->sjc", shifts,
+                     local.reshape(n_chunks, -1, order + 1))[:, ::-1]
+    return fitted, coef if magnitude.ndim > 2 else coef[..., 0]
+
+
+def get_spline_system(x, order, smoothing_factor=0, segments=None):
+    """Design matrix and banded Cholesky factor of a penalized B-spline
+    (P-spline) fit over positions x in [0, segments], knots at integers
+    \n smoothing_factor weighs the second difference penalty on the
+    \n coefficients against the fit, as a fraction of their traces
+    \n returns (sparse design matrix, upper banded factor, knots in x)"""
+    x = np.asarray(x, dtype=float)
+    knots = np.arange(-order, segments + order + 1, dtype=float)
+    design = bspline_design_matrix(np.clip(x, 0, segments), knots, order).tocsc()
+    n_coef = segments + order
+    differences = sparse.eye(n_coef, format="csr")
+    for _ in range(min(2, n_coef - 1)):
+        differences = differences[1:] - differences[:-1]
+    normal = (design.T @ design).tocsr()
+    penalty = (differences.T @ differences).tocsr()
+    scale = normal.diagonal().sum() / max(penalty.diagonal().sum(), 1)
+    # a touch of ridge keeps knots without samples solvable
+    system = (normal + (smoothing_factor * scale) * penalty
+              + (1e-10 * scale) * sparse.eye(n_coef, format="csr"))
+    width = max(order, 2)
+    bands = np.zeros((width + 1, n_coef))
+    for offset in range(min(width, n_coef - 1) + 1):
+        bands[width - offset, offset:] = system.diagonal(offset)
+    return design, cholesky_banded(bands, lower=False), knots
+
+
+def get_spline_segments(length, order):
+    """Knot intervals of a penalized spline over length samples"""
+    return int(max(1, min(length - order, -(-length // SAMPLES_PER_KNOT))))
+
+
+def fit_penalized_splines(time, magnitude, order=3, smoothing_factor=0,
+                          spline_cache=None, evaluate=True):
+    """Penalized spline fits of a stack of chunks of the same length, all
+    chunks (and channels) solved against one banded factorization
+    \n time = (chunks, length), magnitude = (chunks, length[, channels]),
+    \n chunks other than evenly sampled ones have to come one at a time
+    \n spline_cache = optional dict keeping systems of evenly sampled chunks
+    \n returns (fitted magnitudes or None, BSpline of each chunk)"""
+    time = np.asarray(time, dtype=float)
+    magnitude = np.asarray(magnitude, dtype=float)
+    n_chunks, length = time.shape
+    segments = get_spline_segments(length, order)
+    span = time[:, -1] - time[:, 0]
+    span = np.where(span > 0, span, 1)
+
+    key = (length, order, smoothing_factor, "spline")
+    if spline_cache is not None and key in spline_cache:
+        system = spline_cache[key]
+    else:
+        x = np.linspace(0, segments, length) if n_chunks > 1 or is_uniform(time[0]) \
+            else (time[0] - time[0, 0]) / span[0] * segments
+        system = get_spline_system(x, order, smoothing_factor, segments)
+        if spline_cache is not None and is_uniform(time[0]):
+            spline_cache[key] = system
+    design, factor, knots = system
+
+    # one right hand side per chunk and channel
+    rows = np.moveaxis(magnitude, 1, -1).reshape(-1, length)
+    coef = cho_solve_banded((factor, False), design.T @ rows.T, check_finite=False)
+    fitted = None
+    if evaluate:
+        fitted = (design @ coef).T.reshape((n_chunks,) + magnitude.shape[2:] + (length,))
+        fitted = np.moveaxis(fitted, -1, 1)
+
+    coef = np.moveaxis(coef.reshape(segments + order, n_chunks, -1), 1, 0)
+    if magnitude.ndim < 3:
+        coef = coef[..., 0]
+    splines = [interp.BSpline(time[chunk, 0] + knots * (span[chunk] / segments),
+                              coef[chunk], order)
+               for chunk in range(n_chunks)]
+    return fitted, splines
+
+
+def fit_continuous_polynomials(time, magnitude, starts, order=1, continuity=1,
+                               evaluate=True):
+    """Least squares piecewise polynomial of a whole signal, one polynomial
+    per chunk, joined with continuity continuous derivatives at the chunk
+    starts (0 = C0, 1 = C1). The pieces are a B-spline with the chunk starts
+    as knots of multiplicity order - continuity, so all chunks come from one
+    banded solve, linear in the number of chunks.
+    \n starts = index of the first sample of each chunk, chunks don't overlap
+    \n returns (fitted magnitude or None, np.polyfit coefficients of each
+    \n chunk)"""
+    time = np.asarray(time, dtype=float)
+    magnitude = np.asarray(magnitude, dtype=float)
+    continuity = int(np.clip(continuity, -1, order - 1))
+    # each chunk runs up to the next chunk's first sample
+    step = (time[-1] - time[0]) / max(len(time) - 1, 1) or 1
+    breaks = np.append(time[np.asarray(starts, dtype=int)], time[-1] + step)
+    knots = np.concatenate([np.full(continuity + 1, breaks[0]),
+                            np.repeat(breaks, order - continuity),
+                            np.full(continuity + 1, breaks[-1])])
+    design = bspline_design_matrix(time, knots, order).tocsc()
+    n_coef = design.shape[1]
+
+    normal = (design.T @ design).tocsr()
+    # a touch of ridge keeps chunks with too few samples solvable
+    normal = normal + (1e-12 * normal.diagonal().mean()) * sparse.eye(n_coef, format="csr")
+    bands = np.zeros((order + 1, n_coef))
+    for offset in range(min(order, n_coef - 1) + 1):
+        bands[order - offset, offset:] = normal.diagonal(offset)
+    values = magnitude.reshape(len(time), -1)
+    coef = cho_solve_banded((cholesky_banded(bands, lower=False), False),
+                            design.T @ values, check_finite=False)
+    fitted = None
+    if evaluate:
+        fitted = (design @ coef).reshape(magnitude.shape)
+
+    # Taylor coefficients at each chunk start, then powers of time
+    spline = interp.BSpline(knots, coef, order)
+    local = np.stack([spline(breaks[:-1], nu=power) / factorial(power)
+                      for power in range(order + 1)], axis=1)
+    shifts = shift_matrices(-breaks[:-1], np.ones(len(breaks) - 1), order + 1)
+    coef = np.einsum("skj,skc->sjc", shifts, local)[:, ::-1]
+    return fitted, coef if magnitude.ndim > 1 else coef[..., 0]
+
+
+def pchip_edge_slopes(h0, h1, m0, m1):
+    """One-sided three point slopes at the ends of PCHIP chunks, kept
+    shape preserving as in scipy's PchipInterpolator"""
+    slopes = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    flipped = np.sign(slopes) != np.sign(m0)
+    overshoot = (np.sign(m0) != np.sign(m1)) & (np.abs(slopes) > 3 * np.abs(m0))
+    slopes = np.where(flipped, 0, np.where(overshoot, 3 * m0, slopes))
+    return slopes
+
+
+def pchip_slopes(time, magnitude):
+    """Fritsch-Carlson derivatives at every sample of a stack of chunks
+    \n time = (chunks, length), magnitude = (chunks, length, channels)"""
+    steps = np.diff(time, axis=1)[:, :, np.newaxis]
+    secants = np.diff(magnitude, axis=1) / steps
+    slopes = np.zeros_like(magnitude)
+    if magnitude.shape[1] == 2:
+        slopes[:, 0] = slopes[:, 1] = secants[:, 0]
+        return slopes
+
+    # weighted harmonic mean of the secants, zero at extrema
+    flat = ((np.sign(secants[:, 1:]) != np.sign(secants[:, :-1]))
+            | (secants[:, 1:] == 0) | (secants[:, :-1] == 0))
+    w1 = 2 * steps[:, 1:] + steps[:, :-1]
+    w2 = steps[:, 1:] + 2 * steps[:, :-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harmonic_mean = (w1 / secants[:, :-1] + w2 / secants[:, 1:]) / (w1 + w2)
+        slopes[:, 1:-1] = np.where(flat, 0, 1 / harmonic_mean)
+    slopes[:, 0] = pchip_edge_slopes(steps[:, 0], steps[:, 1], secants[:, 0], secants[:, 1])
+    slopes[:, -1] = pchip_edge_slopes(steps[:, -1], steps[:, -2],
+                                      secants[:, -1], secants[:, -2])
+    return slopes
+
+
+def fit_pchip_stack(time, magnitude, evaluate=True):
+    """PCHIP interpolation of a stack of chunks of the same length in one
+    pass, the piecewise cubic of each chunk as a PPoly (the same one
+    scipy's PchipInterpolator builds)
+    \n time = (chunks, length), magnitude = (chunks, length[, channels])
+    \n returns (fitted magnitudes or None, PPoly of each chunk), the
+    \n interpolation passes through every sample, so the fit is the input"""
+    time = np.asarray(time, dtype=float)
+    magnitude = np.asarray(magnitude, dtype=float)
+    if time.shape[1] < 2:
+        raise Exception("PCHIP needs at least 2 samples per chunk")
+    values = magnitude.reshape(magnitude.shape[:2] + (-1,))
+    slopes = pchip_slopes(time, values)
+
+    # cubic Hermite coefficients in powers of (t - knot), highest first
+    steps = np.diff(time, axis=1)[:, :, np.newaxis]
+    secants = np.diff(values, axis=1) / steps
+    curvature = (slopes[:, :-1] + slopes[:, 1:] - 2 * secants) / steps
+    coef = np.stack([curvature / steps,
+                     (secants - slopes[:, :-1]) / steps - curvature,
+                     slopes[:, :-1], values[:, :-1]], axis=1)
+    coef = coef.reshape(coef.shape[:3] + magnitude.shape[2:])
+    models = [interp.PPoly.construct_fast(coef[chunk], time[chunk])
+              for chunk in range(len(time))]
+    return (magnitude.copy() if evaluate else None), models
+
+
+def nested_polynomial_fits(time, magnitude, max_order, basis_cache=None,
+                           basis=None):
+    """Least squares fits of every order up to max_order from a single QR
+    \n basis_cache = optional dict that shares the basis between evenly
+    \n sampled chunks of the same length
+    \n basis = the chunk's polynomial_basis, when the caller already has it
+    \n returns (max_order + 1, samples[, channels]) fitted magnitudes"""
+    if basis is None:
+        basis = get_basis(time, max_order, basis_cache)
+
+    magnitude = np.asarray(magnitude, dtype=float)
+    projections = basis.T @ magnitude
+    # order k adds the k-th basis vector to the order k-1 fit
+    if magnitude.ndim == 1:
+        terms = basis.T * projections[:, np.newaxis]
+    else:
+        terms = basis.T[:, :, np.newaxis] * projections[:, np.newaxis, :]
+    fits = np.cumsum(terms, axis=0)
+    if len(fits) < max_order + 1:
+        # short chunks: higher orders interpolate every sample already
+        fits = np.concatenate(
+            [fits, np.repeat(fits[-1:], max_order + 1 - len(fits), axis=0)])
+    return fits
+
+
+def basis_coefficients(time, basis, fitted, order):
+    """np.polyfit coefficients of a fit of the given order, spanned by the
+    first order + 1 vectors of the polynomial_basis of time. The triangular
+    factor comes back from the basis, nothing is refactorized."""
+    time = np.asarray(time, dtype=float)
+    center = (time[0] + time[-1]) / 2
+    half_width = (time[-1] - time[0]) / 2 or 1
+    basis = basis[:, :order + 1]
+    vandermonde = np.vander((time - center) / half_width, order + 1,
+                            increasing=True)
+    local = np.linalg.lstsq(basis.T @ vandermonde, basis.T @ fitted, rcond=None)[0]
+    shifts = shift_matrices([-center / half_width], [1 / half_width], order + 1)[0]
+    return (shifts.T @ local)[::-1]
+
+
+def selection_scores(rss, dof, n, criterion="bic", press=None):
+    """Scores of candidate fits, the lowest is the best
+    \n rss, dof = residual sum of squares and parameters of each candidate
+    \n n = fitted values, press = leave-one-out residual sums if known,
+    \n generalized cross validation stands in for them otherwise"""
+    rss = np.asarray(rss, dtype=float)
+    dof = np.asarray(dof, dtype=float)
+    # exact fits would score -inf
+    rss = np.maximum(rss, 1e-12 * max(rss.max(), 1e-300))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if criterion == "aic":
+            # corrected for small chunks
+            scores = (n * np.log(rss / n) + 2 * dof
+                      + 2 * dof * (dof + 1) / (n - dof - 1))
+        elif criterion == "bic":
+            scores = n * np.log(rss / n) + dof * np.log(n)
+        elif criterion == "loo":
+            scores = (np.asarray(press, dtype=float) if press is not None
+                      else n * rss / (n - dof) ** 2)
+        else:
+            raise Exception(
+                "Criterion must be " + ", ".join(SELECTION_CRITERIA))
+    # nearly saturated candidates leave too little residual to judge them by
+    scores = np.where(dof <= n / 2, scores, np.inf)
+    return np.nan_to_num(scores, nan=np.inf)
+
+
+def select_polynomial_fit(time, magnitude, max_order, criterion="bic"):
+    """Best polynomial fit of order up to max_order, all orders are scored
+    from one QR. Channels share the order.
+    \n returns (fitted magnitude, coefficients, model)"""
+    magnitude = np.asarray(magnitude, dtype=float)
+    max_order = max(min(max_order, len(time) - 1), 0)
+    basis = get_basis(time, max_order)
+    fits = nested_polynomial_fits(time, magnitude, max_order, basis=basis)
+
+    residuals = magnitude[np.newaxis] - fits
+    axes = tuple(range(1, residuals.ndim))
+    channels = residuals[0].size // len(time)
+    rss = np.sum(residuals ** 2, axis=axes)
+    dof = np.arange(1, max_order + 2) * channels
+
+    press = None
+    if criterion == "loo":
+        # leave-one-out residuals from the leverages of each nested fit
+        leverage = np.cumsum(basis.T ** 2, axis=0)
+        if residuals.ndim > 2:
+            leverage = leverage[:, :, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            press = np.sum((residuals / (1 - leverage)) ** 2, axis=axes)
+
+    order = int(np.argmin(selection_scores(
+        rss, dof, residuals[0].size, criterion, press)))
+    coef = basis_coefficients(time, basis, fits[order], order)
+    return fits[order], coef, coef
+
+
+def select_spline_fit(time, magnitude, order=3, criterion="bic"):
+    """Best smoothing spline of each channel out of SMOOTHING_CANDIDATES
+    \n returns (fitted magnitude, coefficients, model)"""
+    def select(channel):
+        deviation = np.sum((channel - np.mean(channel)) ** 2)
+        splines = [interp.UnivariateSpline(time, channel, k=order,
+                                           s=fraction * deviation,
+                                           check_finite=False)
+                   for fraction in SMOOTHING_CANDIDATES]
+        scores = selection_scores([spl.get_residual() for spl in splines],
+                                  [len(spl.get_coeffs()) for spl in splines],
+                                  len(time), criterion)
+        return splines[int(np.argmin(scores))]
+
+    if np.ndim(magnitude) < 2:
+        spline = select(magnitude)
+        return spline(time), spline.get_coeffs(), spline
+    splines = list(channel_pool.map(select, np.asarray(magnitude).T))
+    return (np.column_stack([spl(time) for spl in splines]),
+            [spl.get_coeffs() for spl in splines], splines)
+
+
+def fit_chunk(type, time, magnitude, order=1, smoothing_factor=0, criterion=None,
+              evaluate=True):
+    """Fits a single chunk, returns (fitted magnitude, coefficients, model),
+    the model evaluates the fit anywhere through evaluate_model
+    \n criterion = aic, bic or loo picks the polynomial order (up to order)
+    \n or the spline smoothing of the chunk instead
+    \n evaluate = False skips evaluating the fit, the magnitude is None"""
+    coef = []
+    if criterion is not None and type == "polynomial":
+        return select_polynomial_fit(time, magnitude, order, criterion)
+    if criterion is not None and type == "spline":
+        return select_spline_fit(time, magnitude, order, criterion)
+
+    # processing interpolation
+    if type == "polynomial":
+        # one least squares solve shared by all channels
+        coef = np.polyfit(time, magnitude, order)
+        model = coef
+
+    elif type == "spline":
+        splines = fit_splines(time, magnitude, order, smoothing_factor)
+        if np.ndim(magnitude) < 2:
+            model = splines[0]
+            coef = model.get_coeffs()
+        else:
+            model = splines
+            coef = [spl.get_coeffs() for spl in splines]
+
+    elif type == "hermite":
+        model = interp.PchipInterpolator(time, magnitude, axis=0)
+    else:
+        raise Exception(
+            "Interpolation type must be polynomial , spline or rbf")
+    if not evaluate:
+        return None, coef, model
+    return evaluate_model(model, time), coef, model
+
+
+def fit_shared_chunk(handle, start, stop, type, order=1, smoothing_factor=0,
+                     criterion=None, evaluate=True):
+    """Fits samples [start, stop) of a signal published in a shared store"""
+    from modules.sharedstore import attach_signal
+    signal = attach_signal(handle)
+    return fit_chunk(type, signal.time[start:stop], signal.magnitude[start:stop],
+                     order, smoothing_factor, criterion, evaluate)
+
+
+class ChunkExecutor():
+    """Pool of workers that fits chunks, results come back in chunk order"""
+
+    def __init__(self, max_workers: int = None, processes: bool = True,
+                 min_samples: int = PARALLEL_MIN_SAMPLES) -> None:
+        self.processes = processes
+        self.min_samples = min_samples
+        self.max_workers = max_workers or os.cpu_count() or 1
+        if processes:
+            # forking would copy the Qt state and half-dead thread pools
+            self.pool = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.pool = ThreadPoolExecutor(
+                max_workers, thread_name_prefix="chunk fit")
+
+    def worth_parallel(self, n_tasks, n_samples=None):
+        """Whether n_tasks fitting n_samples in total pay for the workers"""
+        return n_tasks > 1 and (n_samples is None or n_samples >= self.min_samples)
+
+    def map(self, function, *iterables, n_samples=None):
+        """Maps function over the tasks, serially when there is too little
+        work (n_samples) to pay for the workers"""
+        tasks = list(zip(*iterables))
+        if not self.worth_parallel(len(tasks), n_samples):
+            return [function(*task) for task in tasks]
+        # a few batches per worker amortizes pickling in process pools
+        chunksize = max(len(tasks) // (4 * self.max_workers), 1)
+        return list(self.pool.map(function, *zip(*tasks), chunksize=chunksize))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,435 @@
+'''Compression of records by piecewise polynomials: error-bounded lossy
+codes of quantized polynomials, and lossless codes of integer samples from
+their polynomial residuals. Any range of samples decodes without decoding
+the rest'''
+import struct
+import time as timer
+import zlib
+import numpy as np
+from modules.chunkfit import ChunkExecutor
+from modules.modelstore import cumulative_offsets
+from modules.moments import MomentTable
+from modules.utility import print_debug
+
+BLOCK_SAMPLES = 1 << 20
+"""Samples encoded together, segments never cross blocks"""
+
+INITIAL_LENGTH = 4096
+"""Segment length the refinement of each block starts from"""
+
+HEADER_BYTES = 64
+"""Size counted for the scalars of a compressed record"""
+
+WFDB_SAMPLE_BYTES = {"8": 1, "16": 2, "24": 3, "32": 4, "61": 2, "80": 1,
+                     "160": 2, "212": 1.5, "310": 4 / 3, "311": 4 / 3}
+"""Bytes a sample takes in each WFDB storage format, the size compressed
+records are compared against"""
+
+
+def integer_type(values):
+    """Smallest integer dtype holding all values"""
+    if len(values) == 0:
+        return np.dtype(np.int8)
+    low, high = int(values.min()), int(values.max())
+    if low < 0:
+        # the signed type of the same width, int16 and uint16 would give int32
+        high = -max(high, 0) - 1
+    return np.result_type(np.min_scalar_type(low), np.min_scalar_type(high))
+
+
+def evaluate_segments(indices, first, last, coefficients):
+    """Evaluates the polynomials of segments at sample indices
+    \n first, last = first and last sample of each index's segment
+    \n coefficients = (indices, order + 1, channels) in increasing powers of
+    \n x, x spans [-1, 1] over the segment"""
+    indices, first, last = (np.asarray(values, dtype=float)
+                            for values in (indices, first, last))
+    half_widths = (last - first) / 2
+    half_widths = np.where(half_widths > 0, half_widths, 1)
+    x = ((indices - (first + last) / 2) / half_widths)[:, np.newaxis]
+    values = coefficients[:, -1]
+    for power in range(coefficients.shape[1] - 2, -1, -1):
+        values = values * x + coefficients[:, power]
+    return values
+
+
+def segment_max_errors(moments, starts, stops, coefficients):
+    """Largest absolute error of each segment [start, stop) of a
+    MomentTable, for the given polynomial coefficients"""
+    lengths = stops - starts
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    segments = np.repeat(np.arange(len(starts)), lengths)
+    indices = starts[segments] + np.arange(lengths.sum()) - offsets[segments]
+    fitted = evaluate_segments(moments.time[indices], moments.time[starts[segments]],
+                               moments.time[stops[segments] - 1], coefficients[segments])
+    errors = np.abs(fitted - moments.magnitude[indices]).max(axis=1)
+    return np.maximum.reduceat(errors, offsets)
+
+
+class CompressedSignal():
+    """Quantized piecewise polynomial of a uniformly sampled record
+    \n lengths = samples in each segment
+    \n coefficients = integer coefficients (segments, order + 1, channels) in
+    \n increasing powers of x, x spans [-1, 1] over the segment, in units of
+    \n step
+    \n channels = channels of multi-channel records, 0 for single channel
+    \n sample_bytes = size of a sample in the source record"""
+
+    def __init__(self, lengths, coefficients, step, fsample=1, start_time=0,
+                 channels: int = 0, sample_bytes: float = 8) -> None:
+        self.lengths = np.asarray(lengths)
+        self.coefficients = np.asarray(coefficients)
+        self.step = step
+        self.fsample = fsample
+        self.start_time = start_time
+        self.channels = channels
+        self.sample_bytes = sample_bytes
+        self.starts = np.concatenate([[0], np.cumsum(self.lengths, dtype=np.int64)])
+        """First sample of each segment, then the sample count"""
+        self.encode_seconds = 0
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    @property
+    def nbytes(self):
+        return self.lengths.nbytes + self.coefficients.nbytes + HEADER_BYTES
+
+    @property
+    def source_bytes(self):
+        return len(self) * max(self.channels, 1) * self.sample_bytes
+
+    def get_compression_ratio(self):
+        return self.source_bytes / self.nbytes
+
+    def decode(self, start: int = 0, stop: int = None):
+        """Returns samples [start, stop) of the record"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(start, 0)
+        values = np.empty((max(stop - start, 0), max(self.channels, 1)))
+        for block in range(start, stop, BLOCK_SAMPLES):
+            indices = np.arange(block, min(block + BLOCK_SAMPLES, stop))
+            segments = np.searchsorted(self.starts, indices, side="right") - 1
+            values[block - start:block - start + len(indices)] = evaluate_segments(
+                indices, self.starts[segments], self.starts[segments + 1] - 1,
+                self.coefficients[segments] * self.step)
+        return values if self.channels else values[:, 0]
+
+    def decode_time_range(self, start_time, stop_time):
+        """Returns (time, magnitude) of the samples from start_time up to
+        stop_time"""
+        # slack for sample times that are not exact in floating point
+        start = int(np.ceil((start_time - self.start_time) * self.fsample - 1e-6))
+        stop = int(np.floor((stop_time - self.start_time) * self.fsample + 1e-6)) + 1
+        magnitude = self.decode(start, stop)
+        start = min(max(start, 0), len(self))
+        return self.start_time + np.arange(start, start + len(magnitude)) / self.fsample, magnitude
+
+    def get_report(self):
+        """Returns compression ratio, size in bytes, and encode and decode
+        throughput of the record in MB/s"""
+        started = timer.perf_counter()
+        self.decode()
+        decode_seconds = timer.perf_counter() - started
+        megabytes = self.source_bytes / 1e6
+        return {"compression_ratio": self.get_compression_ratio(),
+                "bytes": self.nbytes,
+                "segments": len(self.lengths),
+                "encode_mb_s": megabytes / max(self.encode_seconds, 1e-12),
+                "decode_mb_s": megabytes / max(decode_seconds, 1e-12)}
+
+    def save(self, path):
+        np.savez(path, lengths=self.lengths, coefficients=self.coefficients,
+                 scalars=np.array([self.step, self.fsample, self.start_time,
+                                   self.channels, self.source_bytes], dtype=float),
+                 sample_bytes=self.sample_bytes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            step, fsample, start_time, channels, source_bytes = stored["scalars"]
+            lengths = stored["lengths"]
+            if "sample_bytes" in stored:
+                sample_bytes = float(stored["sample_bytes"])
+            else:
+                sample_bytes = source_bytes / max(np.sum(lengths) * max(channels, 1), 1)
+            return cls(lengths, stored["coefficients"], step, fsample,
+                       start_time, int(channels), sample_bytes)
+
+
+def encode_block(moments, order, tolerance, step):
+    """Segments of one block whose quantized polynomials stay within
+    tolerance of every sample, as (lengths, integer coefficients)"""
+    n = len(moments)
+    starts = np.arange(0, n, INITIAL_LENGTH)
+    stops = np.append(starts[1:], n)
+    done_starts, done_coefficients = [], []
+    while len(starts):
+        coefficients = np.round(moments.fit_segments(starts, stops, order)[0] / step)
+        errors = segment_max_errors(moments, starts, stops, coefficients * step)
+        # segments of order + 1 samples or less interpolate up to quantization
+        done = (errors <= tolerance) | (stops - starts <= order + 1)
+        done_starts.append(starts[done])
+        done_coefficients.append(coefficients[done])
+
+        # halving keeps refinement at two fits per split, the error bound
+        # rather than the squared error decides the segments anyway
+        starts, stops = starts[~done], stops[~done]
+        splits = (starts + stops) // 2
+        starts, stops = np.concatenate([starts, splits]), np.concatenate([splits, stops])
+
+    starts = np.concatenate(done_starts)
+    by_start = np.argsort(starts)
+    return (np.diff(np.append(starts[by_start], n)),
+            np.concatenate(done_coefficients)[by_start])
+
+
+def default_sample_bytes(magnitude):
+    """Size samples are counted at when the source record's is not given:
+    the smallest integer type holding integer samples, as WFDB hands 16 bit
+    samples over as int64, or the size of float ones"""
+    magnitude = np.asarray(magnitude)
+    if np.issubdtype(magnitude.dtype, np.integer):
+        return integer_type(magnitude.ravel()).itemsize
+    return magnitude.dtype.itemsize
+
+
+def compress_signal(signal, tolerance, order: int = 3, sample_bytes: float = None):
+    """Encodes a uniformly sampled Signal so that no decoded sample is
+    further than tolerance from the original
+    \n segments of the record are halved until the least squares polynomial
+    \n of each one, with coefficients rounded to a step of
+    \n tolerance / (order + 1), is within tolerance of all its samples
+    \n sample_bytes = size of a sample in the source record the compression
+    \n ratio is reported against, such as WFDB_SAMPLE_BYTES[record.fmt[0]]
+    \n for the physical signal of a WFDB record, by default the smallest
+    \n integer type holding integer samples, or the size of float ones"""
+    if tolerance <= 0:
+        raise Exception("Tolerance must be positive")
+    started = timer.perf_counter()
+    magnitude = signal.magnitude
+    n = len(magnitude)
+    # rounding each coefficient moves a sample by at most half the step
+    step = tolerance / (order + 1)
+
+    # an empty record is a single empty block
+    lengths = [np.zeros(0, dtype=np.int64)]
+    coefficients = [np.zeros((0, order + 1, int(np.prod(np.shape(magnitude)[1:]))))]
+    for start in range(0, n, BLOCK_SAMPLES):
+        stop = min(start + BLOCK_SAMPLES, n)
+        moments = MomentTable(np.arange(start, stop, dtype=float),
+                              magnitude[start:stop], order)
+        block_lengths, block_coefficients = encode_block(moments, order, tolerance, step)
+        lengths.append(block_lengths)
+        coefficients.append(block_coefficients)
+    lengths = np.concatenate(lengths)
+    coefficients = np.concatenate(coefficients)
+
+    compressed = CompressedSignal(
+        lengths.astype(integer_type(lengths)),
+        coefficients.astype(integer_type(coefficients.ravel())), step,
+        signal.fsample if signal.fsample else 1,
+        signal.time[0] if len(signal.time) else 0,
+        signal.get_channel_count() if np.ndim(magnitude) > 1 else 0,
+        default_sample_bytes(magnitude) if sample_bytes is None else sample_bytes)
+    compressed.encode_seconds = timer.perf_counter() - started
+    print_debug("Compressed " + str(n) + " samples into " + str(len(lengths)) +
+                " segments, ratio " + str(round(compressed.get_compression_ratio(), 2)))
+    return compressed
+
+
+LOSSLESS_BLOCK_SAMPLES = 16384
+"""Samples per independently decodable block of lossless records"""
+
+DIFFERENCE_ORDERS = 3
+"""Orders of differencing tried on the residuals of each block"""
+
+PREDICTION_MIN, PREDICTION_MAX = -2.0 ** 63, 2.0 ** 63 - 1024
+"""Range of floats that cast to int64"""
+
+BLOCK_HEADER = struct.Struct("<IBBB")
+"""Samples, polynomial order, difference order and bit width of a block"""
+
+block_executor = ChunkExecutor(processes=False, min_samples=4 * LOSSLESS_BLOCK_SAMPLES)
+"""zlib and numpy release the GIL, so threads encode blocks in parallel"""
+
+
+def zigzag(values):
+    """Maps signed integers to unsigned ones, small magnitudes first"""
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def pack_bits(values, width):
+    """Packs unsigned integers into width bits each"""
+    if width == 0:
+        return b""
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    return np.packbits(((values[:, np.newaxis] >> shifts) & np.uint64(1)).astype(np.uint8)).tobytes()
+
+
+def unpack_bits(data, n, width):
+    if width == 0:
+        return np.zeros(n, dtype=np.uint64)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=n * width)
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    return np.sum(bits.reshape(n, width).astype(np.uint64) << shifts, axis=1, dtype=np.uint64)
+
+
+def predict_block(coefficients, n):
+    """Integer prediction of a block from its polynomial, in a fixed order
+    of float operations so the decoder reproduces it exactly"""
+    x = np.arange(n, dtype=float)
+    if n > 1:
+        x = (x - (n - 1) / 2) / ((n - 1) / 2)
+    prediction = np.full(n, coefficients[-1])
+    for power in range(len(coefficients) - 2, -1, -1):
+        prediction = prediction * x + coefficients[power]
+    # casting floats outside int64 is undefined, residuals wrap around anyway
+    np.clip(prediction, PREDICTION_MIN, PREDICTION_MAX, out=prediction)
+    return np.rint(prediction).astype(np.int64)
+
+
+def encode_lossless_block(samples, order, level):
+    """Encodes one block of integer samples as bytes: BLOCK_HEADER, the
+    polynomial coefficients, then the zlib compressed residuals"""
+    samples = np.asarray(samples, dtype=np.int64)
+    n = len(samples)
+    order = min(order, n - 1)
+    x = np.linspace(-1, 1, n) if n > 1 else np.zeros(1)
+    coefficients = np.polynomial.polynomial.polyfit(x, samples, order)
+    residuals = samples - predict_block(coefficients, n)
+
+    # differencing picks up what the block polynomial leaves
+    candidates = [residuals]
+    for difference in range(1, DIFFERENCE_ORDERS):
+        candidates.append(np.diff(candidates[-1], prepend=0))
+    difference = int(np.argmin([np.abs(values).sum() for values in candidates]))
+    values = zigzag(candidates[difference])
+    width = int(values.max()).bit_length() if n else 0
+
+    return (BLOCK_HEADER.pack(n, order, difference, width) + coefficients.tobytes()
+            + zlib.compress(pack_bits(values, width), level))
+
+
+def decode_lossless_block(data):
+    n, order, difference, width = BLOCK_HEADER.unpack_from(data)
+    offset = BLOCK_HEADER.size + 8 * (order + 1)
+    coefficients = np.frombuffer(data[BLOCK_HEADER.size:offset], dtype=float)
+    values = unzigzag(unpack_bits(zlib.decompress(data[offset:]), n, width))
+    for _ in range(difference):
+        values = np.cumsum(values)
+    return values + predict_block(coefficients, n)
+
+
+class LosslessSignal():
+    """Integer record encoded block by block, every block decodes on its
+    own so any range decodes without the rest
+    \n data = encoded blocks end to end, block (b, channel) is number
+    \n b * channels + channel, offsets mark where each one starts
+    \n sample_bytes = size of a sample in the source record, dtype's by default"""
+
+    def __init__(self, data, offsets, n, dtype, channels: int = 0,
+                 block_samples: int = LOSSLESS_BLOCK_SAMPLES, sample_bytes: float = None) -> None:
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.block_samples = block_samples
+        self.sample_bytes = self.dtype.itemsize if sample_bytes is None else sample_bytes
+        self.encode_seconds = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.nbytes + HEADER_BYTES
+
+    @property
+    def source_bytes(self):
+        return self.n * max(self.channels, 1) * self.sample_bytes
+
+    def get_compression_ratio(self):
+        return self.source_bytes / self.nbytes
+
+    def get_block(self, index):
+        return decode_lossless_block(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+    def decode(self, start: int = 0, stop: int = None):
+        """Returns samples [start, stop), exactly as they were encoded"""
+        stop = self.n if stop is None else min(stop, self.n)
+        start = max(start, 0)
+        channels = max(self.channels, 1)
+        first, last = start // self.block_samples, -(-stop // self.block_samples)
+        blocks = [(block * channels + channel) for block in range(first, last)
+                  for channel in range(channels)]
+        decoded = block_executor.map(self.get_block, blocks,
+                                     n_samples=len(blocks) * self.block_samples)
+        values = np.empty((max(last - first, 0) * self.block_samples, channels), dtype=self.dtype)
+        for index, block in enumerate(decoded):
+            row = (index // channels) * self.block_samples
+            values[row:row + len(block), index % channels] = block
+        values = values[start - first * self.block_samples:stop - first * self.block_samples]
+        return values if self.channels else values[:, 0]
+
+    def get_report(self):
+        """Returns compression ratio, size in bytes, and encode and decode
+        throughput of the record in MB/s"""
+        started = timer.perf_counter()
+        self.decode()
+        decode_seconds = timer.perf_counter() - started
+        megabytes = self.source_bytes / 1e6
+        return {"compression_ratio": self.get_compression_ratio(),
+                "bytes": self.nbytes,
+                "blocks": len(self.offsets) - 1,
+                "encode_mb_s": megabytes / max(self.encode_seconds, 1e-12),
+                "decode_mb_s": megabytes / max(decode_seconds, 1e-12)}
+
+    def save(self, path):
+        np.savez(path, data=np.frombuffer(self.data, dtype=np.uint8), offsets=self.offsets,
+                 scalars=np.array([self.n, self.channels, self.block_samples]),
+                 dtype=self.dtype.str, sample_bytes=self.sample_bytes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            n, channels, block_samples = (int(value) for value in stored["scalars"])
+            sample_bytes = float(stored["sample_bytes"]) if "sample_bytes" in stored else None
+            return cls(stored["data"].tobytes(), stored["offsets"], n,
+                       str(stored["dtype"]), channels, block_samples, sample_bytes)
+
+
+def compress_lossless(magnitude, order: int = 2, level: int = 6,
+                      block_samples: int = LOSSLESS_BLOCK_SAMPLES, sample_bytes: float = None):
+    """Encodes integer samples (such as the digital samples of a WFDB
+    record) without loss: each block is predicted by its least squares
+    polynomial and the zig-zagged residuals are bit-packed and zlib
+    compressed at the given level
+    \n sample_bytes = size of a sample in the source record the compression
+    \n ratio is reported against, such as WFDB_SAMPLE_BYTES[record.fmt[0]],
+    \n see default_sample_bytes otherwise"""
+    started = timer.perf_counter()
+    magnitude = np.asarray(magnitude)
+    if not np.issubdtype(magnitude.dtype, np.integer):
+        raise Exception("Lossless compression needs integer samples")
+    columns = magnitude.reshape(len(magnitude), int(np.prod(magnitude.shape[1:])))
+    blocks = [columns[start:start + block_samples, channel]
+              for start in range(0, len(columns), block_samples)
+              for channel in range(columns.shape[1])]
+    encoded = block_executor.map(encode_lossless_block, blocks,
+                                 [order] * len(blocks), [level] * len(blocks),
+                                 n_samples=columns.size)
+
+    compressed = LosslessSignal(
+        b"".join(encoded), cumulative_offsets(encoded), len(magnitude), magnitude.dtype,
+        columns.shape[1] if magnitude.ndim > 1 else 0, block_samples,
+        default_sample_bytes(magnitude) if sample_bytes is None else sample_bytes)
+    compressed.encode_seconds = timer.perf_counter() - started
+    print_debug("Lossless compressed " + str(len(magnitude)) + " samples, ratio " +
+                str(round(compressed.get_compression_ratio(), 2)))
+    return compressed
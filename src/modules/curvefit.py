@@ -3,9 +3,21 @@ from modules.utility import print_debug
 import numpy as np
 from copy import copy
 import sympy
-from scipy import interpolate as interp
 from modules.signals import Signal, ChunkedSignal
-
+from modules.chunkfit import (ChunkExecutor, PARALLEL_MIN_SAMPLES, evaluate_model,
+                              fit_chunk, fit_shared_chunk, fit_uniform_polynomials,
+                              fit_penalized_splines, fit_pchip_stack, is_uniform,
+                              fit_continuous_polynomials, SPLINE_ENGINES)
+from modules.sharedstore import SharedSignalStore, shared_memory_available
+from modules.metrics import (BLOCK_SIZE, residual_metrics, residual_sums,
+                             combine_sums, metrics_from_sums)
+from modules.segmentation import adaptive_chunk_starts
+from modules.moments import MomentTable
+from modules.piecewise import PiecewiseModel
+from modules.modelstore import PiecewiseStore
+from modules.sliding import get_window_length, sliding_polynomial_fit
+
+import pyqtgraph as pg
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as Canvas
 
@@ -29,12 +41,64 @@ class SignalProcessor():
 
         self.extrapolation_type = None
 
+        self.chunk_executor = None
+        """Optional pool that fits spline and hermite chunks in parallel"""
+        self.shared_store = None
+        """Original signal published for worker processes, made on demand"""
+
+        self.auto_fit = None
+        """Criterion (aic, bic or loo) that picks the order or smoothing of
+        each chunk, None fits every chunk with the same settings"""
+
+        self.adaptive_chunks = False
+        """Places the chunk boundaries where the fit error is largest"""
+        self.chunk_tolerance = 0
+        """RMSE below which adaptive chunks are not split further"""
+        self.moment_table = None
+        """Moment table of the original signal, clipped signals are its
+        first samples so it outlives clipping"""
+
+        self.lazy_evaluation = False
+        """Keeps the interpolation as a PiecewiseModel, evaluated only where
+        it is read, see materialize()"""
+
+        self.spline_engine = "fitpack"
+        """Spline fitter, see chunkfit.SPLINE_ENGINES"""
+        self.spline_cache = {}
+        """Penalized spline systems of evenly sampled chunks by length, order
+        and smoothing"""
+
+        self.continuity = None
+        """Derivatives kept continuous across polynomial chunk boundaries
+        (0 = C0, 1 = C1) by fitting all chunks jointly without overlap, None
+        fits the chunks separately and averages their overlaps"""
+
+        self.projection_cache = {}
+        """Projections of evenly sampled polynomial chunks by length and
+        order, kept across refits that leave both alone"""
+
+        self.incremental_refit = False
+        self.fit_cache = {}
+        """Fitted chunks and merged chunks of the last refit, keyed by their
+        sample range and fit parameters"""
+
         self.interpolated_signal = copy(original)
         self.extrapolated_signal = copy(original)
 
+        self.error_metrics = None
+        self.error_metrics_source = None
+        """Interpolated signal the cached error metrics belong to"""
+        self.merged_keys = []
+        """Merged chunk keys of the last chunked interpolation, see interpolate"""
+        self.error_cache = {}
+        """Residual sums of the merged chunks of a lazy interpolation, by
+        merged chunk key, kept across refits"""
+
     def init_interpolation(self, type: str = None, order: int = 1, N_chunks: int = 1,
-                           overlap_percent: int = 0, smoothing_factor=0, kernel="thin_plate_spline"):
+                           overlap_percent: int = 0, smoothing_factor=0, kernel="thin_plate_spline",
+                           auto_fit: str = None):
         self.interpolation_type = type
+        self.auto_fit = auto_fit
         self.interpolation_order = order
         self.smoothing_factor = smoothing_factor/100
         self.kernel = kernel
@@ -52,79 +116,409 @@ class SignalProcessor():
         self.interpolate()
 
     def interpolate(self):
-        type = self.interpolation_type
-
+        if self.interpolation_type == "savgol":
+            return self.interpolate_sliding()
+        if self.is_continuous():
+            return self.interpolate_continuous()
         self.clipped_signal = ChunkedSignal(
-            self.clipped_signal, self.max_chunks, self.overlap_percent)
+            self.clipped_signal, self.max_chunks, self.overlap_percent,
+            self.get_chunk_length(), self.get_chunk_starts())
         self.interpolated_signal = copy(self.clipped_signal)
+        self.interpolated_signal.chunk_array = list(
+            self.clipped_signal.chunk_array)
 
+        fit_cache = {}
+        chunk_keys = []
+        dirty_chunks = []
         for chunk_index in range(len(self.clipped_signal.chunk_array)):
             input = self.clipped_signal.get_chunk(chunk_index)
-            coef = []
-            # processing interpolation
-            if type == "polynomial":
-                coef = np.polyfit(input.time,
-                                  input.magnitude,
-                                  self.interpolation_order)
-                magnitude = np.polyval(coef, input.time)
-
-            elif type == "spline":
-                spl = interp.UnivariateSpline(input.time,
-                                              input.magnitude,
-                                              k=self.interpolation_order,
-                                              s=self.smoothing_factor, check_finite=False)
-                magnitude = spl(input.time)
-                coef = spl.get_coeffs()
-
-            elif type == "hermite":
-                hermite = interp.PchipInterpolator(
-                    input.time, input.magnitude, axis=0)
-                magnitude = hermite(input.time)
+            start = self.clipped_signal.chunk_starts[chunk_index]
+            key = (self.interpolation_type, self.interpolation_order,
+                   self.smoothing_factor, start, start + len(input), self.auto_fit,
+                   self.spline_engine)
+            chunk_keys.append(key)
+
+            if self.incremental_refit and key in self.fit_cache:
+                fit_cache[key] = self.fit_cache[key]
+                self.interpolated_signal.chunk_array[chunk_index] = fit_cache[key]
             else:
-                raise Exception(
-                    "Interpolation type must be polynomial , spline or rbf")
-                return
-            # output
-            self.interpolated_signal.set_chunk(chunk_index, Signal(
-                magnitude=magnitude, fsample=input.fsample, coef=coef, time=input.time))
+                dirty_chunks.append(chunk_index)
+
+        outputs = self.fit_chunks(
+            [self.clipped_signal.get_chunk(index) for index in dirty_chunks],
+            [chunk_keys[index][3] for index in dirty_chunks],
+            evaluate=not self.lazy_evaluation)
+        for chunk_index, output in zip(dirty_chunks, outputs):
+            fit_cache[chunk_keys[chunk_index]] = output
+            self.interpolated_signal.chunk_array[chunk_index] = output
+
+        # a merged chunk only depends on itself and its left neighbour
+        merged_keys = [("merged", self.clipped_signal.get_chunk_range(chunk_index),
+                        self.clipped_signal.get_left_overlap_length(chunk_index),
+                        key, chunk_keys[chunk_index - 1] if chunk_index else None)
+                       for chunk_index, key in enumerate(chunk_keys)]
+        self.merged_keys = merged_keys
+
+        if self.lazy_evaluation:
+            self.interpolated_signal.magnitude = PiecewiseModel(
+                self.clipped_signal.time, self.get_model_store(),
+                np.shape(self.clipped_signal.magnitude)[1:])
+            if self.incremental_refit:
+                self.fit_cache = fit_cache
+            return
+
+        merged_chunks = [self.fit_cache.get(merged_key) if self.incremental_refit else None
+                         for merged_key in merged_keys]
+
+        merged_chunks = self.interpolated_signal.merge_chunks(merged_chunks)
+
+        if self.incremental_refit:
+            fit_cache.update(zip(merged_keys, merged_chunks))
+            self.fit_cache = fit_cache
+
+    def interpolate_sliding(self):
+        """Savitzky-Golay interpolation, every sample takes the polynomial
+        fitted to the window centered on it, a window as long as one of
+        max_chunks chunks. The signal is kept as one chunk whose model is
+        the polynomial of the last window, for extrapolation."""
+        self.clipped_signal = ChunkedSignal(self.clipped_signal, 1)
+        self.merged_keys = []
+        time = np.asarray(self.clipped_signal.time)
+        magnitude = np.asarray(self.clipped_signal.magnitude, dtype=float)
+        if not is_uniform(time):
+            raise Exception("Savitzky-Golay interpolation needs an evenly sampled signal")
+        window = get_window_length(len(time), self.max_chunks, self.interpolation_order)
+        fitted = sliding_polynomial_fit(magnitude, window, self.interpolation_order)
+        coef = fit_uniform_polynomials(
+            time[np.newaxis, -window:], magnitude[np.newaxis, -window:],
+            self.interpolation_order, self.projection_cache, evaluate=False)[1][0]
+
+        self.interpolated_signal = copy(self.clipped_signal)
+        self.interpolated_signal.magnitude = fitted
+        self.interpolated_signal.chunk_array = [Signal(
+            magnitude=fitted, fsample=self.clipped_signal.fsample, coef=coef,
+            time=time, model=coef)]
+
+    def interpolate_continuous(self):
+        """Fits every polynomial chunk at once, joined with continuity
+        continuous derivatives at the chunk boundaries. Chunks don't overlap
+        and there is nothing to merge or refit incrementally."""
+        self.clipped_signal = ChunkedSignal(
+            self.clipped_signal, self.max_chunks, 0,
+            self.get_chunk_length(), self.get_chunk_starts())
+        clipped = self.clipped_signal
+        self.merged_keys = []
+        fitted, coef = fit_continuous_polynomials(
+            clipped.time, clipped.magnitude, clipped.chunk_starts,
+            self.interpolation_order, self.continuity)
+
+        self.interpolated_signal = copy(clipped)
+        self.interpolated_signal.chunk_array = []
+        for chunk_index, chunk in enumerate(clipped.chunk_array):
+            start, stop = clipped.get_chunk_range(chunk_index)
+            self.interpolated_signal.chunk_array.append(Signal(
+                magnitude=fitted[start:stop] if not self.lazy_evaluation else [],
+                fsample=chunk.fsample, coef=coef[chunk_index], time=chunk.time,
+                model=coef[chunk_index]))
+        if self.lazy_evaluation:
+            # the solve evaluates the whole fit anyway, score it while at hand
+            self.error_metrics = residual_metrics(
+                clipped.magnitude, fitted, clipped.chunk_starts)
+            self.error_metrics_source = self.interpolated_signal
+            fitted = PiecewiseModel(clipped.time, self.get_model_store(),
+                                    np.shape(clipped.magnitude)[1:])
+        self.interpolated_signal.magnitude = fitted
+
+    def fit_chunks(self, inputs, starts=None, evaluate=True):
+        """Fits a list of chunks, returns the fitted chunk signals in order
+        \n starts = index of each chunk in the original signal, lets worker
+        \n processes read the chunks from the shared store
+        \n evaluate = False leaves the chunk magnitudes empty, only the
+        \n models are kept"""
+        n = len(inputs)
+        parameters = ([self.interpolation_type] * n,
+                      [self.interpolation_order] * n,
+                      [self.smoothing_factor] * n,
+                      [self.auto_fit] * n,
+                      [evaluate] * n)
+        args = ([self.interpolation_type] * n,
+                [input.time for input in inputs],
+                [input.magnitude for input in inputs]) + parameters[1:]
+
+        # single polynomial fits are too cheap to be worth shipping to workers
+        if self.interpolation_type == "polynomial" and self.auto_fit is None:
+            results = self.fit_polynomial_chunks(inputs, evaluate)
+        elif (self.interpolation_type == "spline" and self.auto_fit is None
+                and self.spline_engine == "penalized"):
+            results = self.fit_penalized_chunks(inputs, evaluate)
+        elif self.interpolation_type == "hermite":
+            results = self.fit_hermite_chunks(inputs, evaluate)
+        elif (self.chunk_executor is None
+                or not self.chunk_executor.worth_parallel(n, sum(len(input) for input in inputs))):
+            results = list(map(fit_chunk, *args))
+        elif self.chunk_executor.processes and starts is not None:
+            handle = self.get_shared_store().handle
+            stops = [start + len(input)
+                     for start, input in zip(starts, inputs)]
+            results = self.chunk_executor.map(
+                fit_shared_chunk, [handle] * n, starts, stops, *parameters)
+        else:
+            results = self.chunk_executor.map(fit_chunk, *args)
+
+        # output
+        return [Signal(magnitude=magnitude if magnitude is not None else [],
+                       fsample=input.fsample, coef=coef, time=input.time, model=model)
+                for input, (magnitude, coef, model) in zip(inputs, results)]
+
+    def fit_polynomial_chunks(self, inputs, evaluate=True):
+        """Fits polynomial chunks, evenly sampled chunks of the same length
+        all at once through the cached projection of that length and order"""
+        def fit_stack(time, magnitude):
+            fitted, coef = fit_uniform_polynomials(
+                time, magnitude, self.interpolation_order, self.projection_cache, evaluate)
+            return fitted, coef, coef
+
+        def fit_single(input):
+            return fit_chunk("polynomial", input.time, input.magnitude,
+                             self.interpolation_order, evaluate=evaluate)
+        return self.fit_equal_chunks(inputs, fit_stack, fit_single)
+
+    def fit_penalized_chunks(self, inputs, evaluate=True):
+        """Fits penalized spline chunks, evenly sampled chunks of the same
+        length against one shared factorization"""
+        def fit_stack(time, magnitude):
+            fitted, splines = fit_penalized_splines(
+                time, magnitude, self.interpolation_order, self.smoothing_factor,
+                self.spline_cache, evaluate)
+            return fitted, [spline.c for spline in splines], splines
+
+        def fit_single(input):
+            fitted, coef, splines = fit_stack([input.time], [input.magnitude])
+            return fitted[0] if evaluate else None, coef[0], splines[0]
+        return self.fit_equal_chunks(inputs, fit_stack, fit_single)
+
+    def fit_hermite_chunks(self, inputs, evaluate=True):
+        """PCHIP interpolates chunks, all chunks of the same length in one
+        vectorized pass"""
+        def fit_stack(time, magnitude):
+            fitted, models = fit_pchip_stack(time, magnitude, evaluate)
+            return fitted, [[]] * len(models), models
+
+        def fit_single(input):
+            fitted, coef, models = fit_stack([input.time], [input.magnitude])
+            return fitted[0] if evaluate else None, coef[0], models[0]
+        return self.fit_equal_chunks(inputs, fit_stack, fit_single, uniform_only=False)
+
+    def fit_equal_chunks(self, inputs, fit_stack, fit_single, uniform_only=True):
+        """Fits evenly sampled chunks of the same length together through
+        fit_stack(times, magnitudes) -> (fitted or None, coefficients,
+        models), the others one by one through fit_single(input)
+        \n uniform_only = False stacks unevenly sampled chunks as well"""
+        results = [None] * len(inputs)
+        groups = {}
+        for index, input in enumerate(inputs):
+            groups.setdefault(len(input), []).append(index)
+        for indices in groups.values():
+            stacked = [index for index in indices
+                       if not uniform_only or is_uniform(inputs[index].time)]
+            if len(stacked) < 2:
+                stacked = []
+            for index in indices:
+                if index not in stacked:
+                    results[index] = fit_single(inputs[index])
+            if not stacked:
+                continue
+            fitted, coef, models = fit_stack([inputs[index].time for index in stacked],
+                                             [inputs[index].magnitude for index in stacked])
+            for row, index in enumerate(stacked):
+                results[index] = (fitted[row] if fitted is not None else None,
+                                  coef[row], models[row])
+        return results
+
+    def set_chunk_executor(self, max_workers: int = None, processes: bool = True,
+                           min_samples: int = PARALLEL_MIN_SAMPLES):
+        """Fits spline and hermite chunks on a pool of worker processes (or
+        threads), records shorter than min_samples are still fitted serially.
+        max_workers = 0 goes back to serial fitting"""
+        if processes and not shared_memory_available():
+            print_debug("No shared memory before Python 3.8, fitting on threads")
+            processes = False
+        if self.chunk_executor is not None:
+            self.chunk_executor.shutdown()
+            self.chunk_executor = None
+        if max_workers != 0:
+            self.chunk_executor = ChunkExecutor(
+                max_workers, processes, min_samples)
+
+    def get_shared_store(self):
+        """Returns the shared memory copy of the original signal"""
+        if self.shared_store is None:
+            self.shared_store = SharedSignalStore(self.original_signal)
+        return self.shared_store
+
+    def release_shared_store(self):
+        """Unlinks the shared copy, it is otherwise released together with
+        the last processor using it"""
+        if self.shared_store is not None:
+            self.shared_store.close()
+            self.shared_store = None
+
+    def get_chunk_length(self):
+        """Fixed chunk length for incremental refits, 0 lets the chunked
+        signal split the clipped signal evenly"""
+        if not self.incremental_refit or len(self.original_signal) == 0:
+            return 0
+        return round(len(self.original_signal) / max(self.max_chunks, 1))
+
+    def get_chunk_starts(self):
+        """Adaptive chunk starts over the clipped signal, None for equal
+        chunks"""
+        if not self.adaptive_chunks or len(self.clipped_signal) == 0:
+            return None
+        order = max(self.interpolation_order, 1)
+        return adaptive_chunk_starts(self.get_moment_table(order),
+                                     len(self.clipped_signal), order,
+                                     self.max_chunks, self.chunk_tolerance)
+
+    def get_moment_table(self, order: int = 3):
+        """Returns the moment table of the original signal, built on first
+        use and again for higher orders"""
+        table = self.moment_table
+        if table is None or table.max_order < order:
+            table = MomentTable(self.original_signal.time,
+                                self.original_signal.magnitude, max(order, 3))
+            self.moment_table = table
+        return table
+
+    def set_adaptive_chunks(self, enabled: bool = True, tolerance: float = 0):
+        """Splits the signal where an interpolation_order polynomial fits
+        worst instead of into equal chunks, max_chunks becomes the most
+        chunks used. Chunks within tolerance (RMSE) are not split."""
+        self.adaptive_chunks = enabled
+        self.chunk_tolerance = tolerance
+
+    def set_spline_engine(self, engine: str = "fitpack"):
+        """Fits spline chunks with FITPACK's adaptive knots or as penalized
+        splines on fixed knots, see chunkfit.SPLINE_ENGINES. Auto fits
+        always use FITPACK."""
+        if engine not in SPLINE_ENGINES:
+            raise Exception("Spline engine must be " + " or ".join(SPLINE_ENGINES))
+        self.spline_engine = engine
+
+    def set_continuity(self, continuity: int = None):
+        """Joins polynomial chunks with continuity continuous derivatives
+        (0 = C0, 1 = C1, clipped below the order), None averages overlapping
+        chunks instead"""
+        self.continuity = continuity
+
+    def is_continuous(self):
+        """Whether the polynomial chunks are fitted jointly, see
+        set_continuity. Auto fits always fit chunks separately."""
+        return (self.interpolation_type == "polynomial" and self.auto_fit is None
+                and self.continuity is not None)
+
+    def set_lazy_evaluation(self, enabled: bool = True):
+        """Represents the interpolation by its chunk models, see
+        PiecewiseModel"""
+        self.lazy_evaluation = enabled
+        self.fit_cache = {}
+
+    def get_model_store(self):
+        """Returns the fitted chunk models of the interpolation as a
+        PiecewiseStore"""
+        magnitude = self.interpolated_signal.magnitude
+        if isinstance(magnitude, PiecewiseModel):
+            return magnitude.store
+        # the chunk layout is the clipped signal's, magnitude may be lazy
+        return PiecewiseStore.from_chunks(
+            self.interpolation_type, self.clipped_signal,
+            [chunk.model for chunk in self.interpolated_signal.chunk_array])
+
+    def materialize(self):
+        """Evaluates a lazy interpolation at every sample, returns the
+        interpolated magnitude"""
+        if isinstance(self.interpolated_signal.magnitude, PiecewiseModel):
+            self.interpolated_signal.magnitude = self.interpolated_signal.magnitude.materialize()
+        return self.interpolated_signal.magnitude
+
+    def set_incremental_refit(self, enabled: bool = True):
+        """Reuses fits of chunks whose samples and parameters are unchanged.
+        Chunk boundaries are then taken from the original signal so that
+        clipping only changes the last chunks, a clipped signal gets fewer
+        than max_chunks chunks, which is why it is off unless asked for"""
+        self.incremental_refit = enabled
+        self.fit_cache = {}
 
     def extrapolate(self):
-        """Extrapolates remaining signal, starting from N of clipped to N of original"""
+        """Extrapolates remaining signal, starting from N of clipped to N of
+        original, with the fitted model of the last chunk"""
         self.extrapolation_type = self.interpolation_type  # placeholder for now
 
         N_clipped = len(self.clipped_signal)
         N_original = len(self.original_signal)
+        time = self.original_signal.time[N_clipped:N_original]
 
-        """Processing Here"""
-        # fitting the clipped signal
-        if self.extrapolation_type == "spline":
-            spl = interp.UnivariateSpline(self.clipped_signal.time,
-                                          self.clipped_signal.magnitude,
-                                          k=self.interpolation_order,
-                                          s=self.smoothing_factor,
-                                          ext=0)
-
-            # plot remaining time
-            self.extrapolated_values = spl(
-                self.original_signal.time[N_clipped:N_original])
-
-        elif self.extrapolation_type == "polynomial":
-            # coefficients of last chunk
-            coef = self.interpolated_signal.chunk_array[-1].coefficients
-            self.extrapolated_values = np.polyval(
-                coef, self.original_signal.time[N_clipped:N_original])
-
-        elif self.extrapolation_type == "hermite":
-            input = self.interpolated_signal.chunk_array[-1]
-            hermite = interp.PchipInterpolator(input.time,
-                                               input.magnitude,
-                                               extrapolate=True)
-            self.extrapolated_values = hermite(
-                self.original_signal.time[N_clipped:N_original])
+        self.extrapolated_values = self.predict(time)
 
         """Output signal here"""
         self.extrapolated_signal = Signal(
-            magnitude=self.extrapolated_values, time=self.original_signal.time[N_clipped:N_original])
+            magnitude=self.extrapolated_values, time=time)
+
+    def predict(self, time, chunk_index: int = -1):
+        """Evaluates the fitted model of a chunk (the last by default) at
+        any times, no refitting involved"""
+        model = self.interpolated_signal.chunk_array[chunk_index].model
+        return evaluate_model(model, time)
+
+    def forecast(self, steps):
+        """Predictions steps samples past the end of the clipped signal
+        (1 = next sample), for any number of steps at once"""
+        time = self.clipped_signal.time
+        step = (time[-1] - time[0]) / max(len(time) - 1, 1)
+        return self.predict(time[-1] + np.asarray(steps) * step)
+
+    def forecast_chunks(self, horizon: int):
+        """Forecasts of every chunk's model for the horizon samples following
+        the chunk
+        \n returns (predictions shaped (chunks, horizon[, channels]),
+        \n indices of the predicted samples in the original signal)"""
+        chunked = self.interpolated_signal
+        stops = np.array([chunked.get_chunk_range(index)[1]
+                          for index in range(len(chunked.chunk_array))])
+        indices = stops[:, np.newaxis] + np.arange(horizon)
+
+        original_time = np.asarray(self.original_signal.time)
+        step = (original_time[-1] - original_time[0]) / max(len(original_time) - 1, 1)
+        time = np.where(indices < len(original_time),
+                        original_time[np.minimum(indices, len(original_time) - 1)],
+                        original_time[-1] + (indices - len(original_time) + 1) * step)
+
+        models = [chunk.model for chunk in chunked.chunk_array]
+        if (self.interpolation_type == "polynomial"
+                and len(set(np.shape(model) for model in models)) == 1):
+            # Horner over every chunk and horizon at once
+            coef = np.asarray(models)
+            predictions = np.zeros(time.shape + coef.shape[2:])
+            if coef.ndim > 2:
+                time = time[..., np.newaxis]
+            for power in range(coef.shape[1]):
+                predictions = predictions * time + coef[:, power, np.newaxis]
+        else:
+            predictions = np.stack([evaluate_model(model, row)
+                                    for model, row in zip(models, time)])
+        return predictions, indices
+
+    def forecast_errors(self, horizon: int):
+        """RMSE of forecast_chunks by number of steps ahead, against the
+        original samples (NaN past the end of the record)"""
+        predictions, indices = self.forecast_chunks(horizon)
+        original = np.asarray(self.original_signal.magnitude)
+        known = indices < len(original)
+        errors = predictions - original[np.minimum(indices, len(original) - 1)]
+        errors = errors.reshape(errors.shape[:2] + (-1,)) ** 2
+        counts = known.sum(axis=0) * errors.shape[2]
+        with np.errstate(invalid="ignore"):
+            return np.sqrt(np.sum(errors * known[..., np.newaxis], axis=(0, 2)) / counts)
 
     def set_clipping(self, clip_percentage: int = 0):
         if clip_percentage == 100:
@@ -154,56 +548,222 @@ class SignalProcessor():
             return True
 
     def percentage_error(self):
-        # signal1 is the original
-        interpolated = self.interpolated_signal.magnitude
-        original = self.original_signal.magnitude[0:len(interpolated)]
-
-        self.sub = np.subtract(original, interpolated)
-
-        original_minus_interpolated = np.average(np.absolute(self.sub))
-        original_avg = np.average(original)
-
-        self.percentageoferror = np.absolute(
-            original_minus_interpolated / original_avg)*100
-        return self.percentageoferror
+        """Mean absolute error of the interpolation relative to the mean of
+        the original signal, in percent"""
+        return self.get_error_metrics()["percentage"]
+
+    def range_error(self):
+        """RMSE of the interpolation relative to the range of the original
+        signal, in percent. Unlike percentage_error it stays meaningful for
+        signals averaging close to zero, such as ECG."""
+        return 100 * self.get_error_metrics()["nrmse"]
+
+    def get_error_metrics(self):
+        """Residual metrics of the interpolation against the original
+        signal, see metrics.residual_metrics"""
+        interpolated = self.interpolated_signal
+        if self.error_metrics_source is interpolated:
+            return self.error_metrics
+
+        chunk_starts = None
+        if type(interpolated) == ChunkedSignal and len(interpolated.chunk_starts) > 0:
+            chunk_starts = interpolated.chunk_starts
+        fitted = interpolated.magnitude
+        original = np.asarray(self.original_signal.magnitude)
+        if isinstance(fitted, PiecewiseModel) and chunk_starts is not None \
+                and len(self.merged_keys) == len(chunk_starts):
+            self.error_metrics = metrics_from_sums(self.get_chunk_sums(original, fitted))
+        else:
+            if not isinstance(fitted, PiecewiseModel):
+                fitted = np.asarray(fitted)
+            # a lazy interpolation is evaluated block by block
+            self.error_metrics = residual_metrics(original, fitted, chunk_starts)
+        self.error_metrics_source = interpolated
+        return self.error_metrics
+
+    def get_chunk_sums(self, original, fitted):
+        """Residual sums of a lazy interpolation merged chunk by merged
+        chunk, only the chunks that changed since the last refit are
+        evaluated, runs of them up to a metrics block at a time"""
+        interpolated = self.interpolated_signal
+        error_cache = {}
+        run = []
+        for chunk_index, key in enumerate(self.merged_keys + [None]):
+            if key in self.error_cache:
+                error_cache[key] = self.error_cache[key]
+            elif key is not None:
+                run.append(chunk_index)
+                run_start = interpolated.get_chunk_range(run[0])[0]
+                if interpolated.get_chunk_range(chunk_index)[1] - run_start < BLOCK_SIZE:
+                    continue
+            if len(run) == 0:
+                continue
+            start = interpolated.get_chunk_range(run[0])[0]
+            values = fitted.evaluate(np.arange(start, interpolated.get_chunk_range(run[-1])[1]))
+            for index in run:
+                chunk_start, chunk_stop = interpolated.get_chunk_range(index)
+                error_cache[self.merged_keys[index]] = residual_sums(
+                    original[chunk_start:chunk_stop],
+                    values[chunk_start - start:chunk_stop - start], [0])
+            run = []
+        self.error_cache = error_cache
+        return combine_sums([error_cache[key] for key in self.merged_keys])
+
+    @property
+    def chunk_errors(self):
+        """RMSE of each chunk of the last interpolation, worked out when
+        first asked for"""
+        if not self.isInterpolated():
+            return np.array([])
+        return self.get_chunk_errors()
+
+    def get_chunk_errors(self, metric="chunk_rmse"):
+        """Per-chunk error of the interpolation
+        \n metric = chunk_rmse, chunk_mae or chunk_max_error"""
+        return self.get_error_metrics().get(metric, np.array([]))
+
+    def get_worst_chunk(self):
+        """Index of the chunk with the largest RMSE"""
+        return int(np.argmax(self.chunk_errors))
+
+
+def channel_coefficients(coef, channel=0):
+    """Returns the coefficients of one channel of a chunk"""
+    if isinstance(coef, list) and len(coef) != 0 and np.ndim(coef[0]) > 0:
+        return coef[channel]  # one spline per channel
+    if np.ndim(coef) == 2:
+        return np.asarray(coef)[:, channel]
+    return coef
 
 
 def update_graph(self):
     if self.signal_processor.original_signal != None:
         draw = self.signal_processor.original_signal
-        self.curve_plot_ref.setData(draw.time, draw.magnitude)
+        set_curve_data(self, self.curve_plot_ref, draw.time, draw.magnitude)
 
     if self.signal_processor.isInterpolated():
         draw = self.signal_processor.interpolated_signal
-        self.curve_plot_interpolated.setData(draw.time, draw.magnitude)
+        set_curve_data(self, self.curve_plot_interpolated,
+                       draw.time, draw.magnitude)
 
         if type(self.signal_processor.interpolated_signal) == ChunkedSignal:
             draw = self.signal_processor.interpolated_signal.chunk_array[self.polynomial_equation_spinBox.value(
             )]
-            self.curve_plot_selected_chunk.setData(draw.time, draw.magnitude)
+            set_curve_data(self, self.curve_plot_selected_chunk,
+                           draw.time, chunk_magnitude(draw))
         else:
-            self.curve_plot_selected_chunk.setData([], [])
+            set_curve_data(self, self.curve_plot_selected_chunk, [], [])
 
     if self.signal_processor.isExtrapolated():
         draw = self.signal_processor.extrapolated_signal
-        self.curve_plot_extrapolated.setData(draw.time, draw.magnitude)
+        set_curve_data(self, self.curve_plot_extrapolated,
+                       draw.time, draw.magnitude)
 
+    update_chunk_error_strip(self)
     update_latex(self)
 
 
+def update_chunk_error_strip(self):
+    """Draws the per-chunk errors as a green to red strip under the curves"""
+    self.chunk_error_strip.setOpts(x0=[], x1=[], height=0)
+    errors = self.signal_processor.chunk_errors
+    interpolated = self.signal_processor.interpolated_signal
+    if not self.signal_processor.isInterpolated() or len(errors) == 0:
+        return
+
+    time = interpolated.time
+    starts = interpolated.chunk_starts
+    stops = np.append(starts[1:], len(time)) - 1
+    low, high = self.curve_plot_ref.lod.get_range()
+    height = 0.06 * ((high - low) or 1)
+
+    normalized = errors / (np.max(errors) or 1)
+    brushes = [pg.mkBrush(int(255 * value), int(255 * (1 - value)), 0)
+               for value in normalized]
+    self.chunk_error_strip.setOpts(x0=time[starts], x1=time[stops],
+                                   y0=low - 2 * height, height=height,
+                                   brushes=brushes, pens=[None] * len(brushes))
+    self.chunk_error_strip_band = (low - 2 * height, low - height)
+
+
+def select_chunk_at(self, event):
+    """Selects the chunk under a click on the error strip"""
+    if not self.signal_processor.isInterpolated() or len(self.signal_processor.chunk_errors) == 0:
+        return
+    point = self.curve_plot.getViewBox().mapSceneToView(event.scenePos())
+    bottom, top = self.chunk_error_strip_band
+    if not bottom <= point.y() <= top:
+        return
+    interpolated = self.signal_processor.interpolated_signal
+    sample = np.searchsorted(interpolated.time, point.x())
+    chunk = max(np.searchsorted(interpolated.chunk_starts, sample, "right") - 1, 0)
+    self.polynomial_equation_spinBox.setValue(int(chunk))
+
+
+def chunk_magnitude(chunk):
+    """Fitted magnitude of a chunk, evaluated from its model when the fit
+    was left lazy"""
+    if len(chunk) == 0 and chunk.model is not None:
+        return evaluate_model(chunk.model, chunk.time)
+    return chunk.magnitude
+
+
+def set_curve_data(self, curve, time, magnitude):
+    """Stores the full curve in its LOD pyramid and draws the visible part,
+    lazy curves are evaluated for the visible part only"""
+    channel = self.channel_index if np.ndim(magnitude) == 2 else None
+    origin = curve.lod.origin
+    if origin is not None and origin[0] is time and origin[1] is magnitude \
+            and origin[2] == channel:
+        # unchanged, such as the original signal after a refit
+        draw_curve_view(self, curve)
+        return
+    if isinstance(magnitude, PiecewiseModel):
+        curve.lod.set_source(time, magnitude, channel)
+    elif channel is not None:
+        curve.lod.set_data(time, np.asarray(magnitude)[:, channel])
+    else:
+        curve.lod.set_data(time, magnitude)
+    curve.lod.origin = (time, magnitude, channel)
+    draw_curve_view(self, curve)
+
+
+def draw_curve_view(self, curve):
+    """Feeds a curve only the decimated points of the current view range"""
+    view_box = self.curve_plot.getViewBox()
+    if view_box.autoRangeEnabled()[0]:
+        # let auto range see the whole extent of the data
+        x_min, x_max = -np.inf, np.inf
+    else:
+        x_min, x_max = view_box.viewRange()[0]
+    time, magnitude = curve.lod.get_view(x_min, x_max, view_box.width())
+    curve.setData(time, magnitude)
+
+
+def refresh_lod(self):
+    """Recomputes the drawn points of every curve after a zoom or pan"""
+    for curve in [self.curve_plot_ref, self.curve_plot_interpolated,
+                  self.curve_plot_extrapolated, self.curve_plot_selected_chunk]:
+        draw_curve_view(self, curve)
+
+
 def update_latex(self):
+    if not self.signal_processor.isInterpolated():
+        return
     if self.signal_processor.interpolation_type != "hermite":
-        latex(self, self.signal_processor.interpolated_signal.get_coefficients(
-            self.polynomial_equation_spinBox.value()))
         self.polynomial_equation_spinBox.setMaximum(
-            self.chunk_number_spinBox.value() - 1)
+            len(self.signal_processor.interpolated_signal.chunk_array) - 1)
+        latex(self, channel_coefficients(
+            self.signal_processor.interpolated_signal.get_coefficients(
+                self.polynomial_equation_spinBox.value()), self.channel_index))
         draw = self.signal_processor.interpolated_signal.chunk_array[self.polynomial_equation_spinBox.value(
         )]
-        self.curve_plot_selected_chunk.setData(draw.time, draw.magnitude)
+        set_curve_data(self, self.curve_plot_selected_chunk,
+                       draw.time, chunk_magnitude(draw))
 
     else:
         latex(self, self.signal_processor.interpolated_signal.coefficients, hermite=True)
-        self.curve_plot_selected_chunk.clear()
+        set_curve_data(self, self.curve_plot_selected_chunk, [], [])
 
 
 def create_latex_figure(self):
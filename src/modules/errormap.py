@@ -2,12 +2,13 @@
 from threading import Thread, Lock
 import threading
 from modules.utility import print_debug
-from modules import interface
+from modules import interface, sweep, errorstore
 from copy import copy
 from PyQt5 import QtWidgets
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as Canvas
 import numpy as np
+import pandas as pd
 import seaborn as sn
 
 plt.rcParams['axes.facecolor'] = 'black'
@@ -18,6 +19,13 @@ plt.rcParams['axes.titlecolor'] = "white"
 plt.rcParams['axes.labelcolor'] = "white"
 plt.rcParams["figure.autolayout"] = True
 
+AXIS_PARAMETERS = {"No. Of Chunks": "chunks",
+                   "Poly. Order": "order",
+                   "% Overlap": "overlap"}
+
+CUBE_TYPES = ["Poly. Order", "No. Of Chunks", "% Overlap"]
+"""Axis order of the error cube"""
+
 
 def values(self, type):
     # whether what the user chose it will still be the same no. for both axes
@@ -32,6 +40,18 @@ def values(self, type):
     return vals
 
 
+def adaptive_values(self, type):
+    # wide ranges, only affordable because the adaptive sweep skips most cells
+    vals = []
+    if type == "No. Of Chunks":
+        vals = np.arange(1, 501)
+    elif type == "Poly. Order":
+        vals = np.arange(1, 16)
+    elif type == "% Overlap":
+        vals = np.arange(0, 51)
+    return vals
+
+
 def select_error_x(self, x_type="No. Of Chunks"):
     self.x_type = x_type
 
@@ -41,52 +61,13 @@ def select_error_y(self, y_type="Poly. Order"):
 
 
 def normalization(self):
-    self.normalized_error = []
-    min = np.amin(self.percentage_error)
-    max = np.amax(self.percentage_error)
-
-    for i in self.percentage_error:
-        self.normalized_error_temp = []
-        for j in i:
-            value = (j - min) / (max - min)
-            self.normalized_error_temp.append(value)
-        self.normalized_error.append(self.normalized_error_temp)
-
-
-def enter(self, order=3, chunks=10, overlap=9):
-    # gets user defaults from original signal processor object
-    if order == 3:
-        order = self.signal_processor.interpolation_order
-    if chunks == 10:
-        chunks = self.signal_processor.max_chunks
-    if overlap == 9:
-        overlap = self.signal_processor.overlap_percent
-
-    # sets user input
-
-    self.signal_processor_error.interpolation_order = order
-    self.signal_processor_error.max_chunks = chunks
-    self.signal_processor_error.overlap_percent = overlap
-
-
-def type_selection(self, x_type, y_type, i, j):
-    # order,chunks,overlap
-    self.y_type == y_type
-    self.x_type == x_type
-    if (self.y_type == "No. Of Chunks" and self.x_type == "Poly. Order"):
-        enter(self, order=i, chunks=j)
-    elif(self.y_type == "Poly. Order" and self.x_type == "No. Of Chunks"):
-        enter(self, order=j, chunks=i)
-    elif (self.y_type == "No. Of Chunks" and self.x_type == "% Overlap"):
-        enter(self, chunks=j, overlap=i)
-    elif (self.y_type == "% Overlap" and self.x_type == "No. Of Chunks"):
-        enter(self, chunks=i, overlap=j)
-    elif(self.y_type == "% Overlap" and self.x_type == "Poly. Order"):
-        enter(self, order=i, overlap=j)
-    elif (self.y_type == "Poly. Order" and self.x_type == "% Overlap"):
-        enter(self, order=j, overlap=i)
-    else:
-        raise Exception("Invalid Selection")
+    self.normalized_error = normalize_grid(
+        np.array(self.percentage_error, dtype=float)).tolist()
+
+
+def sweep_axis(self, type, values):
+    # maps a combo box axis type to a parameter sweep axis
+    return sweep.SweepAxis(AXIS_PARAMETERS[type], values=values)
 
 
 def error_map(self):
@@ -98,7 +79,10 @@ def error_map(self):
             threading.current_thread().name))
         lock = Lock()
 
-        t1 = Thread(target=calculate_error, args=(
+        target = calculate_error
+        if self.adaptive_checkBox.isChecked():
+            target = calculate_error_adaptive
+        t1 = Thread(target=target, args=(
             self,), name='error map thread')
         # start threads
         t1.start()
@@ -119,50 +103,261 @@ def calculate_error(self, loading_counter: int = 0):
 
     interface.progressBar_update(self, 1)
 
-    self.x_values = values(self, self.x_type)
-
-    self.y_values = values(self, self.y_type)
-
     print_debug("calculate error assigned to thread: {}".format(
         threading.current_thread().name))
 
-    x = self.x_values
-    y = self.y_values
-
-    self.percentage_error = []
-    for j in y:
-        # to iterate on the y ranges
-        self.percentage_error_temp = []
-        for i in x:
-            # intrapolate according to the 2 numbers and add to the matrix
-
-            # order,chunks,overlap
-            type_selection(self, self.x_type, self.y_type, i, j)
-
-            self.signal_processor_error.interpolate()
-
-            self.percentage_error_temp.append(
-                self.signal_processor_error.percentage_error())
-
-            print_debug("Error Calculated: " + "x =" + str(i) + " y=" + str(j))
-        self.percentage_error.append(self.percentage_error_temp)
+    # every axis pair is a slice of the cube, switching pairs is free
+    calculate_error_cube(self)
 
     interface.progressBar_update(self, 2)
     if self.toggle_progressBar == 1:
         return
 
+    select_cube_slice(self)
     normalization(self)
 
     interface.progressBar_update(self, 3)
     if self.toggle_progressBar == 1:
         return
-    plot_error_map(self, self.normalized_error, self.x_type, self.y_type)
+    plot_error_map(self, self.normalized_error, self.x_type, self.y_type,
+                   self.x_values, self.y_values)
     # multithreading
     # https://stackoverflow.com/questions/2846653/how-can-i-use-threading-in-python
     pass
 
 
+def calculate_error_cube(self, smoothing_values=None):
+    """Sweeps order x chunks x overlap (x smoothing) into self.error_cube"""
+    axes = [sweep_axis(self, type, values(self, type)) for type in CUBE_TYPES]
+    if smoothing_values is not None:
+        axes.append(sweep.SweepAxis("smoothing", values=smoothing_values))
+    self.error_cube = sweep.run_sweep(
+        self.signal_processor_error, axes, store=self.error_store)
+    self.error_cube_axes = axes
+    self.error_cube_source = cube_source(self)
+    self.slice_axis = None
+
+
+def cube_source(self):
+    # the unswept settings a cube was computed for
+    processor = self.signal_processor
+    # adaptive boundaries follow the processor's own order, as in sweeps
+    adaptive = (processor.interpolation_order, processor.chunk_tolerance) \
+        if processor.adaptive_chunks else None
+    return (id(processor), processor.interpolation_type,
+            processor.smoothing_factor, len(processor.clipped_signal),
+            processor.auto_fit, processor.spline_engine, processor.continuity,
+            processor.incremental_refit, adaptive)
+
+
+def cube_slice(cube, x_axis, y_axis, pins=None):
+    """2-D slice (y rows, x columns) of an error cube, the other axes are
+    pinned at the index given in pins (default 0)"""
+    pins = pins or {}
+    index = [pins.get(axis, 0) for axis in range(cube.ndim)]
+    index[x_axis] = index[y_axis] = slice(None)
+    plane = cube[tuple(index)]
+    if x_axis < y_axis:
+        plane = plane.T
+    return plane
+
+
+def select_cube_slice(self):
+    """Takes the slice of the current x and y axes out of the error cube"""
+    x_axis = CUBE_TYPES.index(self.x_type)
+    y_axis = CUBE_TYPES.index(self.y_type)
+    pinned_axis = 3 - x_axis - y_axis
+    pinned_values = self.error_cube_axes[pinned_axis].values
+
+    self.slice_spinBox.blockSignals(True)
+    if self.slice_axis != pinned_axis:
+        # start from the slice closest to the current fit
+        current = sweep.get_parameters(self.signal_processor)[
+            AXIS_PARAMETERS[CUBE_TYPES[pinned_axis]]]
+        self.slice_axis = pinned_axis
+        self.slice_spinBox.setMaximum(len(pinned_values) - 1)
+        self.slice_spinBox.setValue(
+            int(np.argmin(np.abs(pinned_values - current))))
+    self.slice_spinBox.setPrefix(CUBE_TYPES[pinned_axis] + ": ")
+    self.slice_spinBox.blockSignals(False)
+
+    self.x_values = self.error_cube_axes[x_axis].values
+    self.y_values = self.error_cube_axes[y_axis].values
+    self.percentage_error = cube_slice(
+        self.error_cube, x_axis, y_axis,
+        {pinned_axis: self.slice_spinBox.value()}).tolist()
+
+
+def show_cube_slice(self):
+    """Redraws the error map from the error cube without refitting"""
+    if getattr(self, "error_cube", None) is None:
+        return
+    if self.error_cube_source != cube_source(self):
+        return  # stale, computed for another file or fit
+    if self.x_type == self.y_type:
+        return
+    select_cube_slice(self)
+    normalization(self)
+    plot_error_map(self, self.normalized_error, self.x_type, self.y_type,
+                   self.x_values, self.y_values)
+
+
+def evaluate_error(self, x, y):
+    """Range error of the error processor at one (x, y) cell"""
+    axes = [sweep_axis(self, self.y_type, [y]),
+            sweep_axis(self, self.x_type, [x])]
+    return sweep.run_sweep(self.signal_processor_error, axes)[0, 0]
+
+
+def halves(start, stop):
+    """Splits an index interval at its middle, keeps unit intervals"""
+    middle = (start + stop) // 2
+    if stop - start <= 1:
+        return [(start, stop)]
+    return [(start, middle), (middle, stop)]
+
+
+def adaptive_sweep(evaluate, n_x, n_y, budget=300, tolerance=0, coarse=5,
+                   cells_per_round=4, on_round=None):
+    """Quadtree refinement of an n_y by n_x error grid
+    \n evaluate(i, j) = error at x index i and y index j
+    \n Starts from a coarse grid and keeps splitting the cells that sit in
+    \n low error valleys or across steep changes, until budget evaluations
+    \n are spent or every cell varies less than tolerance. One cell a round
+    \n is the one that could dip lowest between its corners, so minima
+    \n inside cells with even corners are found too.
+    \n on_round(grid) is called with the partial grid (NaN = not evaluated)
+    \n returns the grid"""
+    grid = np.full((n_y, n_x), np.nan)
+    evaluated = np.zeros((n_y, n_x), dtype=bool)
+
+    def visit(i, j):
+        if not evaluated[j, i]:
+            evaluated[j, i] = True
+            grid[j, i] = evaluate(i, j)
+
+    xs = np.unique(np.linspace(0, n_x - 1, min(coarse, n_x)).round().astype(int))
+    ys = np.unique(np.linspace(0, n_y - 1, min(coarse, n_y)).round().astype(int))
+    for j in ys:
+        for i in xs:
+            visit(i, j)
+    x_intervals = list(zip(xs[:-1], xs[1:])) or [(xs[0], xs[0])]
+    y_intervals = list(zip(ys[:-1], ys[1:])) or [(ys[0], ys[0])]
+    cells = [(x0, x1, y0, y1) for x0, x1 in x_intervals for y0, y1 in y_intervals]
+
+    if on_round is not None:
+        on_round(grid)
+
+    while cells and evaluated.sum() < budget:
+        low, high = np.nanmin(grid), np.nanmax(grid)
+        spread_range = (high - low) or 1
+
+        def corner_values(cell):
+            x0, x1, y0, y1 = cell
+            return grid[[y0, y0, y1, y1], [x0, x1, x0, x1]]
+
+        def score(cell):
+            corners = corner_values(cell)
+            if np.all(np.isnan(corners)):
+                return -1, 0
+            spread = np.nanmax(corners) - np.nanmin(corners)
+            valley = (high - np.nanmin(corners)) / spread_range
+            return spread / spread_range + valley, spread
+
+        # drop cells that are fully evaluated or flat enough
+        scored = []
+        for cell in cells:
+            x0, x1, y0, y1 = cell
+            priority, spread = score(cell)
+            if x1 - x0 <= 1 and y1 - y0 <= 1:
+                continue
+            if tolerance > 0 and spread < tolerance:
+                continue
+            scored.append((priority, cell))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        cells = [cell for priority, cell in scored]
+
+        # the steepest slope seen bounds how far below its corners a cell
+        # can dip, the cell with the lowest bound takes the last place
+        valued = [cell for cell in cells if not np.all(np.isnan(corner_values(cell)))]
+        diagonals = {cell: np.hypot(cell[1] - cell[0], cell[3] - cell[2]) for cell in valued}
+        slope = max([score(cell)[1] / diagonals[cell] for cell in valued], default=0)
+
+        def lower_bound(cell):
+            return np.nanmin(corner_values(cell)) - slope * diagonals[cell] / 2
+
+        if len(cells) > cells_per_round and valued:
+            lowest = min(valued, key=lower_bound)
+            if lowest not in cells[:cells_per_round - 1]:
+                cells.remove(lowest)
+                cells.insert(cells_per_round - 1, lowest)
+
+        for x0, x1, y0, y1 in cells[:cells_per_round]:
+            cells.remove((x0, x1, y0, y1))
+            mx, my = (x0 + x1) // 2, (y0 + y1) // 2
+            for i, j in [(mx, y0), (mx, y1), (x0, my), (x1, my), (mx, my)]:
+                visit(i, j)
+            cells.extend((a0, a1, b0, b1) for a0, a1 in halves(x0, x1)
+                         for b0, b1 in halves(y0, y1))
+            if evaluated.sum() >= budget:
+                break
+
+        if on_round is not None:
+            on_round(grid)
+    return grid
+
+
+def calculate_error_adaptive(self, budget: int = 300, tolerance: float = 0):
+    """Error map over wide axis ranges, refined where it matters"""
+    self.toggle_progressBar = 0
+    self.startLoading.emit()
+    self.signal_processor_error = copy(self.signal_processor)
+
+    self.x_values = adaptive_values(self, self.x_type)
+    self.y_values = adaptive_values(self, self.y_type)
+    x = self.x_values
+    y = self.y_values
+
+    def on_round(grid):
+        if self.toggle_progressBar == 1:
+            raise InterruptedError("Error map cancelled")
+        done = np.count_nonzero(~np.isnan(grid))
+        self.progressChanged.emit(min(int(100 * done / budget), 99))
+        self.percentage_error = grid
+        plot_error_map(self, normalize_grid(grid), self.x_type, self.y_type,
+                       self.x_values, self.y_values)
+
+    # cells of earlier sweeps of this record come from the store
+    axes = [sweep_axis(self, self.y_type, y), sweep_axis(self, self.x_type, x)]
+    key, description = sweep.get_sweep_key(
+        self.error_store, self.signal_processor_error, axes)
+    stored, evaluated = self.error_store.lookup(key, [y, x])
+    known = evaluated.copy()
+
+    def evaluate(i, j):
+        if not known[j, i]:
+            stored[j, i] = evaluate_error(self, x[i], y[j])
+            evaluated[j, i] = True
+        return stored[j, i]
+
+    try:
+        adaptive_sweep(evaluate, len(x), len(y), budget, tolerance,
+                       on_round=on_round)
+    except InterruptedError:
+        pass
+    self.error_store.save(key, [y, x], stored, evaluated, description)
+    if self.toggle_progressBar == 0:
+        self.endLoading.emit()
+
+
+def normalize_grid(grid):
+    """Scales a grid to [0, 1], NaN cells stay NaN"""
+    low, high = np.nanmin(grid), np.nanmax(grid)
+    return (grid - low) / ((high - low) or 1)
+
+
 def create_error_map_figure(self):
+    self.error_store = errorstore.ErrorGridStore()
     self.figure = plt.figure()
     self.figure.patch.set_facecolor('black')
     self.axes = self.figure.add_subplot()
@@ -171,11 +366,14 @@ def create_error_map_figure(self):
     # plot_error_map(self) # CALL WHEN ERROR_BUTTON IS CLICKED INSTEAD
 
 
-def plot_error_map(self, data=[], xlabel='', ylabel=''):
+def plot_error_map(self, data=[], xlabel='', ylabel='', x_values=None, y_values=None):
 
     self.axes.clear()
     plt.clf()
 
+    if x_values is not None and y_values is not None:
+        # label cells with parameter values, seaborn thins dense labels
+        data = pd.DataFrame(data, index=y_values, columns=x_values)
 
 # plotting the heatmap
     erorr_map = sn.heatmap(data=data)
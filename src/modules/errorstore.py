@@ -0,0 +1,109 @@
+'''Content-addressed store of computed error grids, so sweeps over a record
+survive closing the window and only new cells are ever computed'''
+import hashlib
+import json
+import os
+import numpy as np
+from modules.utility import print_debug
+
+STORE_DIRECTORY = "errormaps"
+
+
+def signal_hash(signal):
+    """sha256 of the samples and time axis of a signal"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(signal.magnitude, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(signal.time, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+class ErrorGridStore():
+    """Error grids saved as .npz files named after the hash of the signal,
+    method, swept parameters and fixed settings they were computed from"""
+
+    def __init__(self, directory=STORE_DIRECTORY) -> None:
+        self.directory = directory
+
+    def get_key(self, signal, method, parameters, fixed):
+        """Returns (key, description) of a sweep
+        \n parameters = swept parameter names in axis order
+        \n fixed = settings of the parameters that are not swept"""
+        description = json.dumps({"signal": signal_hash(signal),
+                                  "method": method,
+                                  "parameters": list(parameters),
+                                  "fixed": fixed},
+                                 sort_keys=True, default=float)
+        return hashlib.sha256(description.encode()).hexdigest()[:32], description
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """Returns (axis values, grid, evaluated mask, description) of a
+        stored sweep, or None"""
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            n_axes = int(stored["n_axes"])
+            axis_values = [stored["axis_" + str(axis)] for axis in range(n_axes)]
+            return (axis_values, stored["grid"], stored["evaluated"],
+                    str(stored["description"]))
+
+    def lookup(self, key, axis_values):
+        """Returns (grid, evaluated mask) over the requested axis values,
+        filled with whatever cells are stored"""
+        grid = np.full([len(values) for values in axis_values], np.nan)
+        evaluated = np.zeros(grid.shape, dtype=bool)
+        stored = self.load(key)
+        if stored is None:
+            return grid, evaluated
+
+        stored_values, stored_grid, stored_evaluated, description = stored
+        requested, found = [], []
+        for values, old_values in zip(axis_values, stored_values):
+            # exact, as save merges axes, an absolute tolerance would take
+            # small smoothing factors for one another
+            matches = (np.asarray(values, dtype=float)[:, np.newaxis]
+                       == old_values[np.newaxis, :])
+            requested.append(np.flatnonzero(matches.any(axis=1)))
+            found.append(matches.argmax(axis=1)[requested[-1]])
+        grid[np.ix_(*requested)] = stored_grid[np.ix_(*found)]
+        evaluated[np.ix_(*requested)] = stored_evaluated[np.ix_(*found)]
+        print_debug("Reused " + str(evaluated.sum()) + " stored cells")
+        return grid, evaluated
+
+    def save(self, key, axis_values, grid, evaluated, description=""):
+        """Merges the evaluated cells into the stored sweep"""
+        stored = self.load(key)
+        if stored is not None:
+            stored_values, stored_grid, stored_evaluated, description = stored
+            merged_values = [np.union1d(old, new)
+                             for old, new in zip(stored_values, axis_values)]
+            merged_grid, merged_evaluated = self.place(
+                merged_values, stored_values, stored_grid, stored_evaluated)
+            new_grid, new_evaluated = self.place(
+                merged_values, axis_values, grid, evaluated)
+            merged_grid[new_evaluated] = new_grid[new_evaluated]
+            merged_evaluated |= new_evaluated
+            axis_values, grid, evaluated = merged_values, merged_grid, merged_evaluated
+
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {"axis_" + str(axis): np.asarray(values, dtype=float)
+                  for axis, values in enumerate(axis_values)}
+        # write then rename, so readers never see half a file
+        temporary_path = self.get_path(key) + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, grid=grid, evaluated=evaluated,
+                     n_axes=len(axis_values), description=description, **arrays)
+        os.replace(temporary_path, self.get_path(key))
+
+    def place(self, target_values, axis_values, grid, evaluated):
+        """Spreads a grid over the (larger) target axis values"""
+        indices = [np.searchsorted(target, np.asarray(values, dtype=float))
+                   for target, values in zip(target_values, axis_values)]
+        target_grid = np.full([len(values) for values in target_values], np.nan)
+        target_evaluated = np.zeros(target_grid.shape, dtype=bool)
+        target_grid[np.ix_(*indices)] = grid
+        target_evaluated[np.ix_(*indices)] = evaluated
+        return target_grid, target_evaluated
@@ -1,12 +1,13 @@
 
 from turtle import width
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QSpinBox, QProgressBar, QMessageBox, QAction, QPushButton, QSlider, QComboBox, QLCDNumber, QStackedWidget, QStackedLayout, QWidget, QGroupBox, QHBoxLayout, QVBoxLayout, QDial, QLabel, QGridLayout, QToolButton
+from PyQt5.QtWidgets import QCheckBox, QSpinBox, QProgressBar, QMessageBox, QAction, QMenu, QPushButton, QSlider, QComboBox, QLCDNumber, QStackedWidget, QStackedLayout, QWidget, QGroupBox, QHBoxLayout, QVBoxLayout, QDial, QLabel, QGridLayout, QToolButton
 from PyQt5.QtGui import *
 from PyQt5.QtCore import Qt
 from sympy import degree
 from modules import openfile
-from modules.curvefit import update_graph, update_latex
+from modules.curvefit import update_graph, update_latex, refresh_lod, select_chunk_at
+from modules.lod import DecimatedCurve
 from modules.utility import print_debug, print_log
 from modules import errormap
 import pyqtgraph as pg
@@ -15,6 +16,16 @@ import threading
 import os
 
 
+AUTO_FIT_MODES = {"Manual": None, "Auto (AIC)": "aic",
+                  "Auto (BIC)": "bic", "Auto (LOO)": "loo"}
+"""Per-chunk model selection modes, the order spinbox becomes the highest
+order tried"""
+
+CONTINUITY_MODES = {"Averaged joins": None, "C0 joins": 0, "C1 joins": 1}
+"""How polynomial chunks meet: averaged overlaps, or one joint fit with
+continuous values (C0) or slopes too (C1)"""
+
+
 def about_us(self):
     QMessageBox.about(
         self, ' About ', 'This is a curve fitter \nCreated by junior students from the faculty of Engineering, Cairo University, Systems and Biomedical Engineering department \n \nTeam members: \n-Mohammed Nasser \n-Abdullah Saeed \n-Zeyad Mansour \n-Mariam Khaled \n \nhttps://github.com/mo-gaafar/Curve_Fitter.git')
@@ -25,15 +36,23 @@ def update_interpolation(self):
     print_debug("Updating Interpolation")
     chunk_number = int(self.chunk_number_spinBox.value())
     overlap_percent = int(self.overlap_spinBox.value())
+    auto_fit = AUTO_FIT_MODES[self.auto_fit_comboBox.currentText()]
+    self.signal_processor.set_adaptive_chunks(
+        self.adaptive_chunks_checkBox.isChecked())
+    self.signal_processor.set_spline_engine(
+        "penalized" if self.penalized_spline_checkBox.isChecked() else "fitpack")
+    self.signal_processor.set_continuity(
+        CONTINUITY_MODES[self.continuity_comboBox.currentText()])
 
     if self.polynomial_button.isChecked():
         order = int(self.polynomial_degree_spinBox.value())
 
         self.signal_processor.init_interpolation(
-            type="polynomial",
+            type="savgol" if self.sliding_fit_checkBox.isChecked() else "polynomial",
             order=order,
             N_chunks=chunk_number,
-            overlap_percent=overlap_percent)
+            overlap_percent=overlap_percent,
+            auto_fit=auto_fit)
 
     elif self.spline_button.isChecked():
         smoothing_factor = int(self.smoothing_spinBox.value())
@@ -43,7 +62,8 @@ def update_interpolation(self):
             smoothing_factor=smoothing_factor,
             order=order,
             N_chunks=chunk_number,
-            overlap_percent=overlap_percent)
+            overlap_percent=overlap_percent,
+            auto_fit=auto_fit)
 
     elif self.hermite_button.isChecked():
         smoothing_factor = int(self.smoothing_spinBox.value())
@@ -53,7 +73,8 @@ def update_interpolation(self):
             smoothing_factor=smoothing_factor,
             order=order,
             N_chunks=chunk_number,
-            overlap_percent=overlap_percent)
+            overlap_percent=overlap_percent,
+            auto_fit=auto_fit)
 
     self.signal_processor.extrapolate()
     update_error_label(self)
@@ -70,6 +91,11 @@ def update_clipping(self):
     # update_extrapolation(self)
 
 
+def select_channel(self, channel):
+    self.channel_index = channel
+    update_graph(self)
+
+
 def update_error_label(self):
     self.percentage_error_label.setNum(
         (self.signal_processor.percentage_error()))
@@ -194,6 +220,20 @@ def init_plots(self):
     pen = pg.mkPen(color=(200, 200, 0), width=3)
     self.curve_plot_selected_chunk = self.curve_plot.plot(pen=pen)
 
+    # full resolution data lives in the LOD pyramids, curves get the view
+    for curve in [self.curve_plot_ref, self.curve_plot_interpolated,
+                  self.curve_plot_extrapolated, self.curve_plot_selected_chunk]:
+        curve.lod = DecimatedCurve()
+    self.curve_plot.getViewBox().sigXRangeChanged.connect(
+        lambda: refresh_lod(self))
+
+    # per-chunk error strip, click a chunk to show its model
+    self.chunk_error_strip = pg.BarGraphItem(x0=[], x1=[], height=0)
+    self.curve_plot.addItem(self.chunk_error_strip)
+    self.chunk_error_strip_band = (0, 0)
+    self.curve_plot.scene().sigMouseClicked.connect(
+        lambda event: select_chunk_at(self, event))
+
 
 def combobox_selections_visibility(self):
     view = self.y_comboBox.view()
@@ -240,12 +280,36 @@ def init_connectors(self):
     self.polynomial_degree_spinBox.valueChanged.connect(
         lambda: update_interpolation(self))
 
+    self.auto_fit_comboBox = QComboBox()
+    self.auto_fit_comboBox.addItems(AUTO_FIT_MODES)
+    self.horizontalLayout_5.addWidget(self.auto_fit_comboBox)
+    self.auto_fit_comboBox.currentIndexChanged.connect(
+        lambda: update_interpolation(self))
+
+    # one polynomial per sample over a chunk-long window (Savitzky-Golay)
+    self.sliding_fit_checkBox = QCheckBox("Sliding")
+    self.horizontalLayout_5.addWidget(self.sliding_fit_checkBox)
+    self.sliding_fit_checkBox.toggled.connect(
+        lambda: update_interpolation(self))
+
+    self.continuity_comboBox = QComboBox()
+    self.continuity_comboBox.addItems(CONTINUITY_MODES)
+    self.horizontalLayout_5.addWidget(self.continuity_comboBox)
+    self.continuity_comboBox.currentIndexChanged.connect(
+        lambda: update_interpolation(self))
+
     self.overlap_spinBox.valueChanged.connect(
         lambda: update_interpolation(self))
 
     self.smoothing_spinBox.valueChanged.connect(
         lambda: update_interpolation(self))
 
+    # fixed-knot splines, solved for all equal chunks at once
+    self.penalized_spline_checkBox = QCheckBox("Penalized")
+    self.horizontalLayout_9.addWidget(self.penalized_spline_checkBox)
+    self.penalized_spline_checkBox.toggled.connect(
+        lambda: update_interpolation(self))
+
     self.extrapolate_spinBox = self.findChild(
         QSpinBox, "extrapolate_spinBox")
     self.extrapolate_spinBox.valueChanged.connect(
@@ -256,11 +320,28 @@ def init_connectors(self):
     self.chunk_number_spinBox.valueChanged.connect(
         lambda: update_interpolation(self))
 
+    # chunk boundaries where the fit is worst, the spinbox is the chunk budget
+    self.adaptive_chunks_checkBox = QCheckBox("Adaptive")
+    self.horizontalLayout_3.addWidget(self.adaptive_chunks_checkBox)
+    self.adaptive_chunks_checkBox.toggled.connect(
+        lambda: update_interpolation(self))
+
     self.error_map_apply_button = self.findChild(
         QPushButton, "error_map_apply_button")
     self.error_map_apply_button.clicked.connect(
         lambda: errormap.error_map(self))
 
+    # refines wide parameter ranges instead of sweeping a small full grid
+    self.adaptive_checkBox = QCheckBox("Adaptive")
+    self.horizontalLayout_7.addWidget(self.adaptive_checkBox)
+
+    # value of the third parameter when browsing the error cube
+    self.slice_spinBox = QSpinBox()
+    self.slice_spinBox.setMaximum(0)
+    self.horizontalLayout_7.addWidget(self.slice_spinBox)
+    self.slice_spinBox.valueChanged.connect(
+        lambda: errormap.show_cube_slice(self))
+
     self.cancel_button = self.findChild(QPushButton, "cancel_button")
     self.cancel_button.clicked.connect(
         lambda: stop_progressBar(self))
@@ -274,9 +355,22 @@ def init_connectors(self):
     self.y_comboBox.currentIndexChanged.connect(
         lambda: errormap.select_error_y(self, self.y_comboBox.currentText()))
 
+    self.x_comboBox.currentIndexChanged.connect(
+        lambda: errormap.show_cube_slice(self))
+    self.y_comboBox.currentIndexChanged.connect(
+        lambda: errormap.show_cube_slice(self))
+
     self.polynomial_equation_spinBox.valueChanged.connect(
         lambda: update_latex(self))
 
+    # channel shown for multi-channel records
+    self.channel_spinBox = QSpinBox()
+    self.channel_spinBox.setPrefix("Ch ")
+    self.channel_spinBox.setMaximum(0)
+    self.horizontalLayout_16.insertWidget(0, self.channel_spinBox)
+    self.channel_spinBox.valueChanged.connect(
+        lambda: select_channel(self, self.channel_spinBox.value()))
+
     view = self.y_comboBox.view()
     view.setRowHidden(0, True)
 
@@ -293,6 +387,10 @@ def init_connectors(self):
     self.actionOpen = self.findChild(QAction, "actionOpen")
     self.actionOpen.triggered.connect(
         lambda: openfile.browse_window(self))
+    self.actionSave_model = QAction("Save Model", self)
+    self.findChild(QMenu, "menuFile").addAction(self.actionSave_model)
+    self.actionSave_model.triggered.connect(
+        lambda: openfile.save_model_window(self))
 
     # self.actionAbout_us = self.findChild(QAction, "actionAbout_Us")
     # self.actionAbout_us.triggered.connect(
@@ -0,0 +1,131 @@
+'''Level-of-detail decimation for plotting long signals'''
+import numpy as np
+from modules.utility import print_debug
+
+
+class DecimatedCurve():
+    """Min/max pyramid of a curve, used to draw only what the view can show"""
+
+    def __init__(self, time=(), magnitude=(), points_per_pixel: int = 2) -> None:
+        self.points_per_pixel = points_per_pixel
+        self.origin = None
+        """Time, magnitude and channel the curve was set from, see
+        curvefit.set_curve_data"""
+        self.set_data(time, magnitude)
+
+    def __len__(self):
+        return len(self.time)
+
+    def set_data(self, time, magnitude):
+        """Sets the full resolution curve and rebuilds the pyramid"""
+        self.time = np.asarray(time, dtype=float)
+        self.magnitude = np.asarray(magnitude, dtype=float)
+        self.source = None
+        self.last_view = None
+        self.origin = None
+        if len(self.time) != len(self.magnitude):
+            raise Exception("Curve must have the same time and magnitude length")
+
+        # level k holds the min and max of every block of 2**(k+1) samples
+        self.levels = []
+        mins = maxs = self.magnitude
+        while len(mins) > 1:
+            if len(mins) % 2 == 1:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.fmin(mins[0::2], mins[1::2])
+            maxs = np.fmax(maxs[0::2], maxs[1::2])
+            self.levels.append((mins, maxs))
+        print_debug("LOD levels: " + str(len(self.levels)))
+
+    def set_source(self, time, source, channel=None):
+        """Sets a curve that is only evaluated over the viewed range
+        \n source = anything sliced by sample index, such as a PiecewiseModel
+        \n channel = column of multi-channel sources to draw"""
+        self.time = np.asarray(time, dtype=float)
+        self.magnitude = None
+        self.levels = []
+        self.source = source
+        self.channel = channel
+        self.last_view = None
+        self.origin = None
+        if len(self.time) != len(source):
+            raise Exception("Curve must have the same time and magnitude length")
+
+    def get_samples(self, start, stop):
+        """Returns the magnitude of samples [start, stop)"""
+        if self.source is None:
+            return self.magnitude[start:stop]
+        values = self.source[start:stop]
+        if self.channel is not None:
+            values = values[:, self.channel]
+        return values
+
+    def get_range(self):
+        """Returns the (min, max) of the curve, from the top of the pyramid"""
+        if len(self.levels) != 0:
+            return self.levels[-1][0][0], self.levels[-1][1][0]
+        if self.source is None and len(self.magnitude) != 0:
+            return np.nanmin(self.magnitude), np.nanmax(self.magnitude)
+        return np.nan, np.nan
+
+    def get_view(self, x_min=-np.inf, x_max=np.inf, width: int = 1000):
+        """Returns (time, magnitude) covering [x_min, x_max] with about
+        points_per_pixel points for each of the given horizontal pixels"""
+        if len(self.time) == 0:
+            return self.time, self.time
+
+        # one sample of margin on each side so lines reach the view edges
+        start = max(np.searchsorted(self.time, x_min, side="left") - 1, 0)
+        stop = min(np.searchsorted(self.time, x_max, side="right") + 1,
+                   len(self.time))
+        if stop <= start:
+            return self.time[0:0], self.time[0:0]
+
+        # redraws of an unchanged view, such as under auto range, are free
+        width = max(int(width), 1)
+        if self.last_view is not None and self.last_view[0] == (start, stop, width):
+            return self.last_view[1]
+        view = self.get_range_view(start, stop, width)
+        self.last_view = ((start, stop, width), view)
+        return view
+
+    def get_range_view(self, start, stop, width):
+        """get_view of samples [start, stop)"""
+        if stop - start <= self.points_per_pixel * width:
+            return self.time[start:stop], self.get_samples(start, stop)
+
+        # smallest block size that leaves at most one min/max pair per pixel
+        level = max(int(np.ceil(np.log2((stop - start) / width))) - 1, 0)
+        if self.source is None:
+            level = min(level, len(self.levels) - 1)
+            block = 2 ** (level + 1)
+            first_block = start // block
+            last_block = -(-stop // block)
+            mins, maxs = self.levels[level]
+            mins = mins[first_block:last_block]
+            maxs = maxs[first_block:last_block]
+            end = self.magnitude[stop - 1]
+        else:
+            # only the viewed samples are evaluated, reduced on the spot
+            block = 2 ** (level + 1)
+            first_block = start // block
+            last_block = -(-stop // block)
+            values = self.get_samples(first_block * block,
+                                      min(last_block * block, len(self.time)))
+            padded = np.full((last_block - first_block) * block, values[-1])
+            padded[:len(values)] = values
+            padded = padded.reshape(-1, block)
+            mins, maxs = np.nanmin(padded, axis=1), np.nanmax(padded, axis=1)
+            end = values[stop - 1 - first_block * block]
+
+        block_time = self.time[first_block * block:last_block * block:block]
+        time = np.repeat(block_time, 2)
+        magnitude = np.empty(len(time))
+        magnitude[0::2] = mins
+        magnitude[1::2] = maxs
+
+        # keep the true end point so the drawn extent matches the data
+        time = np.append(time, self.time[stop - 1])
+        magnitude = np.append(magnitude, end)
+        return time, magnitude
@@ -0,0 +1,139 @@
+'''Residual metrics of a fit, computed block by block in reused buffers so
+that long and memory-mapped signals never need full-length temporaries'''
+import threading
+import numpy as np
+
+BLOCK_SIZE = 65536
+"""Samples processed per block"""
+
+EPSILON = 1e-12
+"""Floor of the denominators of relative errors"""
+
+workspace = threading.local()
+"""Scratch buffers of the calling thread, kept between calls"""
+
+
+def get_buffers(shape):
+    """Returns two float scratch buffers of the given shape"""
+    buffers = getattr(workspace, "buffers", None)
+    if buffers is None or len(buffers[0]) < shape[0] or buffers[0].shape[1:] != shape[1:]:
+        buffers = (np.empty(shape), np.empty(shape))
+        workspace.buffers = buffers
+    return buffers[0][:shape[0]], buffers[1][:shape[0]]
+
+
+def residual_metrics(original, fitted, chunk_starts=None,
+                     block_size: int = BLOCK_SIZE, epsilon: float = EPSILON):
+    """Error metrics of fitted against the first len(fitted) samples of
+    original, in one pass over both
+    \n chunk_starts = optional sorted start indices of the fitted chunks,
+    \n adds per-chunk errors
+    \n returns a dict of percentage (mean absolute error relative to the mean
+    \n of original, the UI's error label, unbounded for signals averaging
+    \n near zero), mape, rmse, nrmse (relative to the range of original, what
+    \n error maps are scored by), max_error, mean_absolute_error, and
+    \n chunk_mae, chunk_rmse, chunk_max_error arrays when chunk_starts is given"""
+    return metrics_from_sums(residual_sums(original, fitted, chunk_starts,
+                                           block_size, epsilon), epsilon)
+
+
+def residual_sums(original, fitted, chunk_starts=None,
+                  block_size: int = BLOCK_SIZE, epsilon: float = EPSILON):
+    """Running sums behind residual_metrics, sums of separate parts of a
+    signal add up through combine_sums"""
+    n = len(fitted)
+    trailing = np.shape(fitted)[1:]
+    values_per_sample = int(np.prod(trailing))
+
+    absolute_sum = squared_sum = relative_sum = original_sum = 0.0
+    max_error = 0.0
+    original_min, original_max = np.inf, -np.inf
+
+    if chunk_starts is not None:
+        chunk_starts = np.asarray(chunk_starts, dtype=int)
+        chunk_absolute = np.zeros(len(chunk_starts))
+        chunk_squared = np.zeros(len(chunk_starts))
+        chunk_max = np.zeros(len(chunk_starts))
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        error, scratch = get_buffers((stop - start,) + trailing)
+        block = original[start:stop]
+
+        np.subtract(block, fitted[start:stop], out=error)
+        np.absolute(error, out=error)
+        absolute_sum += error.sum()
+        max_error = max(max_error, error.max())
+
+        original_sum += block.sum()
+        original_min = min(original_min, block.min())
+        original_max = max(original_max, block.max())
+
+        np.absolute(block, out=scratch)
+        np.maximum(scratch, epsilon, out=scratch)
+        np.divide(error, scratch, out=scratch)
+        relative_sum += scratch.sum()
+
+        np.multiply(error, error, out=scratch)
+        squared_sum += scratch.sum()
+
+        if chunk_starts is not None:
+            # chunks starting inside this block, plus the one running into it
+            first = np.searchsorted(chunk_starts, start, side="right") - 1
+            last = np.searchsorted(chunk_starts, stop, side="left")
+            offsets = np.maximum(chunk_starts[first:last], start) - start
+            chunks = slice(first, last)
+            chunk_absolute[chunks] += np.add.reduceat(
+                error, offsets, axis=0).reshape(len(offsets), -1).sum(axis=1)
+            chunk_squared[chunks] += np.add.reduceat(
+                scratch, offsets, axis=0).reshape(len(offsets), -1).sum(axis=1)
+            chunk_max[chunks] = np.maximum(chunk_max[chunks], np.maximum.reduceat(
+                error, offsets, axis=0).reshape(len(offsets), -1).max(axis=1))
+
+    sums = {"values": n * values_per_sample, "absolute": absolute_sum,
+            "squared": squared_sum, "relative": relative_sum,
+            "original": original_sum, "original_min": original_min,
+            "original_max": original_max, "max_error": max_error}
+    if chunk_starts is not None:
+        sums["chunk_values"] = np.diff(np.append(chunk_starts, n)) * values_per_sample
+        sums["chunk_absolute"] = chunk_absolute
+        sums["chunk_squared"] = chunk_squared
+        sums["chunk_max"] = chunk_max
+    return sums
+
+
+def combine_sums(parts):
+    """residual_sums of consecutive parts of a signal, as one"""
+    sums = {"values": sum(part["values"] for part in parts),
+            "original_min": min(part["original_min"] for part in parts),
+            "original_max": max(part["original_max"] for part in parts),
+            "max_error": max(part["max_error"] for part in parts)}
+    for name in ["absolute", "squared", "relative", "original"]:
+        sums[name] = sum(part[name] for part in parts)
+    if all("chunk_values" in part for part in parts):
+        for name in ["chunk_values", "chunk_absolute", "chunk_squared", "chunk_max"]:
+            sums[name] = np.concatenate([part[name] for part in parts])
+    return sums
+
+
+def metrics_from_sums(sums, epsilon: float = EPSILON):
+    """residual_metrics from residual_sums"""
+    n_values = max(sums["values"], 1)
+    mean_absolute_error = sums["absolute"] / n_values
+    rmse = np.sqrt(sums["squared"] / n_values)
+    metrics = {
+        "percentage": 100 * mean_absolute_error / max(abs(sums["original"] / n_values), epsilon),
+        "mape": 100 * sums["relative"] / n_values,
+        "rmse": rmse,
+        "nrmse": rmse / max(sums["original_max"] - sums["original_min"], epsilon)
+        if sums["values"] else 0.0,
+        "max_error": sums["max_error"],
+        "mean_absolute_error": mean_absolute_error,
+    }
+
+    if "chunk_values" in sums:
+        chunk_values = np.maximum(sums["chunk_values"], 1)
+        metrics["chunk_mae"] = sums["chunk_absolute"] / chunk_values
+        metrics["chunk_rmse"] = np.sqrt(sums["chunk_squared"] / chunk_values)
+        metrics["chunk_max_error"] = sums["chunk_max"]
+    return metrics
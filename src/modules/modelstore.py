@@ -0,0 +1,246 @@
+'''Compact columnar store of a piecewise fit, evaluated at any times'''
+import os
+import numpy as np
+from scipy import interpolate as interp
+from modules.utility import print_debug
+
+MODEL_TYPES = ["polynomial", "spline", "hermite"]
+
+MODEL_FILE_MAGIC = b"PWMODEL"
+MODEL_FILE_VERSION = 1
+"""Bumped whenever the layout of model files changes"""
+
+ARRAY_FIELDS = ["breaks", "piece_models", "coefficients",
+                "knots", "knot_offsets", "coef_offsets"]
+ARRAY_DTYPES = ["<f8", "<i8", "<f8", "<f8", "<i8", "<i8"]
+"""Arrays of a PiecewiseStore in file order, with their on-disk types"""
+
+MODEL_FILE_HEADER = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("type", "<u4"),
+    ("degree", "<u4"), ("channels", "<u4"),
+    ("ndim", "<u4", (len(ARRAY_FIELDS),)),
+    ("shape", "<u8", (len(ARRAY_FIELDS), 3)),
+    ("offset", "<u8", (len(ARRAY_FIELDS),))])
+"""Fixed size header of a model file, each array starts at its offset"""
+
+ALIGNMENT = 64
+"""Byte alignment of the arrays in model files"""
+
+
+def group_rows(keys):
+    """Yields (key, rows) for each distinct key of an array"""
+    order = np.argsort(keys, kind="stable")
+    present, first = np.unique(keys[order], return_index=True)
+    return zip(present, np.split(order, first[1:]))
+
+
+class PiecewiseStore():
+    """Fitted chunk models as flat arrays
+    \n breaks = start time of each piece, a piece runs up to the next break
+    \n piece_models = (pieces, 2) model indices of each piece, overlaps
+    \n average two models (previous chunk first), otherwise the second is -1
+    \n polynomial: coefficients = (models, order + 1[, channels]) in np.polyfit
+    \n order
+    \n spline: knots and coefficients of every (model, channel) spline packed
+    \n end to end, knot_offsets and coef_offsets mark where each one starts
+    \n hermite: knots are the breakpoints of each model, coefficients
+    \n (intervals, 4[, channels]) the cubic of each interval"""
+
+    def __init__(self, type, breaks, piece_models, coefficients, knots=None,
+                 knot_offsets=None, coef_offsets=None, degree: int = 0,
+                 channels: int = 0) -> None:
+        if type not in MODEL_TYPES:
+            raise Exception("Model type must be " + ", ".join(MODEL_TYPES))
+        self.type = type
+        self.breaks = np.asarray(breaks, dtype=float)
+        self.piece_models = np.asarray(piece_models, dtype=np.int64).reshape(-1, 2)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.knots = np.asarray(knots if knots is not None else [], dtype=float)
+        self.knot_offsets = np.asarray(
+            knot_offsets if knot_offsets is not None else [0], dtype=np.int64)
+        self.coef_offsets = np.asarray(
+            coef_offsets if coef_offsets is not None else [0], dtype=np.int64)
+        self.degree = degree
+        self.channels = channels
+        """Channels of multi-channel fits, 0 for single channel"""
+
+    def __len__(self):
+        return len(self.breaks)
+
+    @classmethod
+    def from_chunks(cls, type, chunked, models):
+        """Builds the store of a chunked fit
+        \n chunked = ChunkedSignal the models were fitted to
+        \n models = fitted model of each chunk, see chunkfit.evaluate_model"""
+        time = np.asarray(chunked.time)
+        channels = chunked.get_channel_count() if np.ndim(chunked.magnitude) > 1 else 0
+
+        starts, piece_models = [], []
+        for index in range(len(models)):
+            start, stop = chunked.get_chunk_range(index)
+            if index > 0:
+                shared = min(start + chunked.get_left_overlap_length(index), stop)
+                if shared > start:
+                    starts.append(start)
+                    piece_models.append((index - 1, index))
+                    start = shared
+            if stop > start:
+                starts.append(start)
+                piece_models.append((index, -1))
+        breaks = time[np.array(starts, dtype=int)]
+
+        if type == "polynomial":
+            order = max(len(model) for model in models)
+            coefficients = np.zeros((len(models), order) + np.shape(models[0])[1:])
+            for index, model in enumerate(models):
+                # leading zeros leave np.polyval's Horner steps unchanged
+                coefficients[index, order - len(model):] = model
+            return cls(type, breaks, piece_models, coefficients, channels=channels)
+
+        if type == "spline":
+            parts = [part for model in models for part in spline_parts(model)]
+            knots = [part[0] for part in parts]
+            coefficients = [part[1] for part in parts]
+            degree = parts[0][2]
+            return cls(type, breaks, piece_models, np.concatenate(coefficients),
+                       np.concatenate(knots), cumulative_offsets(knots),
+                       cumulative_offsets(coefficients), degree, channels)
+
+        # PCHIP interpolators are piecewise cubics already
+        coefficients = [np.moveaxis(model.c, 0, 1) for model in models]
+        knots = [model.x for model in models]
+        return cls(type, breaks, piece_models, np.concatenate(coefficients),
+                   np.concatenate(knots), cumulative_offsets(knots),
+                   cumulative_offsets(coefficients), 3, channels)
+
+    def get_pieces(self, time):
+        """Returns the piece of each time, O(log n) per time"""
+        pieces = np.searchsorted(self.breaks, time, side="right") - 1
+        return np.clip(pieces, 0, len(self.breaks) - 1)
+
+    def evaluate(self, time):
+        """Evaluates the fit at any times, outside the fitted range the edge
+        models extrapolate"""
+        time = np.asarray(time, dtype=float)
+        pieces = self.get_pieces(time.ravel())
+        first, second = self.piece_models[pieces].T
+        values = self.evaluate_models(first, time.ravel())
+        shared = second >= 0
+        if shared.any():
+            values[shared] = (values[shared]
+                              + self.evaluate_models(second[shared], time.ravel()[shared])) / 2
+        return values.reshape(time.shape + values.shape[1:])
+
+    def evaluate_models(self, models, time):
+        """Evaluates model models[i] at time[i]"""
+        if self.type == "polynomial":
+            # Horner over every point at once, as np.polyval does
+            coefficients = self.coefficients[models]
+            if coefficients.ndim > 2:
+                time = time[:, np.newaxis]
+            values = np.zeros(np.broadcast(time, coefficients[:, 0]).shape)
+            for power in range(coefficients.shape[1]):
+                values = values * time + coefficients[:, power]
+            return values
+
+        values = np.empty((len(time), self.channels) if self.channels else len(time))
+        for model, rows in group_rows(models):
+            values[rows] = self.evaluate_model(model, time[rows])
+        return values
+
+    def evaluate_model(self, model, time):
+        """Evaluates one spline or PCHIP model"""
+        if self.type == "spline":
+            columns = []
+            for spline in range(model * max(self.channels, 1),
+                                (model + 1) * max(self.channels, 1)):
+                knots = self.knots[self.knot_offsets[spline]:self.knot_offsets[spline + 1]]
+                coef = self.coefficients[self.coef_offsets[spline]:self.coef_offsets[spline + 1]]
+                columns.append(interp.splev(time, (knots, coef, self.degree)))
+            return np.column_stack(columns) if self.channels else columns[0]
+
+        knots = self.knots[self.knot_offsets[model]:self.knot_offsets[model + 1]]
+        coef = self.coefficients[self.coef_offsets[model]:self.coef_offsets[model + 1]]
+        return interp.PPoly.construct_fast(np.moveaxis(coef, 0, 1), knots)(time)
+
+
+def spline_parts(model):
+    """(knots, coefficients, degree) of each channel of a spline model: a
+    UnivariateSpline, a list of them (one per channel) or a BSpline"""
+    if isinstance(model, interp.BSpline):
+        return [(model.t, column, model.k)
+                for column in model.c.reshape(len(model.c), -1).T]
+    parts = []
+    for spline in (model if isinstance(model, list) else [model]):
+        interior = spline.get_knots()
+        coef = spline.get_coeffs()
+        degree = len(coef) - len(interior) + 1
+        parts.append((np.concatenate([np.repeat(interior[0], degree), interior,
+                                      np.repeat(interior[-1], degree)]), coef, degree))
+    return parts
+
+
+def cumulative_offsets(arrays):
+    """Start of each array when packed end to end, plus the total length"""
+    return np.concatenate([[0], np.cumsum([len(array) for array in arrays])])
+
+
+def save_model(store, path):
+    """Writes a PiecewiseStore as a model file: a MODEL_FILE_HEADER, then
+    each of ARRAY_FIELDS little-endian and C-ordered at an aligned offset"""
+    header = np.zeros(1, dtype=MODEL_FILE_HEADER)
+    header["magic"] = MODEL_FILE_MAGIC
+    header["version"] = MODEL_FILE_VERSION
+    header["type"] = MODEL_TYPES.index(store.type)
+    header["degree"] = store.degree
+    header["channels"] = store.channels
+
+    arrays = []
+    offset = MODEL_FILE_HEADER.itemsize
+    for index, (field, dtype) in enumerate(zip(ARRAY_FIELDS, ARRAY_DTYPES)):
+        array = np.ascontiguousarray(getattr(store, field), dtype=dtype)
+        if array.ndim > 3:
+            raise Exception("Model arrays have at most 3 dimensions")
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header["ndim"][0, index] = array.ndim
+        header["shape"][0, index, :array.ndim] = array.shape
+        header["offset"][0, index] = offset
+        arrays.append((offset, array))
+        offset += array.nbytes
+
+    # write then rename, so readers never see half a file
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header.tobytes())
+        for offset, array in arrays:
+            file.write(bytes(offset - file.tell()))
+            file.write(array.tobytes())
+    os.replace(temporary_path, path)
+    print_debug("Saved model: " + path + " (" + str(offset) + " bytes)")
+
+
+def load_model(path, mmap: bool = True):
+    """Reads a model file written by save_model as a PiecewiseStore
+    \n mmap = map the arrays rather than reading them, so only the pages
+    \n that evaluations touch are ever read"""
+    header = np.fromfile(path, dtype=MODEL_FILE_HEADER, count=1)
+    if len(header) == 0 or header["magic"][0] != MODEL_FILE_MAGIC:
+        raise Exception("Not a model file: " + path)
+    header = header[0]
+    if header["version"] > MODEL_FILE_VERSION:
+        raise Exception("Model file version " + str(header["version"]) +
+                        " is newer than " + str(MODEL_FILE_VERSION))
+
+    arrays = {}
+    for index, (field, dtype) in enumerate(zip(ARRAY_FIELDS, ARRAY_DTYPES)):
+        shape = tuple(int(size) for size in header["shape"][index, :header["ndim"][index]])
+        if np.prod(shape) == 0 or not mmap:
+            with open(path, "rb") as file:
+                file.seek(int(header["offset"][index]))
+                arrays[field] = np.fromfile(
+                    file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        else:
+            arrays[field] = np.memmap(path, dtype=dtype, mode="r",
+                                      offset=int(header["offset"][index]), shape=shape)
+    return PiecewiseStore(MODEL_TYPES[header["type"]], degree=int(header["degree"]),
+                          channels=int(header["channels"]), **arrays)
@@ -0,0 +1,245 @@
+'''Power moment tables of a signal, the least squares polynomial of any
+contiguous segment is assembled from them without rescanning its samples'''
+import numpy as np
+from scipy.special import comb
+from modules.utility import print_debug
+
+BLOCK_SIZE = 16
+"""Samples summed per block, shorter segments are summed directly"""
+
+
+def shift_matrices(alpha, beta, size):
+    """Matrices taking the power moments of u to those of beta u + alpha,
+    one (size, size) matrix per pair"""
+    powers = np.arange(size)
+    difference = powers[:, np.newaxis] - powers
+    lower = difference >= 0
+    alpha_powers = np.asarray(alpha, dtype=float)[:, np.newaxis] ** powers
+    beta_powers = np.asarray(beta, dtype=float)[:, np.newaxis] ** powers
+    return (comb(powers[:, np.newaxis], powers) * lower
+            * alpha_powers[:, np.where(lower, difference, 0)]
+            * beta_powers[:, np.newaxis, :])
+
+
+class MomentTable():
+    """Sums of x^k and x^k y over blocks of the signal and a binary tree of
+    blocks, each taken about its own center (x = (t - center) / half width)
+    so that sums over a segment stay well conditioned after shifting them
+    to the segment's own center. The y sums are likewise taken about each
+    node's mean, so a large baseline doesn't cancel out of the residuals.
+    \n Segments of the signal are assembled in O(K^2 log n), K = max_order"""
+
+    def __init__(self, time, magnitude, max_order: int = 3,
+                 block_size: int = BLOCK_SIZE) -> None:
+        self.time = np.asarray(time, dtype=float)
+        self.magnitude = np.asarray(magnitude, dtype=float).reshape(len(self.time), -1)
+        self.max_order = max_order
+        self.block_size = block_size
+        self.n_moments = 2 * max_order + 1
+
+        n = len(self.time)
+        n_blocks = max(-(-n // block_size), 1)
+        # bottom level padded to a power of two for the tree
+        n_leaves = 1 << int(np.ceil(np.log2(n_blocks)))
+        padded = n_leaves * block_size
+        indices = np.minimum(np.arange(padded), max(n - 1, 0))
+        valid = (np.arange(padded) < n).reshape(n_leaves, block_size)
+
+        time = self.time[indices].reshape(n_leaves, block_size)
+        magnitude = self.magnitude[indices].reshape(n_leaves, block_size, -1)
+        first = time[:, 0]
+        last = np.where(valid, time, -np.inf).max(axis=1)
+        last = np.where(np.isfinite(last), last, first)
+        centers, half_widths = self.get_frame(first, last)
+
+        x = (time - centers[:, np.newaxis]) / half_widths[:, np.newaxis]
+        powers = x[..., np.newaxis] ** np.arange(self.n_moments) * valid[..., np.newaxis]
+        counts = np.maximum(valid.sum(axis=1), 1)[:, np.newaxis]
+        references = np.sum(magnitude * valid[..., np.newaxis], axis=1) / counts
+        magnitude = (magnitude - references[:, np.newaxis]) * valid[..., np.newaxis]
+        cross = (powers[..., :max_order + 1, np.newaxis]
+                 * magnitude[:, :, np.newaxis, :])
+        squares = np.sum(magnitude ** 2, axis=2)
+
+        def inner(values):
+            """Sums over the first k samples of each block, k = 0..block_size"""
+            return np.concatenate([np.zeros((n_leaves, 1) + values.shape[2:]),
+                                   np.cumsum(values, axis=1)], axis=1)
+        self.inner = (inner(powers), inner(cross), inner(squares))
+        """Partial block sums, about the block center and mean"""
+
+        level = (self.inner[0][:, -1], self.inner[1][:, -1], self.inner[2][:, -1],
+                 centers, half_widths, first, last, references)
+        self.levels = [level]
+        """Tree nodes per level: power, cross and square sums, center, half
+        width, first and last time, mean of y"""
+        while len(level[0]) > 1:
+            level = self.merge_nodes(level)
+            self.levels.append(level)
+        print_debug("Moment table: " + str(n_blocks) + " blocks, " +
+                    str(len(self.levels)) + " levels")
+
+    def __len__(self):
+        return len(self.time)
+
+    def get_frame(self, first, last):
+        """Returns (center, half width) of spans of time"""
+        half_widths = (last - first) / 2
+        return (first + last) / 2, np.where(half_widths > 0, half_widths, 1)
+
+    def merge_nodes(self, level):
+        """Returns the next level of the tree, each node the sum of two"""
+        powers, cross, squares, centers, half_widths, first, last, references = level
+        first, last = first[0::2], np.maximum(last[0::2], last[1::2])
+        parent_centers, parent_half_widths = self.get_frame(first, last)
+        shifts = shift_matrices(
+            (centers - np.repeat(parent_centers, 2)) / np.repeat(parent_half_widths, 2),
+            half_widths / np.repeat(parent_half_widths, 2), self.n_moments)
+        powers, cross = self.shift(shifts, powers, cross)
+        # the parent's mean, padding-only nodes count for nothing
+        counts = powers[:, :1]
+        total = counts[0::2] + counts[1::2]
+        parent_references = np.where(
+            total > 0, (counts[0::2] * references[0::2] + counts[1::2] * references[1::2])
+            / np.maximum(total, 1), references[0::2])
+        cross, squares = self.rereference(powers, cross, squares, references,
+                                          np.repeat(parent_references, 2, axis=0))
+        return (powers[0::2] + powers[1::2], cross[0::2] + cross[1::2],
+                squares[0::2] + squares[1::2], parent_centers,
+                parent_half_widths, first, last, parent_references)
+
+    def shift(self, shifts, powers, cross):
+        """Applies shift matrices to power and cross sums"""
+        order = self.max_order + 1
+        return (np.einsum("skj,sj->sk", shifts, powers),
+                np.einsum("skj,sjc->skc", shifts[:, :order, :order], cross))
+
+    def rereference(self, powers, cross, squares, references, new_references):
+        """Cross and square sums about new means of y, from sums about the
+        old ones, without summing raw squares of y"""
+        difference = references - new_references
+        cross = cross + powers[:, :self.max_order + 1, np.newaxis] * difference[:, np.newaxis]
+        squares = squares + np.sum(difference * (2 * cross[:, 0] - powers[:, :1] * difference),
+                                   axis=1)
+        return cross, squares
+
+    def segment_sums(self, starts, stops):
+        """Sums over each segment [start, stop) about its own center
+        \n returns (sums of x^k for k <= 2 max_order, sums of x^k (y - m) for
+        \n k <= max_order, sums of (y - m)^2, m), x spans [-1, 1] over the
+        \n segment and m is the mean of y over it"""
+        starts = np.asarray(starts, dtype=int)
+        stops = np.asarray(stops, dtype=int)
+        centers, half_widths = self.get_frame(self.time[starts], self.time[stops - 1])
+        short = stops - starts < 2 * self.block_size
+
+        powers = np.zeros((len(starts), self.n_moments))
+        cross = np.zeros((len(starts), self.max_order + 1, self.magnitude.shape[1]))
+        squares = np.zeros(len(starts))
+        references = np.zeros((len(starts), self.magnitude.shape[1]))
+        if short.any():
+            sums = self.direct_sums(starts[short], stops[short],
+                                    centers[short], half_widths[short])
+            powers[short], cross[short], squares[short], references[short] = sums
+
+        segments = np.flatnonzero(~short)
+        if len(segments) == 0:
+            return powers, cross, squares, references
+        starts, stops = starts[segments], stops[segments]
+        centers, half_widths = centers[segments], half_widths[segments]
+        block = self.block_size
+        leaves = self.levels[0]
+        # sums are gathered about the mean of the first block, then moved
+        # to the segment's own mean
+        references[segments] = leaves[7][starts // block]
+
+        def add(rows, sums, node_centers, node_half_widths, node_references):
+            """Shifts node sums into the frames of the given segments"""
+            shifts = shift_matrices((node_centers - centers[rows]) / half_widths[rows],
+                                    node_half_widths / half_widths[rows], self.n_moments)
+            node_powers, node_cross = self.shift(shifts, sums[0], sums[1])
+            node_cross, node_squares = self.rereference(
+                node_powers, node_cross, sums[2], node_references,
+                references[segments[rows]])
+            np.add.at(powers, segments[rows], node_powers)
+            np.add.at(cross, segments[rows], node_cross)
+            np.add.at(squares, segments[rows], node_squares)
+
+        # partial blocks at either end
+        all_rows = np.arange(len(segments))
+        head_block, head_offset = np.divmod(starts, block)
+        head = head_offset > 0
+        head_rows = all_rows[head]
+        add(head_rows, [total[head_block[head]] - partial[head_block[head], head_offset[head]]
+                        for total, partial in zip(leaves[:3], self.inner)],
+            leaves[3][head_block[head]], leaves[4][head_block[head]],
+            leaves[7][head_block[head]])
+        tail_block, tail_offset = np.divmod(stops, block)
+        tail = tail_offset > 0
+        add(all_rows[tail], [partial[tail_block[tail], tail_offset[tail]]
+                             for partial in self.inner],
+            leaves[3][tail_block[tail]], leaves[4][tail_block[tail]],
+            leaves[7][tail_block[tail]])
+
+        # whole blocks in between, bottom up through the tree
+        left = head_block + head
+        right = tail_block
+        for level in self.levels:
+            if not (left < right).any():
+                break
+            take = (left < right) & (left % 2 == 1)
+            add(all_rows[take], [sums[left[take]] for sums in level[:3]],
+                level[3][left[take]], level[4][left[take]], level[7][left[take]])
+            left = left + take
+            take = (left < right) & (right % 2 == 1)
+            right = right - take
+            add(all_rows[take], [sums[right[take]] for sums in level[:3]],
+                level[3][right[take]], level[4][right[take]], level[7][right[take]])
+            left, right = left // 2, right // 2
+
+        means = references[segments] + cross[segments, 0] / powers[segments, :1]
+        cross[segments], squares[segments] = self.rereference(
+            powers[segments], cross[segments], squares[segments],
+            references[segments], means)
+        references[segments] = means
+        return powers, cross, squares, references
+
+    def direct_sums(self, starts, stops, centers, half_widths):
+        """segment_sums of short segments, straight from the samples"""
+        offsets = np.arange(min(2 * self.block_size, max(np.max(stops - starts), 1)))
+        indices = starts[:, np.newaxis] + offsets
+        valid = indices < stops[:, np.newaxis]
+        indices = np.minimum(indices, len(self) - 1)
+        x = (self.time[indices] - centers[:, np.newaxis]) / half_widths[:, np.newaxis]
+        powers = x[..., np.newaxis] ** np.arange(self.n_moments) * valid[..., np.newaxis]
+        magnitude = self.magnitude[indices]
+        means = (np.sum(magnitude * valid[..., np.newaxis], axis=1)
+                 / np.maximum(valid.sum(axis=1), 1)[:, np.newaxis])
+        magnitude = (magnitude - means[:, np.newaxis]) * valid[..., np.newaxis]
+        return (powers.sum(axis=1),
+                np.einsum("skj,skc->sjc", powers[..., :self.max_order + 1], magnitude),
+                np.sum(magnitude ** 2, axis=(1, 2)), means)
+
+    def fit_segments(self, starts, stops, order):
+        """Least squares polynomials of each segment from their normal
+        equations
+        \n returns (coefficients in increasing powers of the segment's x,
+        \n shaped (segments, order + 1, channels), residual sums of squares)"""
+        if order > self.max_order:
+            raise Exception("Order must be at most " + str(self.max_order))
+        powers, cross, squares, means = self.segment_sums(starts, stops)
+        terms = np.arange(order + 1)
+        normal_matrix = powers[:, terms[:, np.newaxis] + terms]
+        cross = cross[:, :order + 1]
+        # a touch of ridge keeps segments shorter than the order solvable
+        ridge = 1e-12 * np.trace(normal_matrix, axis1=1, axis2=2)
+        normal_matrix = normal_matrix + ridge[:, np.newaxis, np.newaxis] * np.eye(order + 1)
+        coef = np.linalg.solve(normal_matrix, cross)
+        rss = np.maximum(squares - np.sum(coef * cross, axis=(1, 2)), 0)
+        coef[:, 0] += means
+        return coef, rss
+
+    def segment_rss(self, starts, stops, order):
+        """Residual sum of squares of the least squares polynomial of each
+        segment [start, stop)"""
+        return self.fit_segments(starts, stops, order)[1]
@@ -4,11 +4,10 @@ import numpy as np
 from modules.utility import print_debug
 from modules.curvefit import *
 from modules import curvefit
+from modules.modelstore import save_model, MODEL_TYPES
 import wfdb
 import csv
 
-MAX_SAMPLES = 300
-
 
 def browse_window(self):
     """Open file dialog to select a file"""
@@ -20,6 +19,32 @@ def browse_window(self):
     open_file(self, path)
 
 
+def save_model_window(self):
+    """Save file dialog to store the fitted models of the interpolation"""
+    if self.signal_processor.interpolation_type is None:
+        print_debug("Nothing fitted to save")
+        return
+    if self.signal_processor.interpolation_type not in MODEL_TYPES:
+        print_debug("No piecewise model to save for " +
+                    self.signal_processor.interpolation_type)
+        return
+    path = QFileDialog.getSaveFileName(
+        None, 'save the fitted model', './', filter="Piecewise Model(*.pwm)")[0]
+    if path == '':
+        print_debug("No file selected")
+        return
+    save_model(self.signal_processor.get_model_store(), path)
+
+
+def channel_magnitude(rows):
+    """Rows of channel values as (samples, channels), flattened for a single
+    channel, None when there are no samples"""
+    values = np.array(rows, dtype=float)
+    if values.ndim != 2 or values.size == 0:
+        return None
+    return values[:, 0] if values.shape[1] == 1 else values
+
+
 def open_file(self, path):
     """Open the file and read the data"""
 
@@ -35,12 +60,14 @@ def open_file(self, path):
 
     if filetype == "rec" or filetype == "dat" or filetype == "hea":
 
-        # open wfdb file
-        self.record = wfdb.rdrecord(path[:-4], channels=[0])
+        # open wfdb file, all channels as (samples, channels)
+        self.record = wfdb.rdrecord(path[:-4])
 
         # update signal object
-        temp_magnitude = np.concatenate(
-            self.record.p_signal)
+        temp_magnitude = channel_magnitude(self.record.p_signal)
+        if temp_magnitude is None:
+            print_debug("No samples in " + path)
+            return
 
         self.signal = Signal(magnitude=temp_magnitude, fsample=self.record.fs)
 
@@ -48,15 +75,29 @@ def open_file(self, path):
         with open(path, 'r') as csvFile:    # 'r' its a mode for reading and writing
             csvReader = csv.reader(csvFile, delimiter=',')
             for line in csvReader:
+                if len(line) == 0:
+                    continue
+                # every column after time is a channel
                 temp_magnitude.append(
-                    float(line[1]))
+                    [float(value) for value in line[1:]])
                 temp_time.append(
                     float(line[0]))
+        temp_magnitude = channel_magnitude(temp_magnitude)
+        if temp_magnitude is None:
+            print_debug("No samples in " + path)
+            return
         self.signal = Signal(magnitude=temp_magnitude, time=temp_time)
 
     print_debug("Record loaded")
 
-    self.signal.set_max_samples(MAX_SAMPLES)
+    # the fitting workers outlive records
+    chunk_executor = self.signal_processor.chunk_executor
     self.signal_processor = SignalProcessor(self.signal)
+    self.signal_processor.chunk_executor = chunk_executor
+    self.signal_processor.set_lazy_evaluation(True)
+
+    self.channel_index = 0
+    self.channel_spinBox.setMaximum(self.signal.get_channel_count() - 1)
+    self.channel_spinBox.setValue(0)
 
     curvefit.update_graph(self)
@@ -0,0 +1,37 @@
+'''Piecewise fitted signal, evaluated only for the samples that are asked for'''
+import numpy as np
+
+
+class PiecewiseModel():
+    """Sample-indexed view of a PiecewiseStore, standing in for a merged
+    magnitude array. Slicing evaluates the models over just those samples,
+    with the overlap averaging of ChunkedSignal.merge_chunks.
+    \n time = sample times the store was fitted to"""
+
+    def __init__(self, time, store, trailing_shape=()) -> None:
+        self.time = np.asarray(time)
+        self.store = store
+        self.shape = (len(self.time),) + tuple(trailing_shape)
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        """Evaluates a slice (or array) of sample indices"""
+        if isinstance(index, slice):
+            return self.evaluate(np.arange(*index.indices(len(self))))
+        return self.evaluate(np.arange(len(self))[index])
+
+    def __array__(self, dtype=None):
+        values = self.materialize()
+        return values if dtype is None else values.astype(dtype)
+
+    def evaluate(self, indices):
+        """Returns the fitted values at the given sample indices"""
+        values = self.store.evaluate(self.time[np.asarray(indices, dtype=int)])
+        return values.reshape((len(values),) + self.shape[1:])
+
+    def materialize(self):
+        """Evaluates every sample"""
+        return self.evaluate(np.arange(len(self)))
@@ -0,0 +1,52 @@
+'''Error driven chunk boundaries, placed from moment tables so that the cost
+of any candidate segment is found without rescanning its samples'''
+import heapq
+import numpy as np
+from modules.utility import print_debug
+
+SPLIT_CANDIDATES = 64
+"""Split points tried in each segment"""
+
+
+def adaptive_chunk_starts(moments, n, order=1, max_chunks=1, tolerance=0,
+                          min_length=None):
+    """Chunk starts over the first n samples of a MomentTable, placed where
+    a polynomial of the given order fits worst. The segment whose best
+    split lowers the squared error most is split first, until there are
+    max_chunks chunks or every chunk's RMSE is within tolerance.
+    \n min_length = fewest samples in a chunk, twice the number of
+    \n coefficients (2 * (order + 1)) by default"""
+    if min_length is None:
+        min_length = 2 * (order + 1)
+    min_length = max(min_length, 1)
+    values_per_sample = moments.magnitude.shape[1]
+
+    def push(heap, start, stop):
+        """Queues the best split of a segment, unless it fits well enough"""
+        splits = np.unique(np.linspace(start + min_length, stop - min_length,
+                                       SPLIT_CANDIDATES).round().astype(int))
+        if stop - start < 2 * min_length:
+            splits = splits[:0]
+        # the segment itself and both sides of every split in one query
+        rss = moments.segment_rss(
+            np.concatenate([[start], np.full(len(splits), start), splits]),
+            np.concatenate([[stop], splits, np.full(len(splits), stop)]), order)
+        if np.sqrt(rss[0] / ((stop - start) * values_per_sample)) <= tolerance:
+            return
+        if len(splits) == 0:
+            return
+        costs = rss[1:len(splits) + 1] + rss[len(splits) + 1:]
+        best = np.argmin(costs)
+        heapq.heappush(heap, (costs[best] - rss[0], start, stop, splits[best]))
+
+    starts = [0]
+    heap = []
+    push(heap, 0, n)
+    while heap and len(starts) < max_chunks:
+        gain, start, stop, split = heapq.heappop(heap)
+        starts.append(split)
+        push(heap, start, split)
+        push(heap, split, stop)
+
+    print_debug("Adaptive chunks: " + str(len(starts)))
+    return np.sort(np.array(starts, dtype=int))
@@ -0,0 +1,81 @@
+'''Shared memory store that lets worker processes read a signal without
+pickling its arrays into every task'''
+import weakref
+import numpy as np
+from modules.signals import Signal
+from modules.utility import print_debug
+
+MAX_ATTACHED = 8
+"""Shared memory segments a worker keeps mapped between tasks"""
+
+attached_segments = {}
+"""Segments this process has attached to, by name (oldest first)"""
+
+
+def shared_memory_available():
+    """Whether multiprocessing.shared_memory exists (Python 3.8 and up)"""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return False
+    return True
+
+
+class SharedSignalStore():
+    """Publishes the arrays of a signal once in shared memory.
+    \n handle = small picklable description that workers attach to
+    \n The segments are unlinked by close() or when the store is collected"""
+
+    def __init__(self, signal) -> None:
+        self.segments = []
+        self.handle = {"fsample": signal.fsample,
+                       "time": self.publish(signal.time),
+                       "magnitude": self.publish(signal.magnitude)}
+        self.finalizer = weakref.finalize(
+            self, release_segments, self.segments)
+
+    def publish(self, array):
+        """Copies an array into a new shared segment, returns its spec"""
+        from multiprocessing import shared_memory
+        array = np.ascontiguousarray(array, dtype=float)
+        segment = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype,
+                   buffer=segment.buf)[...] = array
+        self.segments.append(segment)
+        print_debug("Published shared segment " + segment.name)
+        return (segment.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """Unlinks the shared segments, workers must be done with them"""
+        self.finalizer()
+
+
+def release_segments(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+    segments.clear()
+
+
+def attach_array(spec):
+    """Returns a zero-copy view of a published array"""
+    from multiprocessing import shared_memory
+    name, shape, dtype = spec
+    if name not in attached_segments:
+        # forget the oldest segments, unless a caller still holds a view
+        for old_name in list(attached_segments)[:-MAX_ATTACHED + 1]:
+            try:
+                attached_segments[old_name].close()
+                del attached_segments[old_name]
+            except BufferError:
+                pass
+        attached_segments[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=attached_segments[name].buf)
+
+
+def attach_signal(handle):
+    """Returns a signal viewing the shared arrays of a store handle"""
+    return Signal(magnitude=attach_array(handle["magnitude"]),
+                  fsample=handle["fsample"],
+                  time=attach_array(handle["time"]))
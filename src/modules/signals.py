@@ -8,7 +8,7 @@ from modules.utility import print_debug, print_log
 class Signal():
     """Represents a signal"""
 
-    def __init__(self, magnitude=[], fsample=0, time=[], coef=[]) -> None:
+    def __init__(self, magnitude=[], fsample=0, time=[], coef=[], model=None) -> None:
 
         self.magnitude = magnitude
         self.fsample = fsample
@@ -30,10 +30,12 @@ class Signal():
         #     raise Exception("Signal must have a time or fsampling vector")
 
         self.coefficients = coef
+        self.model = model
+        """Fitted model of the signal, see chunkfit.evaluate_model"""
 
     def __len__(self):
         """Returns the length of the signal"""
-        if self.magnitude != []:
+        if len(self.magnitude) != 0:
             return len(self.magnitude)
         else:
             print_debug("Signal has 0 length")
@@ -99,29 +101,73 @@ class Signal():
     def get_coefficients(self):
         return self.coefficients
 
+    def get_channel_count(self):
+        """Returns the number of channels, magnitude is (samples, channels)
+        for multi-channel signals"""
+        if np.ndim(self.magnitude) < 2:
+            return 1
+        return np.shape(self.magnitude)[1]
+
+    def get_channel(self, channel=0):
+        """Returns a single channel signal"""
+        if np.ndim(self.magnitude) < 2:
+            return self
+        return Signal(np.asarray(self.magnitude)[:, channel], self.fsample, self.time)
+
 
 class ChunkedSignal(Signal):
     """Represents a chunked signal"""
 
-    def __init__(self, signal, max_chunks: int = 0, overlap_percent: int = 0) -> None:
-        super().__init__(signal.magnitude, signal.fsample, signal.time)
+    def __init__(self, signal, max_chunks: int = 0, overlap_percent: int = 0,
+                 chunk_length: int = 0, chunk_starts=None) -> None:
+        # chunk boundaries index time, which files may hand over as a list
+        super().__init__(signal.magnitude, signal.fsample, np.asarray(signal.time))
 
         self.chunk_array = []
         """Array of full chunk signal objects (includes overlap)"""
         self.chunk_length = 0
+        self.overlap_length = 0
+        self.chunk_starts = np.array([], dtype=int)
+        """Index of the first sample of each chunk"""
+        self.overlap_lengths = np.array([], dtype=int)
+        """Samples each chunk runs into the next one"""
         self.overlap_percent = overlap_percent
         if len(signal.magnitude) > 0:
-            self.update_chunk_size(max_chunks)
+            if chunk_starts is not None:
+                self.set_chunk_starts(chunk_starts)
+            else:
+                self.update_chunk_size(max_chunks, chunk_length)
             # self.generate_chunks()
 
-    def update_chunk_size(self, max_chunks):
+    def update_chunk_size(self, max_chunks, chunk_length=0):
+        """Splits into max_chunks equal chunks, or into chunks of a fixed
+        chunk_length when given (keeps boundaries stable across clipping)"""
         if max_chunks == 0:
             max_chunks = 1
-        self.chunk_length = round(len(self.magnitude)/max_chunks)
+        if chunk_length > 0:
+            self.chunk_length = chunk_length
+        else:
+            self.chunk_length = round(len(self.magnitude)/max_chunks)
         print_debug("Chunk length: " + str(self.chunk_length))
         print_debug("Overlap percent: " + str(self.overlap_percent))
         self.overlap_length = int(np.ceil(
             self.chunk_length * (self.overlap_percent/100)))  # TODO: FIX THIS
+        self.chunk_starts = np.arange(0, len(self.magnitude), self.chunk_length)
+        self.overlap_lengths = np.full(len(self.chunk_starts), self.overlap_length)
+        self.generate_chunks()
+
+    def set_chunk_starts(self, chunk_starts):
+        """Splits at the given chunk starts (variable length chunks), each
+        chunk overlaps the next by overlap_percent of the shorter of the two"""
+        self.chunk_starts = np.asarray(chunk_starts, dtype=int)
+        lengths = np.diff(np.append(self.chunk_starts, len(self.magnitude)))
+        shorter = np.minimum(lengths, np.append(lengths[1:], lengths[-1]))
+        self.overlap_lengths = np.ceil(
+            shorter * (self.overlap_percent/100)).astype(int)
+        # nominal values, for display
+        self.chunk_length = int(round(lengths.mean()))
+        self.overlap_length = int(self.overlap_lengths.max())
+        print_debug("Chunk lengths: " + str(lengths))
         self.generate_chunks()
 
     def generate_chunks(self):
@@ -129,72 +175,91 @@ class ChunkedSignal(Signal):
 
         # generate chunks
         chunk_array = []
-        chunk_length = self.chunk_length
-        overlap_length = self.overlap_length
 
-        for index in range(0, len(self.magnitude), chunk_length):
-            chunk_array.append(Signal(self.magnitude[index:index+chunk_length + overlap_length],
+        for index in range(len(self.chunk_starts)):
+            start, stop = self.get_chunk_range(index)
+            stop += self.overlap_lengths[index]
+            chunk_array.append(Signal(self.magnitude[start:stop],
                                       self.fsample,
-                                      self.time[index:index +
-                                    chunk_length + overlap_length],
+                                      self.time[start:stop],
                                       self.coefficients))
 
         self.chunk_array = chunk_array
-    def merge_chunks(self):
-        """Merges chunks into the main signal superclass"""
 
-        # clear data
-        self.time = []
-        self.magnitude = []
+    def get_chunk_range(self, index):
+        """Returns (start, stop) sample indices of a chunk without overlap"""
+        start = self.chunk_starts[index]
+        if index + 1 < len(self.chunk_starts):
+            return start, self.chunk_starts[index + 1]
+        return start, len(self.magnitude)
+
+    def get_left_overlap_length(self, index):
+        """Samples at the start of a chunk shared with the previous chunk"""
+        return self.overlap_lengths[max(index - 1, 0)]
+
+    def merge_chunks(self, merged_chunks=None):
+        """Merges chunks into the main signal superclass
+        \n merged_chunks = optional list of already merged (time, magnitude)
+        \n chunks, None entries are merged again
+        \n returns the list of merged chunks"""
+        if merged_chunks is None:
+            merged_chunks = [None] * len(self.chunk_array)
 
         for index in range(0, len(self.chunk_array)):
-            print_debug("Merging chunk " + str(index))
-            print_debug(self.chunk_array[index])
-            # for each chunk
-
-            averaged_overlap = []
-            overwritten_chunk = []
-            remaining_chunk = []
-
-            # average the chunk+overlap and add to main signal
-            if index == len(self.chunk_array):
-                averaged_overlap = []  # last chunk cornercase
-            elif index == 0:
-                averaged_overlap = self.get_overlap_magnitudes(
-                    index, "left")
-            else:
-                averaged_overlap = self.average_overlap(index)
+            if merged_chunks[index] is None:
+                merged_chunks[index] = self.merge_chunk(index)
 
-            # overwrite the left side overlap of the next chunk
-            # append the left averaged overlap to actual chunk
+        # Convert to 1D arrays
+        self.time = np.concatenate([chunk[0] for chunk in merged_chunks])
+        self.magnitude = np.concatenate(
+            [chunk[1] for chunk in merged_chunks])
+        return merged_chunks
+
+    def merge_chunk(self, index):
+        """Returns (time, magnitude) of a chunk without overlap, with its
+        left overlap averaged against the previous chunk"""
+        print_debug("Merging chunk " + str(index))
+        # for each chunk
+
+        averaged_overlap = []
+        overwritten_chunk = []
+        remaining_chunk = []
+
+        # average the chunk+overlap and add to main signal
+        if index == len(self.chunk_array):
+            averaged_overlap = []  # last chunk cornercase
+        elif index == 0:
+            averaged_overlap = self.get_overlap_magnitudes(
+                index, "left")
+        else:
+            averaged_overlap = self.average_overlap(index)
 
-            remaining_chunk = self.get_chunk_without_overlap(
-                index).magnitude[self.overlap_length:self.chunk_length]  # chunk starting after left overlap
-            print_debug("Remaining chunk: " + str(remaining_chunk))
+        # overwrite the left side overlap of the next chunk
+        # append the left averaged overlap to actual chunk
 
-            overwritten_chunk = np.concatenate(
-                (averaged_overlap, remaining_chunk), axis=None)
+        chunk_without_overlap = self.get_chunk_without_overlap(index)
+        remaining_chunk = chunk_without_overlap.magnitude[self.get_left_overlap_length(index):]  # chunk starting after left overlap
 
-            print_debug("Overwritten Chunk: " + str(overwritten_chunk))
-            # add to main signal
+        overwritten_chunk = np.concatenate(
+            (averaged_overlap, remaining_chunk), axis=0)
 
-            appended_time = self.get_chunk_without_overlap(index).time
+        # add to main signal
 
-            if len(appended_time) != len(overwritten_chunk):
-                difference = len(appended_time) - len(overwritten_chunk)
-                print_debug("Target Length: " + str(len(appended_time)))
-                print_debug("Length before padding: " +
-                            str(len(overwritten_chunk)))
-                overwritten_chunk.resize(len(appended_time))
-                print_debug("Length after padding: " +
-                            str(len(overwritten_chunk)))
+        appended_time = chunk_without_overlap.time
 
-            self.time.append(appended_time)
-            self.magnitude.append(overwritten_chunk)
+        if len(appended_time) != len(overwritten_chunk):
+            print_debug("Target Length: " + str(len(appended_time)))
+            print_debug("Length before padding: " +
+                        str(len(overwritten_chunk)))
+            padded_chunk = np.zeros(
+                (len(appended_time),) + overwritten_chunk.shape[1:])
+            padded_chunk[:len(overwritten_chunk)] = overwritten_chunk[:len(
+                appended_time)]
+            overwritten_chunk = padded_chunk
+            print_debug("Length after padding: " +
+                        str(len(overwritten_chunk)))
 
-        # Convert to 1D arrays
-        self.time = np.concatenate(self.time)
-        self.magnitude = np.concatenate(self.magnitude)
+        return appended_time, overwritten_chunk
 
     def average_overlap(self, chunk_index):
         """Averages the overlap magnitude of two chunks"""
@@ -221,13 +286,15 @@ class ChunkedSignal(Signal):
         \n direction = location of overlap wrt to current chunk
         \n (accounts for leftmost and rightmost cornercases)
         \n returns a magnitude array """
-        overlap_length = self.overlap_length
+        overlap_length = self.overlap_lengths[chunk_index]
         print_debug("Overlap length: " + str(overlap_length))
-        chunk_length = self.chunk_length
+        start, stop = self.get_chunk_range(chunk_index)
+        chunk_length = stop - start
         print_debug("Chunk length: " + str(chunk_length))
 
         if direction == "left":
             print_debug("Getting left overlap")
+            overlap_length = self.get_left_overlap_length(chunk_index)
             return self.chunk_array[chunk_index][:overlap_length].magnitude
         elif direction == "right":
             if chunk_index != len(self.chunk_array)-1:
@@ -236,7 +303,8 @@ class ChunkedSignal(Signal):
             else:
                 if overlap_length != 0:
                     overlap_length -= 1
-                return np.zeros(overlap_length)  # Zero padding
+                # Zero padding
+                return np.zeros((overlap_length,) + np.shape(self.magnitude)[1:])
         else:
             raise Exception("Direction must be left or right")
 
@@ -246,7 +314,8 @@ class ChunkedSignal(Signal):
 
     def get_chunk_without_overlap(self, index):
         """Returns the chunk signal object without overlap"""
-        output = copy(self.chunk_array[index][:self.chunk_length])
+        start, stop = self.get_chunk_range(index)
+        output = copy(self.chunk_array[index][:stop - start])
         print_debug(" Chunk without overlap" + str(output))
         return output
 
@@ -0,0 +1,50 @@
+'''Sliding window least squares polynomials of evenly sampled signals,
+computed as Savitzky-Golay convolutions rather than one fit per window'''
+import numpy as np
+from scipy import signal as sig
+from modules.utility import print_debug
+
+STREAM_BLOCK_SAMPLES = 1 << 18
+"""Samples convolved at a time, long records stream through in blocks"""
+
+DIRECT_MAX_WINDOW = 32
+"""Windows up to this length are convolved directly, longer ones by FFT"""
+
+
+def get_window_length(n, max_chunks, order):
+    """Odd window as long as one of max_chunks chunks of n samples, long
+    enough for the order and no longer than the signal"""
+    window = int(round(n / max(max_chunks, 1)))
+    window = max(window, order + 2)
+    window = min(window, n if n % 2 else n - 1)
+    return window if window % 2 else window - 1
+
+
+def sliding_polynomial_fit(magnitude, window, order,
+                           block_samples: int = STREAM_BLOCK_SAMPLES):
+    """Value at its center of the least squares polynomial of every window
+    of an evenly sampled signal, the first and last half windows take the
+    polynomial of the first and last window (savgol_filter's interp mode)"""
+    magnitude = np.asarray(magnitude, dtype=float)
+    n = len(magnitude)
+    if window % 2 == 0 or window <= order or window > n:
+        raise Exception("Window must be odd, longer than the order and "
+                        "no longer than the signal")
+    values = magnitude.reshape(n, -1)
+    half = window // 2
+    kernel = sig.savgol_coeffs(window, order, use="conv")[:, np.newaxis]
+    method = "direct" if window <= DIRECT_MAX_WINDOW else "fft"
+
+    fitted = np.empty_like(values)
+    for start in range(half, n - half, block_samples):
+        stop = min(start + block_samples, n - half)
+        fitted[start:stop] = sig.convolve(values[start - half:stop + half], kernel,
+                                          mode="valid", method=method)
+
+    offsets = np.arange(window)
+    first = np.polyfit(offsets, values[:window], order)
+    fitted[:half] = np.polyval(first, offsets[:half, np.newaxis])
+    last = np.polyfit(offsets, values[n - window:], order)
+    fitted[n - half:] = np.polyval(last, offsets[window - half:, np.newaxis])
+    print_debug("Sliding fit: window " + str(window) + ", " + method + " convolution")
+    return fitted.reshape(magnitude.shape)
@@ -0,0 +1,217 @@
+'''Parameter sweeps over fit settings, planned so that cells sharing chunk
+boundaries also share their chunking and least squares setup'''
+from copy import copy
+import numpy as np
+from modules.signals import Signal, ChunkedSignal
+from modules.chunkfit import nested_polynomial_fits
+from modules.metrics import EPSILON
+from modules.utility import print_debug
+
+PARAMETERS = {"order": "interpolation_order",
+              "chunks": "max_chunks",
+              "overlap": "overlap_percent",
+              "smoothing": "smoothing_factor",
+              "clip": "clip_percentage"}
+"""Sweepable parameters and the SignalProcessor attribute holding them"""
+
+INTEGER_PARAMETERS = ["order", "chunks"]
+BOUNDARY_PARAMETERS = ["clip", "chunks", "overlap"]
+"""Parameters that decide where the chunks start and stop"""
+
+MOMENT_MAX_ORDER = 7
+"""Highest polynomial order scored straight from the moment table, the
+normal equations it solves lose digits quickly above it"""
+
+
+class SweepAxis():
+    """Values of one fit parameter to sweep
+    \n scale = "linear" or "log" spacing of num values from start to stop,
+    \n or "explicit" to sweep the given values
+    \n smoothing is in SignalProcessor units (spinbox value / 100)"""
+
+    def __init__(self, parameter, start=0, stop=1, num=10, scale="linear",
+                 values=None) -> None:
+        if parameter not in PARAMETERS:
+            raise Exception("Parameter must be one of " + ", ".join(PARAMETERS))
+        if values is not None:
+            scale = "explicit"
+
+        if scale == "linear":
+            values = np.linspace(start, stop, num)
+        elif scale == "log":
+            values = np.geomspace(start, stop, num)
+        elif scale != "explicit":
+            raise Exception("Scale must be linear, log or explicit")
+
+        values = np.asarray(values, dtype=float)
+        if parameter in INTEGER_PARAMETERS:
+            values = np.unique(np.round(values)).astype(int)
+
+        self.parameter = parameter
+        self.scale = scale
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+
+def get_parameters(processor):
+    """Returns the current fit parameters of a SignalProcessor"""
+    return {name: getattr(processor, attribute)
+            for name, attribute in PARAMETERS.items()}
+
+
+def plan_sweep(axes, base, skip=None):
+    """Groups the cells of a sweep by the parameters that decide the chunk
+    boundaries
+    \n base = values of the parameters that are not swept
+    \n skip = optional mask of cells that are already known
+    \n returns {(clip, chunks, overlap): [(cell index, parameters), ...]}"""
+    plan = {}
+    for index in np.ndindex(*[len(axis) for axis in axes]):
+        if skip is not None and skip[index]:
+            continue
+        parameters = dict(base)
+        for axis, value_index in zip(axes, index):
+            parameters[axis.parameter] = axis.values[value_index]
+        key = tuple(parameters[name] for name in BOUNDARY_PARAMETERS)
+        plan.setdefault(key, []).append((index, parameters))
+    return plan
+
+
+def get_sweep_key(store, processor, axes):
+    """Returns (key, description) of a sweep in an ErrorGridStore"""
+    swept = [axis.parameter for axis in axes]
+    fixed = {name: value for name, value in get_parameters(processor).items()
+             if name not in swept}
+    # what the unswept clip and chunking mode actually produce
+    fixed["clipped_length"] = len(processor.clipped_signal)
+    fixed["incremental_refit"] = processor.incremental_refit
+    fixed["auto_fit"] = processor.auto_fit
+    fixed["metric"] = "range_error"
+    if processor.interpolation_type == "spline":
+        fixed["spline_engine"] = processor.spline_engine
+    if processor.interpolation_type == "polynomial":
+        fixed["continuity"] = processor.continuity
+    if processor.adaptive_chunks:
+        # adaptive boundaries follow the processor's own order, even when
+        # the order is swept
+        fixed["adaptive_chunks"] = processor.interpolation_order
+        fixed["chunk_tolerance"] = processor.chunk_tolerance
+    return store.get_key(processor.original_signal,
+                         processor.interpolation_type, swept, fixed)
+
+
+def run_sweep(processor, axes, on_cell=None, store=None):
+    """Range error (see SignalProcessor.range_error) of the processor's fit
+    for every combination of the axis values, the processor itself is left
+    untouched
+    \n on_cell(index, error) is called as cells finish
+    \n store = optional ErrorGridStore, stored cells are reused and the new
+    \n ones are merged into it
+    \n returns an ndarray with one dimension per axis (NaN = invalid cell)"""
+    errors = np.full([len(axis) for axis in axes], np.nan)
+    evaluated = np.zeros(errors.shape, dtype=bool)
+    if store is not None:
+        key, description = get_sweep_key(store, processor, axes)
+        errors, evaluated = store.lookup(key, [axis.values for axis in axes])
+    swept = [axis.parameter for axis in axes]
+    base = get_parameters(processor)
+    plan = plan_sweep(axes, base, evaluated)
+    if processor.interpolation_type == "polynomial" and processor.auto_fit is None \
+            and len(processor.original_signal) != 0:
+        # built once, the copies made for each chunking share it
+        orders = next((axis.values for axis in axes if axis.parameter == "order"),
+                      [base["order"]])
+        processor.get_moment_table(min(max(orders), MOMENT_MAX_ORDER))
+    print_debug("Sweep planned: " + str(errors.size) + " cells in " +
+                str(len(plan)) + " chunkings")
+
+    for (clip, chunks, overlap), cells in plan.items():
+        sweeper = copy(processor)
+        try:
+            if "clip" in swept:
+                sweeper.set_clipping(clip)
+            sweeper.max_chunks = chunks
+            sweeper.overlap_percent = overlap
+            chunked = ChunkedSignal(sweeper.clipped_signal, chunks, overlap,
+                                    sweeper.get_chunk_length(),
+                                    sweeper.get_chunk_starts())
+        except Exception as error:
+            print_debug("Invalid chunking: " + str(error))
+            for index, parameters in cells:
+                evaluated[index] = True
+            continue
+
+        for index, error in evaluate_group(sweeper, chunked, cells):
+            errors[index] = error
+            evaluated[index] = True
+            if on_cell is not None:
+                on_cell(index, error)
+
+    if store is not None and plan:
+        store.save(key, [axis.values for axis in axes],
+                   errors, evaluated, description)
+    return errors
+
+
+def evaluate_group(sweeper, chunked, cells):
+    """Yields (cell index, error) for cells sharing the chunked signal"""
+    chunks = chunked.chunk_array
+    starts = list(chunked.chunk_starts)
+
+    # whole-signal fits share nothing between cells
+    joint = sweeper.interpolation_type == "savgol" or sweeper.is_continuous()
+    nested = (sweeper.interpolation_type == "polynomial" and sweeper.auto_fit is None
+              and not joint)
+    # chunks that tile the signal (no overlap) are scored from the residual
+    # sums of squares of the moment table, without fitting them
+    tiled = nested and sum(len(chunk) for chunk in chunks) == len(chunked)
+
+    def from_table(order):
+        return tiled and order <= MOMENT_MAX_ORDER
+
+    if tiled:
+        table = sweeper.get_moment_table(min(
+            max(parameters["order"] for index, parameters in cells), MOMENT_MAX_ORDER))
+        segments = (np.asarray(starts, dtype=int),
+                    np.append(starts[1:], len(chunked)).astype(int))
+        original = np.asarray(chunked.magnitude)
+        spread = max(np.max(original) - np.min(original), EPSILON) if original.size else 1
+
+    fitted_orders = [parameters["order"] for index, parameters in cells
+                     if not from_table(parameters["order"])]
+    if nested and fitted_orders:
+        # every order of a chunk comes from one QR, shared by equal chunks
+        basis_cache = {}
+        nested_fits = [nested_polynomial_fits(chunk.time, chunk.magnitude,
+                                              max(fitted_orders), basis_cache)
+                       for chunk in chunks]
+
+    for index, parameters in cells:
+        sweeper.interpolation_order = parameters["order"]
+        sweeper.smoothing_factor = parameters["smoothing"]
+        try:
+            if from_table(parameters["order"]):
+                rss = table.segment_rss(*segments, parameters["order"]).sum()
+                yield index, 100 * np.sqrt(rss / max(original.size, 1)) / spread
+                continue
+            if joint:
+                sweeper.interpolate()
+                yield index, sweeper.range_error()
+                continue
+            if nested:
+                outputs = [Signal(magnitude=fits[parameters["order"]],
+                                  fsample=chunk.fsample, time=chunk.time)
+                           for chunk, fits in zip(chunks, nested_fits)]
+            else:
+                outputs = sweeper.fit_chunks(chunks, starts)
+
+            interpolated = copy(chunked)
+            interpolated.chunk_array = outputs
+            interpolated.merge_chunks()
+            sweeper.interpolated_signal = interpolated
+            yield index, sweeper.range_error()
+        except Exception as error:
+            print_debug("Invalid cell " + str(parameters) + ": " + str(error))
+            yield index, np.nan
@@ -0,0 +1,5 @@
+'''Puts src on the path so tests import the app's modules as it does'''
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+
+
+def fit(magnitude, interpolation_type, continuity=None):
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=100))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    processor.max_chunks = 6
+    processor.overlap_percent = 0 if continuity is not None else 25
+    processor.continuity = continuity
+    processor.interpolate()
+    return processor
+
+
+@pytest.mark.parametrize("interpolation_type, continuity", [
+    ("polynomial", None), ("polynomial", 1), ("spline", None), ("hermite", None),
+    ("savgol", None)])
+def test_channels_fit_as_separate_records(interpolation_type, continuity):
+    rng = np.random.default_rng(17)
+    time = np.arange(1800) / 100
+    magnitude = np.column_stack([np.sin(time), 3 * np.cos(2 * time), time ** 2 / 50])
+    magnitude = magnitude + 0.05 * rng.normal(size=magnitude.shape)
+
+    together = fit(magnitude, interpolation_type, continuity)
+    fitted = np.asarray(together.interpolated_signal.magnitude)
+    assert fitted.shape == magnitude.shape
+    for channel in range(magnitude.shape[1]):
+        alone = fit(magnitude[:, channel], interpolation_type, continuity)
+        assert np.allclose(fitted[:, channel], alone.interpolated_signal.magnitude,
+                           atol=1e-9)
+        # models evaluate to the fit channel by channel too
+        predicted = together.predict(time[-10:])
+        assert np.allclose(predicted[:, channel], alone.predict(time[-10:]), atol=1e-9)
@@ -0,0 +1,202 @@
+import numpy as np
+import pytest
+from scipy import interpolate as interp
+from modules.chunkfit import (fit_uniform_polynomials, bspline_design_matrix,
+                              fit_penalized_splines, fit_pchip_stack,
+                              fit_continuous_polynomials, select_polynomial_fit,
+                              select_spline_fit, selection_scores)
+
+
+def make_stack(n_chunks=6, length=120, channels=0, fsample=100):
+    rng = np.random.default_rng(12)
+    time = np.arange(n_chunks * length).reshape(n_chunks, length) / fsample
+    magnitude = np.stack([np.sin(time * (channel + 1)) for channel in range(max(channels, 1))],
+                         axis=-1)
+    magnitude = magnitude + 0.05 * rng.normal(size=magnitude.shape)
+    return time, magnitude if channels else magnitude[..., 0]
+
+
+@pytest.mark.parametrize("order", [0, 1, 3, 5])
+@pytest.mark.parametrize("channels", [0, 2])
+def test_uniform_polynomials_match_polyfit(order, channels):
+    time, magnitude = make_stack(channels=channels)
+    fitted, coef = fit_uniform_polynomials(time, magnitude, order)
+    assert fitted.shape == magnitude.shape and coef.shape[:2] == (len(time), order + 1)
+    for chunk in range(len(time)):
+        expected = np.polyfit(time[chunk], magnitude[chunk], order)
+        assert np.allclose(coef[chunk], expected, rtol=1e-6, atol=1e-9)
+        assert np.allclose(fitted[chunk], np.polyval(expected, time[chunk][:, np.newaxis]
+                                                     if channels else time[chunk]), atol=1e-9)
+
+
+def test_uniform_polynomials_share_projections():
+    time, magnitude = make_stack()
+    projection_cache = {}
+    first = fit_uniform_polynomials(time, magnitude, 3, projection_cache)
+    again = fit_uniform_polynomials(time + 7, magnitude, 3, projection_cache, evaluate=False)
+    assert len(projection_cache) == 1
+    assert again[0] is None
+    assert np.allclose(np.polyval(again[1][2], time[2] + 7), first[0][2], atol=1e-9)
+
+
+def make_knots(order, interior, clamped):
+    if clamped:
+        return np.concatenate([np.zeros(order + 1), interior, np.full(order + 1, 10.0)])
+    return np.arange(-order, 10 + order + 1, dtype=float)
+
+
+@pytest.mark.parametrize("order", [1, 2, 3, 5])
+@pytest.mark.parametrize("clamped", [False, True])
+def test_design_matrix_fallback(monkeypatch, order, clamped):
+    # repeated interior knots, as continuous polynomial fits place them
+    knots = make_knots(order, [2.5, 2.5, 4, 7, 7, 7], clamped)
+    x = np.append(np.linspace(0, 10, 301), [2.5, 4, 10])
+    expected = interp.BSpline.design_matrix(x, knots, order).toarray()
+    monkeypatch.delattr(interp.BSpline, "design_matrix")
+    fallback = bspline_design_matrix(x, knots, order)
+    assert np.allclose(fallback.toarray(), expected, atol=1e-12)
+    assert np.allclose(fallback.sum(axis=1), 1)
+
+
+def test_penalized_splines_without_design_matrix(monkeypatch):
+    time, magnitude = make_stack(channels=2)
+    fitted, splines = fit_penalized_splines(time, magnitude, 3, 1e-3)
+    monkeypatch.delattr(interp.BSpline, "design_matrix")
+    fallback, fallback_splines = fit_penalized_splines(time, magnitude, 3, 1e-3)
+    assert np.allclose(fallback, fitted, atol=1e-9)
+    assert np.allclose(fallback_splines[4](time[4]), fitted[4], atol=1e-9)
+
+
+def test_unpenalized_splines_are_least_squares():
+    time, magnitude = make_stack()
+    fitted, splines = fit_penalized_splines(time, magnitude, 3, 0)
+    for chunk in range(len(time)):
+        expected = interp.make_lsq_spline(time[chunk], magnitude[chunk], splines[chunk].t, 3)
+        assert np.allclose(fitted[chunk], expected(time[chunk]), atol=1e-6)
+
+
+@pytest.mark.parametrize("length", [2, 3, 4, 50])
+@pytest.mark.parametrize("channels", [0, 2])
+def test_pchip_stack_matches_scipy(length, channels):
+    rng = np.random.default_rng(13)
+    # uneven steps, plateaus and extrema exercise every slope rule
+    time = np.cumsum(rng.uniform(0.1, 1, size=(5, length)), axis=1)
+    magnitude = np.round(rng.normal(size=(5, length) + ((channels,) if channels else ())), 1)
+    magnitude[:, length // 2:length // 2 + 2] = 0.3
+    fitted, models = fit_pchip_stack(time, magnitude)
+    assert np.array_equal(fitted, magnitude)
+    for chunk in range(len(time)):
+        expected = interp.PchipInterpolator(time[chunk], magnitude[chunk])
+        fine = np.linspace(time[chunk, 0], time[chunk, -1], 7 * length)
+        for nu in range(3):
+            assert np.allclose(models[chunk](fine, nu), expected(fine, nu), atol=1e-9)
+
+
+def test_pchip_stack_needs_two_samples():
+    with pytest.raises(Exception):
+        fit_pchip_stack(np.zeros((3, 1)), np.zeros((3, 1)))
+
+
+def make_record(channels=0):
+    rng = np.random.default_rng(15)
+    time = 50 + np.arange(1500) / 100
+    magnitude = np.column_stack([np.sin(time * (channel + 1)) for channel in range(max(channels, 1))])
+    magnitude = magnitude + 0.05 * rng.normal(size=magnitude.shape)
+    return time, magnitude if channels else magnitude[:, 0]
+
+
+@pytest.mark.parametrize("order, continuity", [(1, 0), (2, 1), (3, 1), (3, 2)])
+@pytest.mark.parametrize("channels", [0, 2])
+def test_continuous_polynomials_join(order, continuity, channels):
+    time, magnitude = make_record(channels)
+    starts = [0, 200, 450, 500, 1100]
+    fitted, coef = fit_continuous_polynomials(time, magnitude, starts, order, continuity)
+    fitted = fitted.reshape(len(time), -1)
+    coef = coef.reshape(len(starts), order + 1, -1)
+    for channel in range(fitted.shape[1]):
+        pieces = coef[:, :, channel]
+        for chunk, start in enumerate(starts[1:], 1):
+            for nu in range(continuity + 1):
+                left = np.polyval(np.polyder(pieces[chunk - 1], nu), time[start])
+                right = np.polyval(np.polyder(pieces[chunk], nu), time[start])
+                assert left == pytest.approx(right, rel=1e-6, abs=1e-6)
+
+        # the chunk polynomials are the fit itself
+        for chunk, (start, stop) in enumerate(zip(starts, starts[1:] + [len(time)])):
+            assert np.allclose(np.polyval(pieces[chunk], time[start:stop]),
+                               fitted[start:stop, channel], atol=1e-6)
+
+
+@pytest.mark.parametrize("order, continuity", [(1, 0), (2, 1), (3, 1), (3, 2)])
+def test_continuous_polynomials_are_least_squares(order, continuity):
+    time, magnitude = make_record()
+    starts = np.array([0, 300, 310, 900])
+    fitted, coef = fit_continuous_polynomials(time, magnitude, starts, order, continuity)
+    # the same spline space, built independently of the fit
+    end = time[-1] + (time[1] - time[0])
+    knots = np.concatenate([np.full(order + 1, time[0]),
+                            np.repeat(time[starts[1:]], order - continuity),
+                            np.full(order + 1, end)])
+    expected = interp.make_lsq_spline(time, magnitude, knots, order)(time)
+    assert np.allclose(fitted, expected, atol=1e-7)
+
+
+def test_discontinuous_polynomials_are_separate_fits():
+    time, magnitude = make_record()
+    starts = [0, 500, 1000]
+    fitted, coef = fit_continuous_polynomials(time, magnitude, starts, 2, -1)
+    for chunk, (start, stop) in enumerate(zip(starts, starts[1:] + [len(time)])):
+        expected = np.polyfit(time[start:stop], magnitude[start:stop], 2)
+        assert np.allclose(np.polyval(coef[chunk], time[start:stop]),
+                           np.polyval(expected, time[start:stop]), atol=1e-7)
+
+
+@pytest.mark.parametrize("criterion", ["aic", "bic", "loo"])
+def test_selection_finds_the_true_order(criterion):
+    rng = np.random.default_rng(22)
+    time = np.linspace(-1, 1, 400)
+    magnitude = 1 - 2 * time + 3 * time ** 3 + 0.05 * rng.normal(size=400)
+    fitted, coef, model = select_polynomial_fit(time, magnitude, 10, criterion)
+    assert len(coef) == 4
+    assert np.allclose(fitted, np.polyval(np.polyfit(time, magnitude, 3), time), atol=1e-9)
+
+
+def test_leave_one_out_scores_match_refits(monkeypatch):
+    rng = np.random.default_rng(23)
+    time = np.sort(rng.uniform(0, 2, 40))
+    magnitude = np.exp(time) + 0.1 * rng.normal(size=40)
+    scored = []
+    monkeypatch.setattr("modules.chunkfit.selection_scores",
+                        lambda rss, dof, n, criterion, press: scored.append(press) or
+                        selection_scores(rss, dof, n, criterion, press))
+    select_polynomial_fit(time, magnitude, 4, "loo")
+    for order, press in enumerate(scored[0]):
+        expected = 0
+        for left_out in range(len(time)):
+            keep = np.arange(len(time)) != left_out
+            coef = np.polyfit(time[keep], magnitude[keep], order)
+            expected += (np.polyval(coef, time[left_out]) - magnitude[left_out]) ** 2
+        assert press == pytest.approx(expected, rel=1e-6)
+
+
+def test_selection_scores():
+    rss, dof, n = np.array([10.0, 4.0, 3.9]), np.array([1, 2, 3]), 50
+    assert np.allclose(selection_scores(rss, dof, n, "bic"),
+                       n * np.log(rss / n) + dof * np.log(n))
+    assert np.allclose(selection_scores(rss, dof, n, "aic"),
+                       n * np.log(rss / n) + 2 * dof + 2 * dof * (dof + 1) / (n - dof - 1))
+    # saturated candidates are never picked
+    assert np.argmin(selection_scores([1.0, 0.0], [2, 30], n, "bic")) == 0
+    with pytest.raises(Exception):
+        selection_scores(rss, dof, n, "r2")
+
+
+def test_spline_selection_per_channel():
+    rng = np.random.default_rng(24)
+    time = np.linspace(0, 10, 500)
+    magnitude = np.column_stack([np.sin(time), np.sin(time)]) + rng.normal(size=(500, 2)) * [0.01, 0.3]
+    fitted, coef, splines = select_spline_fit(time, magnitude)
+    assert fitted.shape == magnitude.shape
+    # the noisier channel is smoothed more
+    assert len(coef[1]) < len(coef[0])
+    assert np.sqrt(np.mean((fitted[:, 1] - np.sin(time)) ** 2)) < 0.3
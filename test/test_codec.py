@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.codec import (CompressedSignal, LosslessSignal, compress_signal,
+                           compress_lossless, default_sample_bytes)
+
+
+def make_signal(n=20000, channels=0, fsample=250, start_time=0):
+    rng = np.random.default_rng(10)
+    time = start_time + np.arange(n) / fsample
+    magnitude = np.column_stack([np.sin(time * (channel + 1)) + 0.5 * np.sin(7 * time)
+                                 for channel in range(max(channels, 1))])
+    magnitude = magnitude + 0.01 * rng.normal(size=magnitude.shape)
+    return Signal(magnitude=magnitude if channels else magnitude[:, 0],
+                  fsample=fsample, time=time)
+
+
+@pytest.mark.parametrize("channels", [0, 3])
+@pytest.mark.parametrize("tolerance", [1e-3, 0.05])
+def test_lossy_within_tolerance(channels, tolerance):
+    signal = make_signal(channels=channels)
+    compressed = compress_signal(signal, tolerance)
+    decoded = compressed.decode()
+    assert decoded.shape == np.shape(signal.magnitude)
+    assert np.max(np.abs(decoded - signal.magnitude)) <= tolerance * (1 + 1e-9)
+
+
+def test_lossy_random_access():
+    signal = make_signal(channels=2)
+    compressed = compress_signal(signal, 0.01)
+    decoded = compressed.decode()
+    for start, stop in [(0, 1), (17, 4117), (19990, 20000), (19990, 30000),
+                        (-5, 3), (500, 500)]:
+        assert np.array_equal(compressed.decode(start, stop),
+                              decoded[max(start, 0):stop])
+
+
+def test_lossy_time_range():
+    signal = make_signal(start_time=100)
+    compressed = compress_signal(signal, 0.01)
+    time, magnitude = compressed.decode_time_range(102, 104)
+    inside = (signal.time >= 102) & (signal.time <= 104)
+    assert np.allclose(time, signal.time[inside])
+    assert np.array_equal(magnitude, compressed.decode()[inside])
+    time, magnitude = compressed.decode_time_range(0, 50)
+    assert len(time) == len(magnitude) == 0
+
+
+def test_lossy_save_load(tmp_path):
+    signal = make_signal(channels=2)
+    compressed = compress_signal(signal, 0.01, sample_bytes=2)
+    path = str(tmp_path / "record.npz")
+    compressed.save(path)
+    loaded = CompressedSignal.load(path)
+    assert np.array_equal(loaded.decode(), compressed.decode())
+    assert loaded.sample_bytes == 2 and loaded.channels == 2
+    assert loaded.get_compression_ratio() == compressed.get_compression_ratio()
+
+
+def test_lossy_empty_record():
+    compressed = compress_signal(Signal(magnitude=np.zeros(0), fsample=250), 0.01)
+    assert len(compressed) == 0
+    assert compressed.decode().shape == (0,)
+
+
+def test_lossy_ratio_counts_source_samples():
+    signal = make_signal()
+    as_float = compress_signal(signal, 0.01)
+    assert as_float.source_bytes == len(signal.magnitude) * 8
+    counts = Signal(magnitude=np.round(signal.magnitude * 1000).astype(np.int64),
+                    fsample=250, time=signal.time)
+    as_int16 = compress_signal(counts, 10)
+    assert as_int16.source_bytes == len(signal.magnitude) * 2
+    as_given = compress_signal(signal, 0.01, sample_bytes=1.5)
+    assert as_given.get_compression_ratio() == pytest.approx(
+        len(signal.magnitude) * 1.5 / as_given.nbytes)
+
+
+def test_lossy_rejects_zero_tolerance():
+    with pytest.raises(Exception):
+        compress_signal(make_signal(100), 0)
+
+
+def make_samples(dtype, n=40000, channels=0):
+    rng = np.random.default_rng(11)
+    info = np.iinfo(dtype)
+    walk = np.cumsum(rng.integers(-3, 4, size=(n, max(channels, 1))), axis=0)
+    samples = np.clip(walk * (info.max // 64), info.min, info.max).astype(dtype)
+    # the extremes of the type, whatever the predictions around them
+    samples[1000:1004] = [[info.min], [info.max], [info.min], [info.max]]
+    return samples if channels else samples[:, 0]
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+@pytest.mark.parametrize("dtype", [np.int16, np.int64, np.uint16, np.int32])
+@pytest.mark.parametrize("channels", [0, 3])
+def test_lossless_bit_exact(dtype, channels):
+    samples = make_samples(dtype, channels=channels)
+    compressed = compress_lossless(samples, block_samples=4096)
+    decoded = compressed.decode()
+    assert decoded.dtype == samples.dtype
+    assert np.array_equal(decoded, samples)
+
+
+@pytest.mark.parametrize("samples", [np.zeros(0, dtype=np.int16), np.array([7]),
+                                     np.zeros((0, 2), dtype=np.int64)])
+def test_lossless_tiny_records(samples):
+    compressed = compress_lossless(samples)
+    decoded = compressed.decode()
+    assert decoded.shape == samples.shape and decoded.dtype == samples.dtype
+    assert np.array_equal(decoded, samples)
+
+
+def test_lossless_random_access():
+    samples = make_samples(np.int16, n=10000, channels=2)
+    compressed = compress_lossless(samples, block_samples=1000)
+    for start, stop in [(0, 1), (999, 1001), (1234, 5678), (9000, 20000), (-3, 2), (42, 42)]:
+        assert np.array_equal(compressed.decode(start, stop), samples[max(start, 0):stop])
+
+
+def test_lossless_save_load(tmp_path):
+    samples = make_samples(np.int64, n=10000)
+    compressed = compress_lossless(samples, block_samples=1000, sample_bytes=1.5)
+    path = str(tmp_path / "record.npz")
+    compressed.save(path)
+    loaded = LosslessSignal.load(path)
+    assert np.array_equal(loaded.decode(), samples)
+    assert loaded.decode().dtype == np.int64
+    assert loaded.sample_bytes == 1.5
+    assert loaded.get_compression_ratio() == compressed.get_compression_ratio()
+
+
+def test_lossless_rejects_floats():
+    with pytest.raises(Exception):
+        compress_lossless(np.zeros(10))
+
+
+def test_default_sample_bytes():
+    # WFDB hands 16 bit samples over as int64
+    assert default_sample_bytes(np.array([-32768, 32767], dtype=np.int64)) == 2
+    assert default_sample_bytes(np.array([0, 200], dtype=np.int64)) == 1
+    assert default_sample_bytes(np.array([-1, 40000], dtype=np.int64)) == 4
+    assert default_sample_bytes(np.zeros(3, dtype=np.float32)) == 4
+    assert compress_lossless(np.array([-300, 300] * 50)).sample_bytes == 2
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.chunkfit import evaluate_model
+
+
+def make_processor(magnitude=None, interpolation_type="polynomial", order=2):
+    rng = np.random.default_rng(20)
+    time = np.arange(2400) / 100
+    if magnitude is None:
+        magnitude = np.sin(time) + 0.05 * rng.normal(size=len(time))
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=100))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = order
+    processor.max_chunks = 8
+    processor.overlap_percent = 20
+    return processor
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_chunk_errors_of_merged_chunks(lazy):
+    magnitude = np.sin(np.arange(2400) / 100)
+    # a burst of noise in one chunk only
+    magnitude[1520:1580] += np.random.default_rng(21).normal(size=60)
+    processor = make_processor(magnitude)
+    assert len(processor.chunk_errors) == 0
+    processor.set_lazy_evaluation(lazy)
+    processor.interpolate()
+
+    chunked = processor.interpolated_signal
+    fitted = np.asarray(chunked.magnitude)
+    expected = []
+    for index in range(len(chunked.chunk_array)):
+        start, stop = chunked.get_chunk_range(index)
+        expected.append(np.sqrt(np.mean((fitted[start:stop] - magnitude[start:stop]) ** 2)))
+    assert np.allclose(processor.chunk_errors, expected, rtol=1e-9)
+    assert processor.get_worst_chunk() == 5
+    assert np.allclose(processor.get_chunk_errors("chunk_max_error"),
+                       [np.abs(fitted[slice(*chunked.get_chunk_range(index))]
+                               - magnitude[slice(*chunked.get_chunk_range(index))]).max()
+                        for index in range(len(chunked.chunk_array))])
+
+
+def test_error_metrics_follow_the_interpolation():
+    processor = make_processor()
+    processor.interpolate()
+    first = processor.get_error_metrics()
+    assert processor.get_error_metrics() is first
+    processor.interpolation_order = 5
+    processor.interpolate()
+    assert processor.get_error_metrics()["rmse"] < first["rmse"]
+
+
+@pytest.mark.parametrize("interpolation_type", ["polynomial", "spline", "hermite"])
+def test_extrapolation_continues_the_last_model(interpolation_type):
+    processor = make_processor(interpolation_type=interpolation_type, order=3)
+    processor.set_clipping(25)
+    processor.interpolate()
+    processor.extrapolate()
+
+    clipped_length = len(processor.clipped_signal)
+    time = processor.original_signal.time[clipped_length:]
+    extrapolated = processor.extrapolated_signal
+    assert np.array_equal(extrapolated.time, time)
+    last = processor.interpolated_signal.chunk_array[-1]
+    assert np.allclose(extrapolated.magnitude, evaluate_model(last.model, time))
+    ahead = processor.clipped_signal.time[-1] + np.array([1, 5]) / 100
+    assert np.allclose(processor.forecast([1, 5]), processor.predict(ahead))
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+def test_chunk_forecasts(channels):
+    rng = np.random.default_rng(25)
+    time = np.arange(2400) / 100
+    magnitude = np.column_stack([np.sin(time), np.cos(time)])[:, :channels].squeeze()
+    magnitude = magnitude + 0.01 * rng.normal(size=magnitude.shape)
+    processor = make_processor(magnitude, order=3)
+    processor.interpolate()
+
+    predictions, indices = processor.forecast_chunks(50)
+    chunked = processor.interpolated_signal
+    assert predictions.shape[:2] == (len(chunked.chunk_array), 50)
+    original_time = np.asarray(processor.original_signal.time)
+    for index, chunk in enumerate(chunked.chunk_array):
+        assert indices[index, 0] == chunked.get_chunk_range(index)[1]
+        # past the end of the record, time keeps its step
+        inside = np.minimum(indices[index], len(time) - 1)
+        times = np.where(indices[index] < len(time), original_time[inside],
+                         original_time[-1] + (indices[index] - len(time) + 1) / 100)
+        assert np.allclose(predictions[index], evaluate_model(chunk.model, times), atol=1e-9)
+
+    errors = processor.forecast_errors(50)
+    known = indices < len(time)
+    expected = [np.sqrt(np.mean((predictions[known[:, step], step]
+                                 - np.asarray(magnitude)[indices[known[:, step], step]]) ** 2))
+                for step in range(50)]
+    assert np.allclose(errors, expected, rtol=1e-9)
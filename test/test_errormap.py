@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules import sweep
+from modules.errorstore import ErrorGridStore
+from modules.errormap import adaptive_sweep, cube_slice, normalize_grid
+
+
+def valley(n_x, n_y):
+    """Error surface with one sharp minimum away from the coarse grid"""
+    x, y = np.meshgrid(np.arange(n_x), np.arange(n_y))
+    return np.hypot(x - 0.63 * n_x, y - 0.37 * n_y) + 0.01 * x
+
+
+@pytest.mark.parametrize("budget", [30, 120, 400])
+def test_adaptive_sweep_spends_the_budget_once_per_cell(budget):
+    surface = valley(40, 30)
+    calls = []
+
+    def evaluate(i, j):
+        calls.append((i, j))
+        return surface[j, i]
+
+    grid = adaptive_sweep(evaluate, 40, 30, budget=budget)
+    assert len(calls) == len(set(calls))
+    # a round may finish the cell it started on
+    assert len(calls) <= budget + 4
+    evaluated = ~np.isnan(grid)
+    assert evaluated.sum() == len(calls)
+    assert np.array_equal(grid[evaluated], surface[evaluated])
+    assert evaluated[[0, 0, -1, -1], [0, -1, 0, -1]].all()
+
+
+def test_adaptive_sweep_finds_the_valley():
+    surface = valley(64, 64)
+    grid = adaptive_sweep(lambda i, j: surface[j, i], 64, 64, budget=250)
+    assert np.nanmin(grid) == pytest.approx(surface.min(), abs=1.5)
+    assert np.count_nonzero(~np.isnan(grid)) < surface.size / 10
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_adaptive_sweep_skips_invalid_cells():
+    # cells the fit fails on come back as NaN
+    surface = valley(40, 40)
+    surface[:, :12] = np.nan
+    grid = adaptive_sweep(lambda i, j: surface[j, i], 40, 40, budget=200)
+    assert np.nanmin(grid) == pytest.approx(np.nanmin(surface), abs=1.5)
+
+
+def test_adaptive_sweep_covers_small_grids():
+    surface = valley(3, 1)
+    grid = adaptive_sweep(lambda i, j: surface[j, i], 3, 1, budget=100)
+    assert np.array_equal(grid, surface)
+
+
+def test_flat_cells_stop_refining():
+    rounds = []
+    grid = adaptive_sweep(lambda i, j: 1.0, 50, 50, budget=1000, tolerance=1e-3,
+                          on_round=lambda grid: rounds.append(grid.copy()))
+    assert np.count_nonzero(~np.isnan(grid)) == 25
+    assert len(rounds) >= 1
+
+
+def test_normalize_grid():
+    grid = normalize_grid(np.array([[2.0, np.nan], [4.0, 3.0]]))
+    assert np.array_equal(grid[~np.isnan(grid)], [0, 1, 0.5])
+    assert np.array_equal(normalize_grid(np.full((2, 2), 5.0)), np.zeros((2, 2)))
+
+
+def test_cube_slice():
+    cube = np.arange(2 * 3 * 4).reshape(2, 3, 4)
+    assert np.array_equal(cube_slice(cube, 2, 1), cube[0])
+    assert np.array_equal(cube_slice(cube, 1, 2), cube[0].T)
+    assert np.array_equal(cube_slice(cube, 0, 2, {1: 2}), cube[:, 2, :].T)
+    assert np.array_equal(cube_slice(cube, 2, 0, pins={1: 1}), cube[:, 1, :])
+
+
+def test_error_cube_matches_plane_sweeps(tmp_path, monkeypatch):
+    rng = np.random.default_rng(19)
+    time = np.arange(2000) / 200
+    processor = SignalProcessor(Signal(magnitude=np.sin(3 * time) + 0.05 * rng.normal(size=2000),
+                                       fsample=200))
+    processor.interpolation_type = "polynomial"
+    orders = sweep.SweepAxis("order", values=[1, 3])
+    chunks = sweep.SweepAxis("chunks", values=[2, 5, 9])
+    overlaps = sweep.SweepAxis("overlap", values=[0, 10, 30])
+    store = ErrorGridStore(str(tmp_path))
+    cube = sweep.run_sweep(processor, [orders, chunks, overlaps], store=store)
+    for index, overlap in enumerate(overlaps.values):
+        processor.overlap_percent = overlap
+        plane = sweep.run_sweep(processor, [orders, chunks])
+        assert np.allclose(cube_slice(cube, 1, 0, {2: index}), plane, rtol=1e-12)
+    # a second cube comes from the store, without fitting anything
+    processor.overlap_percent = 0
+    monkeypatch.setattr(sweep, "evaluate_group", None)
+    assert np.array_equal(sweep.run_sweep(processor, [orders, chunks, overlaps], store=store),
+                          cube)
@@ -0,0 +1,64 @@
+import numpy as np
+from modules.signals import Signal
+from modules.errorstore import ErrorGridStore, signal_hash
+
+
+def make_store(tmp_path):
+    signal = Signal(magnitude=np.sin(np.arange(100) / 7), fsample=10)
+    store = ErrorGridStore(str(tmp_path))
+    key, description = store.get_key(signal, "polynomial", ["order", "chunks"],
+                                     {"overlap": 0})
+    return store, key, description
+
+
+def test_round_trip(tmp_path):
+    store, key, description = make_store(tmp_path)
+    axes = [np.array([1.0, 2.0, 3.0]), np.array([1.0, 4.0])]
+    grid = np.arange(6, dtype=float).reshape(3, 2)
+    evaluated = np.array([[True, True], [True, False], [True, True]])
+    store.save(key, axes, grid, evaluated, description)
+
+    loaded_axes, loaded_grid, loaded_evaluated, loaded_description = store.load(key)
+    assert all(np.array_equal(old, new) for old, new in zip(axes, loaded_axes))
+    assert np.array_equal(loaded_evaluated, evaluated)
+    assert np.array_equal(loaded_grid[evaluated], grid[evaluated])
+    assert loaded_description == description
+
+    reused, reused_evaluated = store.lookup(key, [[2.0, 3.0, 5.0], [4.0]])
+    assert np.array_equal(reused_evaluated, [[False], [True], [False]])
+    assert reused[1, 0] == grid[2, 1]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_save_merges_axes(tmp_path):
+    store, key, description = make_store(tmp_path)
+    store.save(key, [[1.0, 3.0]], np.array([10.0, 30.0]), np.array([True, True]))
+    store.save(key, [[2.0, 3.0]], np.array([20.0, 31.0]), np.array([True, True]))
+    grid, evaluated = store.lookup(key, [[1.0, 2.0, 3.0]])
+    assert evaluated.all()
+    assert np.array_equal(grid, [10.0, 20.0, 31.0])
+
+
+def test_lookup_is_exact(tmp_path):
+    # smoothing factors well below any absolute tolerance are distinct cells
+    store, key, description = make_store(tmp_path)
+    stored = np.geomspace(1e-10, 1e-6, 5)
+    store.save(key, [stored], np.arange(5.0), np.ones(5, dtype=bool))
+    grid, evaluated = store.lookup(key, [[1e-10, 2e-10, stored[2]]])
+    assert np.array_equal(evaluated, [True, False, True])
+    assert np.array_equal(grid[evaluated], [0.0, 2.0])
+
+
+def test_missing_key(tmp_path):
+    store, key, description = make_store(tmp_path)
+    assert store.load(key) is None
+    grid, evaluated = store.lookup(key, [[1.0, 2.0]])
+    assert np.isnan(grid).all() and not evaluated.any()
+
+
+def test_keys_follow_the_samples():
+    time = np.arange(50) / 10
+    first = Signal(magnitude=np.ones(50), fsample=10, time=time)
+    second = Signal(magnitude=np.append(np.ones(49), 2), fsample=10, time=time)
+    assert signal_hash(first) == signal_hash(Signal(magnitude=np.ones(50), fsample=10, time=time))
+    assert signal_hash(first) != signal_hash(second)
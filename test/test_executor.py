@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.chunkfit import ChunkExecutor
+
+
+def fit(interpolation_type, executor=None):
+    rng = np.random.default_rng(18)
+    time = np.arange(4000) / 100
+    magnitude = np.column_stack([np.sin(time), np.cos(3 * time)])
+    processor = SignalProcessor(Signal(magnitude=magnitude + 0.05 * rng.normal(size=magnitude.shape),
+                                       fsample=100))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    processor.max_chunks = 8
+    processor.overlap_percent = 10
+    if executor is not None:
+        # workers even for this short record
+        processor.set_chunk_executor(2, processes=executor == "processes", min_samples=0)
+    processor.interpolate()
+    processor.set_chunk_executor(0)
+    processor.release_shared_store()
+    return np.asarray(processor.interpolated_signal.magnitude)
+
+
+@pytest.mark.parametrize("executor", ["threads", "processes"])
+@pytest.mark.parametrize("interpolation_type", ["spline", "hermite"])
+def test_pooled_fits_match_serial(executor, interpolation_type):
+    assert np.array_equal(fit(interpolation_type, executor), fit(interpolation_type))
+
+
+def test_executor_keeps_task_order():
+    executor = ChunkExecutor(3, processes=False, min_samples=0)
+    try:
+        assert executor.map(pow, range(20), [2] * 20) == [index ** 2 for index in range(20)]
+        assert not executor.worth_parallel(1)
+        assert not ChunkExecutor(2, processes=False, min_samples=100).worth_parallel(5, 99)
+    finally:
+        executor.shutdown()
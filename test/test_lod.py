@@ -0,0 +1,76 @@
+import numpy as np
+from modules.lod import DecimatedCurve
+
+
+def brute_force_envelope(magnitude, block):
+    """Min and max of every block of samples"""
+    padded = np.append(magnitude, np.full(-len(magnitude) % block, magnitude[-1]))
+    blocks = padded.reshape(-1, block)
+    return blocks.min(axis=1), blocks.max(axis=1)
+
+
+def test_view_keeps_extremes():
+    rng = np.random.default_rng(0)
+    time = np.arange(100000) / 1000
+    magnitude = np.cumsum(rng.normal(size=len(time)))
+    curve = DecimatedCurve(time, magnitude)
+
+    view_time, view_magnitude = curve.get_view(width=500)
+    assert len(view_time) <= 2 * 2 * 500 + 1
+    assert view_magnitude.min() == magnitude.min()
+    assert view_magnitude.max() == magnitude.max()
+    assert view_time[-1] == time[-1] and view_magnitude[-1] == magnitude[-1]
+
+    block = 2 ** int(np.ceil(np.log2(len(time) / 500)))
+    mins, maxs = brute_force_envelope(magnitude, block)
+    assert np.array_equal(view_magnitude[0:-1:2], mins)
+    assert np.array_equal(view_magnitude[1:-1:2], maxs)
+
+
+def test_zoomed_view_is_full_resolution():
+    time = np.arange(10000) / 100
+    magnitude = np.sin(time)
+    curve = DecimatedCurve(time, magnitude)
+    view_time, view_magnitude = curve.get_view(10, 12, width=1000)
+    inside = (time >= 10) & (time <= 12)
+    assert np.array_equal(view_time[1:-1], time[inside])
+    assert np.array_equal(view_magnitude[1:-1], magnitude[inside])
+
+
+def test_range_from_pyramid():
+    magnitude = np.array([3.0, -2.0, 7.0, 1.0, 0.5])
+    curve = DecimatedCurve(np.arange(5), magnitude)
+    assert curve.get_range() == (-2.0, 7.0)
+
+
+class SlicedArray():
+    """Lazy source standing in for a PiecewiseModel, counts evaluations"""
+
+    def __init__(self, values):
+        self.values = values
+        self.evaluated = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        values = self.values[index]
+        self.evaluated += len(values)
+        return values
+
+
+def test_lazy_source_matches_data_and_caches_views():
+    time = np.arange(50000) / 100
+    magnitude = np.sin(time) + 0.1 * np.sin(37 * time)
+    source = SlicedArray(magnitude)
+    lazy = DecimatedCurve()
+    lazy.set_source(time, source)
+
+    expected = DecimatedCurve(time, magnitude).get_view(width=300)
+    view = lazy.get_view(width=300)
+    assert np.array_equal(view[0], expected[0])
+    assert np.allclose(view[1], expected[1])
+
+    evaluated = source.evaluated
+    lazy.get_view(width=300)
+    assert source.evaluated == evaluated
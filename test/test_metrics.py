@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from modules.metrics import residual_metrics, residual_sums, combine_sums, metrics_from_sums
+
+
+def make_fit(shape=(1000,)):
+    rng = np.random.default_rng(3)
+    original = 2 + rng.normal(size=shape)
+    fitted = original + 0.1 * rng.normal(size=shape)
+    return original, fitted
+
+
+@pytest.mark.parametrize("shape", [(1000,), (1000, 3)])
+def test_metrics_match_numpy(shape):
+    original, fitted = make_fit(shape)
+    error = np.abs(original - fitted)
+    metrics = residual_metrics(original, fitted)
+    assert metrics["mean_absolute_error"] == pytest.approx(error.mean())
+    assert metrics["percentage"] == pytest.approx(100 * error.mean() / abs(original.mean()))
+    assert metrics["mape"] == pytest.approx(100 * np.mean(error / np.abs(original)))
+    assert metrics["rmse"] == pytest.approx(np.sqrt(np.mean(error ** 2)))
+    assert metrics["nrmse"] == pytest.approx(
+        np.sqrt(np.mean(error ** 2)) / np.ptp(original))
+    assert metrics["max_error"] == error.max()
+
+
+def test_chunk_metrics():
+    original, fitted = make_fit((1000, 2))
+    starts = [0, 10, 11, 400, 999]
+    error = np.abs(original - fitted)
+    metrics = residual_metrics(original, fitted, starts, block_size=64)
+    for index, (start, stop) in enumerate(zip(starts, starts[1:] + [1000])):
+        assert metrics["chunk_mae"][index] == pytest.approx(error[start:stop].mean())
+        assert metrics["chunk_rmse"][index] == pytest.approx(
+            np.sqrt(np.mean(error[start:stop] ** 2)))
+        assert metrics["chunk_max_error"][index] == error[start:stop].max()
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1000])
+def test_blocks_match_one_block(block_size):
+    original, fitted = make_fit()
+    starts = [0, 100, 130, 700]
+    whole = residual_metrics(original, fitted, starts, block_size=len(original))
+    blocked = residual_metrics(original, fitted, starts, block_size=block_size)
+    for name, value in whole.items():
+        assert np.allclose(blocked[name], value, rtol=1e-12), name
+
+
+def test_combined_parts_match_whole():
+    original, fitted = make_fit()
+    whole = residual_metrics(original, fitted, [0, 300, 600])
+    parts = [residual_sums(original[:300], fitted[:300], [0]),
+             residual_sums(original[300:], fitted[300:], [0, 300])]
+    combined = metrics_from_sums(combine_sums(parts))
+    for name, value in whole.items():
+        assert np.allclose(combined[name], value, rtol=1e-12), name
+
+
+def test_fitted_prefix_and_empty():
+    original, fitted = make_fit()
+    prefix = residual_metrics(original, fitted[:500])
+    assert prefix["rmse"] == pytest.approx(residual_metrics(original[:500], fitted[:500])["rmse"])
+    empty = residual_metrics(original[:0], fitted[:0])
+    assert empty["rmse"] == 0 and empty["nrmse"] == 0
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.chunkfit import evaluate_model
+from modules.modelstore import (MODEL_TYPES, ARRAY_FIELDS, PiecewiseStore, save_model,
+                                load_model)
+
+
+def is_mapped(array):
+    """Whether an array views a memory map"""
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def fit(interpolation_type, channels=2, auto_fit=None, spline_engine="fitpack"):
+    rng = np.random.default_rng(9)
+    time = np.arange(1600) / 160
+    magnitude = np.column_stack([np.cos(time * (channel + 2)) for channel in range(channels)])
+    magnitude = (magnitude + 0.05 * rng.normal(size=magnitude.shape)).squeeze()
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=160))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    processor.max_chunks = 8
+    processor.overlap_percent = 20
+    processor.auto_fit = auto_fit
+    processor.spline_engine = spline_engine
+    processor.interpolate()
+    return processor
+
+
+def expected_values(processor, time):
+    """The fit at any times from the chunk models: overlaps average the
+    two chunks sharing them, the edge chunks extrapolate"""
+    chunked = processor.clipped_signal
+    models = [chunk.model for chunk in processor.interpolated_signal.chunk_array]
+    sample_time = np.asarray(chunked.time)
+    values = []
+    for moment in time:
+        index = int(np.clip(np.searchsorted(sample_time, moment, side="right") - 1,
+                            0, len(sample_time) - 1))
+        chunk = int(np.searchsorted(chunked.chunk_starts, index, side="right") - 1)
+        value = evaluate_model(models[chunk], np.array([moment]))[0]
+        overlap_stop = chunked.chunk_starts[chunk] + chunked.get_left_overlap_length(chunk)
+        if chunk > 0 and index < overlap_stop:
+            value = (value + evaluate_model(models[chunk - 1], np.array([moment]))[0]) / 2
+        values.append(value)
+    return np.array(values)
+
+
+@pytest.mark.parametrize("interpolation_type, auto_fit, spline_engine", [
+    ("polynomial", None, "fitpack"), ("polynomial", "bic", "fitpack"),
+    ("spline", None, "fitpack"), ("spline", None, "penalized"), ("hermite", None, "fitpack")])
+@pytest.mark.parametrize("channels", [1, 2])
+def test_store_evaluates_the_chunk_models(interpolation_type, auto_fit, spline_engine, channels):
+    processor = fit(interpolation_type, channels, auto_fit, spline_engine)
+    store = PiecewiseStore.from_chunks(
+        interpolation_type, processor.clipped_signal,
+        [chunk.model for chunk in processor.interpolated_signal.chunk_array])
+    time = np.asarray(processor.clipped_signal.time)
+    # between samples, in overlaps and past both ends
+    moments = np.concatenate([[time[0] - 0.05], (time[1:] + time[:-1])[::7] / 2,
+                              [time[-1] + 0.05]])
+    assert np.allclose(store.evaluate(moments), expected_values(processor, moments), atol=1e-9)
+    assert np.allclose(store.evaluate(time), processor.materialize(), atol=1e-9)
+
+
+@pytest.mark.parametrize("interpolation_type", MODEL_TYPES)
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, interpolation_type, channels, mmap):
+    processor = fit(interpolation_type, channels)
+    store = processor.get_model_store()
+    path = str(tmp_path / "model.pwm")
+    save_model(store, path)
+    loaded = load_model(path, mmap=mmap)
+
+    assert loaded.type == store.type
+    assert loaded.degree == store.degree and loaded.channels == store.channels
+    for field in ARRAY_FIELDS:
+        array = getattr(loaded, field)
+        assert np.array_equal(array, getattr(store, field)), field
+        if array.size:
+            assert is_mapped(array) == mmap, field
+
+    time = processor.clipped_signal.time
+    between = (time[1:] + time[:-1]) / 2
+    for times in [time, between, time[400:410]]:
+        assert np.array_equal(loaded.evaluate(times), store.evaluate(times))
+    assert np.allclose(store.evaluate(time).reshape(np.shape(processor.materialize())),
+                       processor.materialize(), atol=1e-9)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_not_a_model_file(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a model file at all")
+    with pytest.raises(Exception):
+        load_model(str(path))
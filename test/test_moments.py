@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from modules.moments import MomentTable
+
+
+def make_signal(n=3000, offset=0.0, channels=2):
+    rng = np.random.default_rng(6)
+    time = offset + np.sort(rng.uniform(0, 30, n))
+    magnitude = (np.column_stack([np.sin(time), np.cos(0.3 * time)])[:, :channels]
+                 + 0.1 * rng.normal(size=(n, channels)))
+    return time, magnitude
+
+
+def make_segments(n):
+    rng = np.random.default_rng(7)
+    bounds = np.sort(rng.integers(0, n, size=(40, 2)), axis=1)
+    bounds[:, 1] += 9
+    # single blocks, block edges and the whole signal
+    bounds = np.vstack([bounds, [[0, n], [16, 32], [5, 15], [0, 10]]])
+    return bounds[:, 0], np.minimum(bounds[:, 1], n)
+
+
+def lstsq_fit(time, magnitude, start, stop, order):
+    center = (time[start] + time[stop - 1]) / 2
+    half_width = (time[stop - 1] - time[start]) / 2 or 1
+    x = (time[start:stop] - center) / half_width
+    vandermonde = x[:, np.newaxis] ** np.arange(order + 1)
+    coef, residuals = np.linalg.lstsq(vandermonde, magnitude[start:stop], rcond=None)[:2]
+    return coef, np.sum((vandermonde @ coef - magnitude[start:stop]) ** 2)
+
+
+@pytest.mark.parametrize("offset", [0, 1e6])
+@pytest.mark.parametrize("order, accuracy", [(0, 1e-10), (1, 1e-10), (3, 1e-9), (7, 1e-6)])
+def test_rss_matches_lstsq(offset, order, accuracy):
+    time, magnitude = make_signal(offset=offset)
+    magnitude = magnitude + offset / 1e3
+    table = MomentTable(time, magnitude, max_order=7)
+    starts, stops = make_segments(len(time))
+    rss = table.segment_rss(starts, stops, order)
+    for start, stop, value in zip(starts, stops, rss):
+        expected = lstsq_fit(time, magnitude, start, stop, order)[1]
+        # the normal equations cancel against the segment's spread, losing
+        # digits with the order (the sweep stops using them at order 7)
+        segment = magnitude[start:stop]
+        spread = np.sum((segment - segment.mean(axis=0)) ** 2)
+        assert value == pytest.approx(expected, rel=1e-6, abs=accuracy * spread)
+
+
+def test_coefficients_match_polyfit():
+    time, magnitude = make_signal(channels=1)
+    table = MomentTable(time, magnitude, max_order=4)
+    starts, stops = make_segments(len(time))
+    coef, rss = table.fit_segments(starts, stops, 4)
+    for start, stop, segment_coef in zip(starts, stops, coef):
+        expected = lstsq_fit(time, magnitude, start, stop, 4)[0]
+        assert np.allclose(segment_coef, expected, rtol=1e-6, atol=1e-8)
+
+
+def test_order_limit():
+    time, magnitude = make_signal(100)
+    with pytest.raises(Exception):
+        MomentTable(time, magnitude, max_order=2).segment_rss([0], [100], 3)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.metrics import residual_metrics
+from modules.piecewise import PiecewiseModel
+
+
+def fit(interpolation_type, lazy, overlap=0, channels=1):
+    rng = np.random.default_rng(8)
+    time = np.arange(2000) / 200
+    magnitude = np.column_stack([np.sin(time * (channel + 1)) for channel in range(channels)])
+    magnitude = (magnitude + 0.05 * rng.normal(size=magnitude.shape)).squeeze()
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=200))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    processor.max_chunks = 8
+    processor.overlap_percent = overlap
+    processor.set_lazy_evaluation(lazy)
+    processor.interpolate()
+    return processor
+
+
+@pytest.mark.parametrize("interpolation_type", ["polynomial", "spline", "hermite"])
+@pytest.mark.parametrize("overlap", [0, 25])
+def test_lazy_matches_eager(interpolation_type, overlap):
+    eager = fit(interpolation_type, False, overlap)
+    lazy = fit(interpolation_type, True, overlap)
+    model = lazy.interpolated_signal.magnitude
+    assert isinstance(model, PiecewiseModel)
+    expected = np.asarray(eager.interpolated_signal.magnitude)
+    assert np.allclose(model[:], expected, atol=1e-9)
+    assert np.allclose(model[333:1234], expected[333:1234], atol=1e-9)
+    assert np.allclose(model[[5, 1999, 700]], expected[[5, 1999, 700]], atol=1e-9)
+    assert np.allclose(np.asarray(model), expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("overlap", [0, 25])
+def test_lazy_metrics_match_full(overlap):
+    lazy = fit("polynomial", True, overlap, channels=2)
+    metrics = lazy.get_error_metrics()
+    original = np.asarray(lazy.original_signal.magnitude)
+    fitted = np.asarray(lazy.interpolated_signal.magnitude)
+    expected = residual_metrics(original, fitted, lazy.interpolated_signal.chunk_starts)
+    for name, value in expected.items():
+        assert np.allclose(metrics[name], value, rtol=1e-9), name
+
+
+def test_materialize():
+    lazy = fit("polynomial", True)
+    expected = lazy.interpolated_signal.magnitude[:]
+    assert np.array_equal(lazy.materialize(), expected)
+    assert isinstance(lazy.interpolated_signal.magnitude, np.ndarray)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.metrics import residual_metrics
+
+
+def make_processor(interpolation_type="polynomial", incremental=True, lazy=False):
+    rng = np.random.default_rng(16)
+    time = np.arange(3000) / 100
+    magnitude = np.sin(time) + 0.05 * rng.normal(size=len(time))
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=100))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    processor.max_chunks = 10
+    processor.overlap_percent = 20
+    processor.set_incremental_refit(incremental)
+    processor.set_lazy_evaluation(lazy)
+    return processor
+
+
+def fitted_magnitude(processor):
+    return np.asarray(processor.interpolated_signal.magnitude)
+
+
+@pytest.mark.parametrize("interpolation_type", ["polynomial", "spline", "hermite"])
+def test_unclipped_refit_matches_full_fit(interpolation_type):
+    incremental = make_processor(interpolation_type)
+    full = make_processor(interpolation_type, incremental=False)
+    for processor in [incremental, full]:
+        processor.interpolate()
+    assert np.allclose(fitted_magnitude(incremental), fitted_magnitude(full), atol=1e-12)
+    assert len(incremental.interpolated_signal.chunk_array) == 10
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_clipped_refit_reuses_unchanged_chunks(lazy):
+    processor = make_processor(lazy=lazy)
+    processor.interpolate()
+    before = list(processor.interpolated_signal.chunk_array)
+    processor.get_error_metrics()
+
+    processor.set_clipping(35)
+    processor.interpolate()
+    after = processor.interpolated_signal.chunk_array
+    # boundaries come from the original signal, only the clipped end is refitted
+    reused = sum(any(chunk is old for old in before) for chunk in after)
+    assert reused == len(after) - 1
+
+    fresh = make_processor(lazy=lazy)
+    fresh.set_clipping(35)
+    fresh.interpolate()
+    assert np.array_equal(fitted_magnitude(processor), fitted_magnitude(fresh))
+
+    metrics = processor.get_error_metrics()
+    expected = residual_metrics(np.asarray(processor.original_signal.magnitude),
+                                fitted_magnitude(fresh),
+                                fresh.interpolated_signal.chunk_starts)
+    for name, value in expected.items():
+        assert np.allclose(metrics[name], value, rtol=1e-9), name
+
+
+def test_parameter_change_refits_everything():
+    processor = make_processor()
+    processor.interpolate()
+    before = list(processor.interpolated_signal.chunk_array)
+    processor.interpolation_order = 2
+    processor.interpolate()
+    assert not any(chunk is old for chunk in processor.interpolated_signal.chunk_array
+                   for old in before)
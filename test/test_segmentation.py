@@ -0,0 +1,37 @@
+import numpy as np
+from modules.moments import MomentTable
+from modules.segmentation import adaptive_chunk_starts
+
+
+def make_table(magnitude, order=1):
+    return MomentTable(np.arange(len(magnitude)) / 100, magnitude, order)
+
+
+def test_split_finds_step():
+    magnitude = np.where(np.arange(1000) < 637, 0.0, 5.0)
+    starts = adaptive_chunk_starts(make_table(magnitude), 1000, order=1, max_chunks=2)
+    assert len(starts) == 2
+    # split candidates are spaced about 1000 / SPLIT_CANDIDATES apart
+    assert abs(starts[1] - 637) <= 1000 / 64
+
+
+def test_chunk_limits():
+    rng = np.random.default_rng(4)
+    magnitude = np.cumsum(rng.normal(size=2000))
+    for max_chunks in [1, 5, 40]:
+        starts = adaptive_chunk_starts(make_table(magnitude, 2), 2000, order=2,
+                                       max_chunks=max_chunks)
+        assert starts[0] == 0 and len(starts) <= max_chunks
+        assert np.all(np.diff(np.append(starts, 2000)) >= 2 * 3)
+
+
+def test_tolerance_stops_splitting():
+    rng = np.random.default_rng(5)
+    time = np.arange(500) / 100
+    magnitude = 3 * time + 1 + 0.01 * rng.normal(size=500)
+    starts = adaptive_chunk_starts(make_table(magnitude), 500, order=1,
+                                   max_chunks=10, tolerance=0.02)
+    assert np.array_equal(starts, [0])
+    starts = adaptive_chunk_starts(make_table(magnitude), 500, order=1,
+                                   max_chunks=10, tolerance=0.005)
+    assert len(starts) == 10
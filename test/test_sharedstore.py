@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.chunkfit import fit_chunk, fit_shared_chunk
+from modules.sharedstore import (SharedSignalStore, attach_signal, attached_segments,
+                                 shared_memory_available)
+
+pytestmark = pytest.mark.skipif(not shared_memory_available(),
+                                reason="no shared memory before Python 3.8")
+
+
+def segment_names(store):
+    return [spec[0] for key, spec in store.handle.items() if key != "fsample"]
+
+
+@pytest.fixture
+def signal():
+    time = np.arange(1000) / 50
+    return Signal(magnitude=np.column_stack([np.sin(time), np.cos(time)]), fsample=50, time=time)
+
+
+@pytest.fixture
+def store(signal):
+    store = SharedSignalStore(signal)
+    yield store
+    # this process attached as a worker would, detach before unlinking
+    for name in segment_names(store):
+        if name in attached_segments:
+            attached_segments.pop(name).close()
+    store.close()
+
+
+def test_attached_signal_views_the_published_arrays(signal, store):
+    attached = attach_signal(store.handle)
+    assert np.array_equal(attached.magnitude, signal.magnitude)
+    assert np.array_equal(attached.time, signal.time)
+    assert attached.fsample == signal.fsample
+    assert np.shares_memory(attached.magnitude, attach_signal(store.handle).magnitude)
+
+
+def test_shared_chunk_fit_matches_direct_fit(signal, store):
+    shared = fit_shared_chunk(store.handle, 200, 500, "spline", 3)
+    direct = fit_chunk("spline", signal.time[200:500], signal.magnitude[200:500], 3)
+    assert np.array_equal(shared[0], direct[0])
+
+
+def test_close_unlinks_the_segments(signal):
+    from multiprocessing import shared_memory
+    store = SharedSignalStore(signal)
+    names = segment_names(store)
+    store.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from scipy import signal as sig
+from modules.sliding import DIRECT_MAX_WINDOW, get_window_length, sliding_polynomial_fit
+
+
+def make_magnitude(n=5000, channels=0):
+    rng = np.random.default_rng(14)
+    time = np.arange(n) / 100
+    magnitude = np.column_stack([np.sin(time * (channel + 1)) for channel in range(max(channels, 1))])
+    magnitude = magnitude + 0.1 * rng.normal(size=magnitude.shape)
+    return magnitude if channels else magnitude[:, 0]
+
+
+@pytest.mark.parametrize("window, order", [(5, 2), (DIRECT_MAX_WINDOW + 1, 3), (301, 4)])
+@pytest.mark.parametrize("channels", [0, 2])
+def test_sliding_fit_matches_savgol(window, order, channels):
+    magnitude = make_magnitude(channels=channels)
+    expected = sig.savgol_filter(magnitude, window, order, axis=0, mode="interp")
+    # small blocks so that several block joins are crossed
+    fitted = sliding_polynomial_fit(magnitude, window, order, block_samples=777)
+    assert fitted.shape == magnitude.shape
+    assert np.allclose(fitted, expected, atol=1e-9)
+
+
+def test_whole_signal_window():
+    magnitude = make_magnitude(n=101)
+    fitted = sliding_polynomial_fit(magnitude, 101, 3)
+    offsets = np.arange(101)
+    assert np.allclose(fitted, np.polyval(np.polyfit(offsets, magnitude, 3), offsets), atol=1e-9)
+
+
+@pytest.mark.parametrize("window, order", [(4, 2), (3, 3), (5001, 2)])
+def test_invalid_windows(window, order):
+    with pytest.raises(Exception):
+        sliding_polynomial_fit(make_magnitude(), window, order)
+
+
+def test_window_length():
+    assert get_window_length(1000, 10, 3) == 99
+    assert get_window_length(1000, 1000, 3) == 5
+    assert get_window_length(100, 1, 3) == 99
@@ -0,0 +1,91 @@
+from copy import copy
+import numpy as np
+import pytest
+from modules.signals import Signal
+from modules.curvefit import SignalProcessor
+from modules.chunkfit import nested_polynomial_fits
+from modules import sweep
+
+
+def make_processor(interpolation_type="polynomial"):
+    rng = np.random.default_rng(1)
+    time = np.arange(3000) / 250
+    magnitude = 5 + np.sin(2 * time) + 0.3 * np.sin(11 * time) + 0.05 * rng.normal(size=len(time))
+    processor = SignalProcessor(Signal(magnitude=magnitude, fsample=250))
+    processor.interpolation_type = interpolation_type
+    processor.interpolation_order = 3
+    return processor
+
+
+def refit_error(processor, parameters):
+    """Range error of one cell, fitted the way the GUI fits"""
+    cell = copy(processor)
+    for name, value in parameters.items():
+        setattr(cell, sweep.PARAMETERS[name], value)
+    cell.interpolate()
+    return cell.range_error()
+
+
+@pytest.mark.parametrize("overlap", [0, 20])
+def test_sweep_matches_refits(overlap):
+    processor = make_processor()
+    processor.overlap_percent = overlap
+    axes = [sweep.SweepAxis("order", values=[1, 2, 3]),
+            sweep.SweepAxis("chunks", values=[1, 4, 25])]
+    errors = sweep.run_sweep(processor, axes)
+    for i, order in enumerate(axes[0].values):
+        for j, chunks in enumerate(axes[1].values):
+            expected = refit_error(processor, {"order": order, "chunks": chunks})
+            assert errors[i, j] == pytest.approx(expected, rel=1e-6)
+
+
+@pytest.mark.filterwarnings("ignore::numpy.RankWarning")
+@pytest.mark.parametrize("overlap", [0, 20])
+def test_high_orders_at_least_as_good_as_polyfit(overlap):
+    # np.polyfit is poorly conditioned at high orders on offset chunks, the
+    # sweep's QR fits are the exact least squares solution
+    processor = make_processor()
+    processor.overlap_percent = overlap
+    axes = [sweep.SweepAxis("order", values=[6, 8, 9]),
+            sweep.SweepAxis("chunks", values=[1, 4, 25])]
+    errors = sweep.run_sweep(processor, axes)
+    for i, order in enumerate(axes[0].values):
+        for j, chunks in enumerate(axes[1].values):
+            expected = refit_error(processor, {"order": order, "chunks": chunks})
+            assert errors[i, j] <= expected * (1 + 1e-6)
+
+
+def test_sweep_spline_cells():
+    processor = make_processor("spline")
+    axes = [sweep.SweepAxis("smoothing", values=[0, 0.01]),
+            sweep.SweepAxis("chunks", values=[2, 5])]
+    errors = sweep.run_sweep(processor, axes)
+    for i, smoothing in enumerate(axes[0].values):
+        for j, chunks in enumerate(axes[1].values):
+            expected = refit_error(processor, {"smoothing": smoothing, "chunks": chunks})
+            assert errors[i, j] == pytest.approx(expected, rel=1e-9)
+
+
+def test_sweep_leaves_processor_untouched():
+    processor = make_processor()
+    before = sweep.get_parameters(processor)
+    sweep.run_sweep(processor, [sweep.SweepAxis("chunks", values=[2, 3])])
+    assert sweep.get_parameters(processor) == before
+
+
+def test_nested_fits_match_polyfit():
+    rng = np.random.default_rng(2)
+    time = np.sort(rng.uniform(0, 3, 200))
+    magnitude = np.column_stack([np.exp(time), np.cos(3 * time)])
+    fits = nested_polynomial_fits(time, magnitude, 6)
+    for order in range(7):
+        for channel in range(2):
+            expected = np.polyval(np.polyfit(time, magnitude[:, channel], order), time)
+            assert np.allclose(fits[order][:, channel], expected, atol=1e-9)
+
+
+def test_integer_axes_are_rounded_and_unique():
+    axis = sweep.SweepAxis("chunks", 1, 10, num=25)
+    assert np.array_equal(axis.values, np.arange(1, 11))
+    with pytest.raises(Exception):
+        sweep.SweepAxis("colour")